@@ -70,9 +70,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Sin conexiones persistentes: bajo ASGI las que abren los hilos de
+        # sync_to_async fuera de un request nunca se cierran
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Espera el lock en vez de fallar enseguida
+            'timeout': 20,
+            # La transacción toma el lock de escritura al empezar: sin esto
+            # dos transacciones que leen y después escriben se bloquean
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# SQLite en producción (ver keno/basedatos.py)
+KENO_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,        # negativo: KiB (64 MB)
+    'mmap_size': 268435456,      # 256 MB
+    'temp_store': 'MEMORY',
+}
+# Un solo hilo escribe lo que mandan los consumidores; con PostgreSQL no hace falta
+KENO_COLA_ESCRITURA = DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+
+# Diario de liquidaciones: las rondas se anotan aquí antes de llegar a la
+# base (ver keno/diario.py). Debe ser un disco local y persistente.
+KENO_DIARIO_DIR = os.environ.get('KENO_DIARIO_DIR', BASE_DIR / 'diario')
+
+# /metrics: solo staff, o quien mande Authorization: Bearer <token>
+KENO_METRICS_TOKEN = os.environ.get('KENO_METRICS_TOKEN', '')
+
 # Para producción con PostgreSQL (opcional)
 # DATABASES = {
 #     'default': {
@@ -129,6 +158,20 @@ else:
         },
     }
 
+# Estado compartido del juego (rondas, boletos, reloj de sala)
+# Con varios workers en el mismo host usar KENO_ESTADO_BACKEND=sqlite
+if os.environ.get('KENO_ESTADO_BACKEND') == 'sqlite':
+    KENO_ESTADO = {
+        'BACKEND': 'keno.estado.SQLiteBackend',
+        'OPTIONS': {
+            'ruta': os.environ.get('KENO_ESTADO_PATH', BASE_DIR / 'estado.sqlite3'),
+        },
+    }
+else:
+    KENO_ESTADO = {
+        'BACKEND': 'keno.estado.MemoriaBackend',
+    }
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Autenticación
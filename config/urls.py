@@ -11,4 +11,11 @@ urlpatterns = [
     path('inicio/', views.inicio, name='inicio'),
     path('sala/', views.sala, name='sala'),
     path('ranking/', views.ranking, name='ranking'),
+    path('probabilidades/<str:version>/', views.probabilidades, name='probabilidades'),
+    path('estadisticas/', views.estadisticas, name='estadisticas'),
+    path('historial/jugador/<str:nickname>/', views.historial_jugador, name='historial_jugador'),
+    path('historial/jugador/<str:nickname>/exportar/', views.exportar_jugador, name='exportar_jugador'),
+    path('historial/sala/<int:sala_id>/', views.historial_sala, name='historial_sala'),
+    path('historial/sala/<int:sala_id>/exportar/', views.exportar_sala, name='exportar_sala'),
+    path('metrics', views.metricas, name='metricas'),
 ]
\ No newline at end of file
@@ -1,3 +1,14 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import TablaPagos
+
+
+@admin.register(TablaPagos)
+class TablaPagosAdmin(admin.ModelAdmin):
+    list_display = ('version', 'predeterminada', 'fecha_creacion')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Una tabla ya creada no se edita: se publica una version nueva
+        if obj is not None:
+            return ('version', 'pagos')
+        return ()
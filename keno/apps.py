@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class KenoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'keno'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+
+        from .basedatos import configurar_sqlite
+        from .metricas import instalar_en_conexion
+        from .ranking import invalidar_ranking
+
+        # Cuenta las consultas ORM por mensaje de WebSocket (ver metricas.py)
+        connection_created.connect(instalar_en_conexion, dispatch_uid='keno_metricas')
+        # WAL y PRAGMAs de producción en cada conexión nueva (ver basedatos.py)
+        connection_created.connect(configurar_sqlite, dispatch_uid='keno_sqlite')
+        # El ranking en memoria no ve cambios de puntos hechos con save()
+        post_save.connect(invalidar_ranking, sender='keno.Jugador', dispatch_uid='keno_ranking')
+        post_delete.connect(invalidar_ranking, sender='keno.Jugador', dispatch_uid='keno_ranking_borrar')
@@ -0,0 +1,167 @@
+import asyncio
+import contextvars
+import os
+import queue
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .metricas import espera_escritura, lote_escritura, registrar_error
+
+# ============================================================
+#   SQLITE EN PRODUCCION
+# ============================================================
+#
+# SQLite admite un solo escritor a la vez. Con el journal por defecto un
+# escritor además bloquea a los lectores, y varios hilos escribiendo a la
+# vez terminan en "database is locked". Tres piezas:
+#
+#   - PRAGMAs por conexión (settings.KENO_SQLITE_PRAGMAS) con el hook
+#     connection_created: WAL (los lectores no esperan al escritor),
+#     synchronous=NORMAL (fsync en los checkpoints, no en cada commit),
+#     cache y mmap más grandes. Con CONN_MAX_AGE=0 (Django desaconseja
+#     conexiones persistentes bajo ASGI) se aplican en cada conexión
+#     nueva; son baratos y journal_mode=WAL queda guardado en el archivo.
+#
+#   - ColaEscritura: las escrituras de los consumidores las ejecuta un solo
+#     hilo. Lo que se acumula mientras escribe va en la misma transacción
+#     (un commit por lote); cada trabajo corre en su propio savepoint, así
+#     que si uno falla solo se deshace lo suyo y el error le llega a quien
+#     lo encoló. Las FK de SQLite son diferidas y se comprueban recién en
+#     el COMMIT: si el commit del lote falla, los trabajos se repiten de a
+#     uno, cada uno en su transacción, y solo el culpable recibe el error.
+#
+#   - Las lecturas no pasan por la cola: con WAL corren en paralelo.
+#
+# Con otra base (KENO_COLA_ESCRITURA=False) la cola no se usa y cada
+# escritura va por database_sync_to_async como antes.
+#
+# Los comandos de medición (bench_repositorio, load_test) usan
+# base_descartable(): la base de prueba en memoria de Django es de caché
+# compartida, bloquea por tabla y no tiene WAL, así que el hilo escritor
+# y las lecturas del executor chocan ("database table is locked").
+
+MAX_LOTE = 64
+
+
+def configurar_sqlite(sender, connection, **kwargs):
+    # Receptor de connection_created (ver apps.py)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, valor in settings.KENO_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={valor}')
+
+
+def _resolver(futuro, resultado, error):
+    # Quien encoló pudo haberse cancelado (el cliente se desconectó)
+    if futuro.done():
+        return
+    if error is not None:
+        futuro.set_exception(error)
+    else:
+        futuro.set_result(resultado)
+
+
+class ColaEscritura:
+
+    def __init__(self):
+        self._cola = queue.SimpleQueue()
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    async def ejecutar(self, funcion, *args):
+        if not settings.KENO_COLA_ESCRITURA:
+            return await database_sync_to_async(funcion)(*args)
+
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._arrancar()
+        # El contexto viaja con el trabajo: las consultas se siguen contando
+        # en el mensaje que las originó (ver metricas.py)
+        self._cola.put((funcion, args, contextvars.copy_context(), loop, futuro, time.perf_counter()))
+        return await futuro
+
+    def _arrancar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._escribir, name='keno-escritor', daemon=True)
+                self._hilo.start()
+
+    def _tomar_lote(self):
+        lote = [self._cola.get()]
+        while len(lote) < MAX_LOTE:
+            try:
+                lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _ejecutar(self, lote):
+        resultados = []
+        with transaction.atomic():
+            for funcion, args, contexto, *_ in lote:
+                try:
+                    with transaction.atomic():
+                        resultados.append((contexto.run(funcion, *args), None))
+                except Exception as e:
+                    resultados.append((None, e))
+        return resultados
+
+    def _ejecutar_solo(self, trabajo):
+        try:
+            return self._ejecutar([trabajo])[0]
+        except Exception as e:
+            registrar_error('cola_escritura', 'Error confirmando escritura')
+            return None, e
+
+    def _escribir(self):
+        while True:
+            lote = self._tomar_lote()
+            # Igual que database_sync_to_async: respeta CONN_MAX_AGE y
+            # descarta conexiones rotas
+            close_old_connections()
+
+            try:
+                resultados = self._ejecutar(lote)
+            except Exception as e:
+                # Falló el commit: no quedó escrito ningún trabajo del lote
+                if len(lote) == 1:
+                    registrar_error('cola_escritura', 'Error confirmando escritura')
+                    resultados = [(None, e)]
+                else:
+                    resultados = [self._ejecutar_solo(trabajo) for trabajo in lote]
+
+            lote_escritura.observar(len(lote))
+            fin = time.perf_counter()
+            for (_, _, _, loop, futuro, encolado), (resultado, error) in zip(lote, resultados):
+                espera_escritura.observar(fin - encolado)
+                try:
+                    loop.call_soon_threadsafe(_resolver, futuro, resultado, error)
+                except RuntimeError:
+                    # El loop de quien lo encoló ya cerró
+                    pass
+
+
+cola_escritura = ColaEscritura()
+
+
+@contextmanager
+def base_descartable():
+    # Base de prueba en un archivo temporal, con los PRAGMAs de producción
+    prueba = connection.settings_dict.setdefault('TEST', {})
+    anterior = prueba.get('NAME')
+    with tempfile.TemporaryDirectory() as directorio:
+        if connection.vendor == 'sqlite':
+            prueba['NAME'] = os.path.join(directorio, 'descartable.sqlite3')
+        nombre_original = connection.creation.create_test_db(verbosity=0, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            prueba['NAME'] = anterior
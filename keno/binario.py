@@ -0,0 +1,82 @@
+import struct
+
+from .liquidacion import NUMERO_MAX, mascara_a_numeros, numeros_a_mascara
+
+# ============================================================
+#   SUBPROTOCOLO BINARIO (keno.bin.v1)
+# ============================================================
+#
+# Opcional: el cliente lo pide en el handshake (Sec-WebSocket-Protocol).
+# Solo boletos y resultados viajan en binario; el resto sigue en JSON.
+# Un conjunto de números es una máscara de 80 bits en 10 bytes
+# little-endian (bit n-1 → número n).
+#
+# Cliente → servidor, boleto:
+#   u8 0x01 | u8 largo nickname | nickname utf-8 | máscara (10 bytes)
+#
+# Servidor → cliente, sorteo_completado:
+#   u8 0x02 | 20 x u8 números ganadores (en orden de salida) | u16 registros
+#   por registro: u8 largo nickname | nickname utf-8 | u8 aciertos |
+#                 u32 puntos | máscara de números elegidos (10 bytes)
+#   al final (opcional): semilla revelada (32 bytes) |
+#                        compromiso del siguiente sorteo (sha256, 32 bytes)
+#   al final (opcional): u32 secuencia del evento en la sala
+#
+# Si un valor no cabe (más de 65535 registros, puntos fuera de u32),
+# codificar_sorteo devuelve None y el resultado sale en JSON.
+
+SUBPROTOCOLO = 'keno.bin.v1'
+
+BOLETO = 0x01
+SORTEO_COMPLETADO = 0x02
+
+BYTES_MASCARA = NUMERO_MAX // 8
+
+_REGISTRO = struct.Struct('<BI')   # aciertos, puntos
+
+
+class FrameInvalido(ValueError):
+    pass
+
+
+def _nickname(texto):
+    datos = (texto or '').encode('utf-8')[:255]
+    return bytes((len(datos),)) + datos
+
+
+def mascara_a_bytes(mascara):
+    return mascara.to_bytes(BYTES_MASCARA, 'little')
+
+
+def decodificar_boleto(frame):
+    # Devuelve (nickname, numeros) para pasarlo a parsear_boleto
+    if len(frame) < 2 or frame[0] != BOLETO:
+        raise FrameInvalido('Frame de boleto invalido')
+    largo = frame[1]
+    fin = 2 + largo
+    if len(frame) != fin + BYTES_MASCARA:
+        raise FrameInvalido('Frame de boleto invalido')
+    nickname = frame[2:fin].decode('utf-8', errors='replace')
+    mascara = int.from_bytes(frame[fin:], 'little')
+    return nickname, mascara_a_numeros(mascara)
+
+
+def codificar_sorteo(numeros_ganadores, resultados, semilla=None, siguiente_compromiso=None, seq=None):
+    try:
+        partes = [
+            bytes((SORTEO_COMPLETADO,)),
+            bytes(numeros_ganadores),
+            struct.pack('<H', len(resultados)),
+        ]
+        for resultado in resultados:
+            partes.append(_nickname(resultado['nickname']))
+            partes.append(_REGISTRO.pack(resultado['aciertos'], resultado['puntos']))
+            partes.append(mascara_a_bytes(numeros_a_mascara(resultado['numeros'])))
+    except struct.error:
+        return None
+    if semilla is not None:
+        partes.append(semilla)
+        partes.append(bytes.fromhex(siguiente_compromiso))
+    if seq is not None:
+        partes.append(struct.pack('<I', seq))
+    return b''.join(partes)
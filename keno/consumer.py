@@ -1,18 +1,130 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+import asyncio
 import json
-import random
+import math
+import secrets
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from django.utils import timezone
+
+from . import repositorio
+from .binario import SUBPROTOCOLO, FrameInvalido, codificar_sorteo, decodificar_boleto
+from .diario import diario
+from .difusion import codificar, difundir, enviar_evento
+from .estado import obtener_store
+from .flujo import ConsumidorRegulado
+from .liquidacion import Boleto, BoletoInvalido, liquidar_ronda, parsear_boleto
+from .metricas import ConsumidorMedido, registrar_error
+from .presencia import Presencia, difusor
+from .sorteo import Sorteo, pool
 
 # ============================================================
 #   CONSUMIDOR DE SALA (MANEJO DE TIEMPO Y JUGADORES)
 # ============================================================
 
-class SalaConsumer(AsyncWebsocketConsumer):
-    tiempo_compartido = {}
-    
+DURACION_LOBBY = 120   # segundos de espera antes de pasar al juego
+INTERVALO_SYNC = 5     # cada cuanto el servidor reenvía el reloj
+# Turno de emisión: con varios workers solo uno difunde el reloj de cada
+# sala. Si el dueño deja de renovarlo (murió), otro lo toma al vencer.
+DURACION_TURNO = 2 * INTERVALO_SYNC + 1
+EMISOR = uuid.uuid4().hex   # este proceso
+
+
+def estado_cuenta(cuenta):
+    # cuenta: {'deadline', 'conexiones'} tal como está en el store
+    if cuenta is None:
+        return {'tiempo': 0}
+    ahora = time.time()
+    return {
+        'tiempo': math.ceil(max(0.0, cuenta['deadline'] - ahora)),
+        'deadline': int(cuenta['deadline'] * 1000),
+        'ahora': int(ahora * 1000)
+    }
+
+
+class CuentaRegresiva:
+    # Tarea local que difunde el reloj de una sala mientras este worker
+    # tenga el turno. El deadline, el total de conexiones y el turno viven
+    # en el store, compartidos entre workers.
+    __slots__ = ('conexiones', 'tarea')
+
+    def __init__(self):
+        self.conexiones = 0
+        self.tarea = None
+
+
+async def tomar_turno(store, clave):
+    # Toma o renueva el turno de emisión; False si otro worker lo tiene vigente
+    ahora = time.time()
+    turno, version = await store.get(clave)
+    if turno is not None and turno['emisor'] != EMISOR and turno['vence'] > ahora:
+        return False
+    return await store.cas(clave, version, {'emisor': EMISOR, 'vence': ahora + DURACION_TURNO})
+
+
+async def soltar_turno(store, clave):
+    turno, version = await store.get(clave)
+    if turno is not None and turno['emisor'] == EMISOR:
+        await store.cas(clave, version, None)
+
+
+async def emitir_cuenta(store, clave, room_group_name):
+    # Una sola tarea por sala y worker, y un solo worker con el turno:
+    # difunde el reloj con baja frecuencia y los clientes interpolan entre
+    # mensajes usando el deadline.
+    channel_layer = get_channel_layer()
+    clave_turno = clave + ':emisor'
+    try:
+        while True:
+            cuenta, _ = await store.get(clave)
+            if cuenta is None:
+                return
+            if await tomar_turno(store, clave_turno):
+                await difundir(channel_layer, room_group_name, 'timer_sync', **estado_cuenta(cuenta))
+            restante = cuenta['deadline'] - time.time()
+            if restante <= 0:
+                return
+            await asyncio.sleep(min(INTERVALO_SYNC, restante))
+    finally:
+        await soltar_turno(store, clave_turno)
+
+
+class ConsumidorConStore:
+    # as_asgi(store=...) elige el store; AsyncWebsocketConsumer ignora los
+    # argumentos del constructor, así que se toman aquí
+    store = None   # EstadoStore; por defecto el configurado en KENO_ESTADO
+
+    def __init__(self, *args, store=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if store is not None:
+            self.store = store
+
+
+class SalaConsumer(ConsumidorConStore, ConsumidorMedido, ConsumidorRegulado, AsyncWebsocketConsumer):
+    tipos_cliente = frozenset({'player_joined', 'pedir_snapshot'})
+    # Cada pedido devuelve el snapshot completo de la sala
+    limites = {
+        'player_joined': (3, 0.2),
+        'pedir_snapshot': (3, 0.5),
+    }
+    cuentas = {}   # sala_id → CuentaRegresiva (tareas de este worker)
+
     async def connect(self):
         self.sala_id = self.scope['url_route']['kwargs']['sala_id']
         self.room_group_name = f'sala_{self.sala_id}'
+        self.clave_cuenta = f'sala:{self.sala_id}:cuenta'
+        if self.store is None:
+            self.store = obtener_store()
+        self.presencia = None
+
+        # Sin sala no hay roster que escribir: se rechaza el handshake
+        if not await repositorio.sala_existe(self.sala_id):
+            await self.close()
+            return
+        self.presencia = Presencia(self.store, self.sala_id)
         
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -21,22 +133,72 @@ class SalaConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
-        # Inicializar tiempo por sala
-        if self.sala_id not in SalaConsumer.tiempo_compartido:
-            SalaConsumer.tiempo_compartido[self.sala_id] = 120
+        cuenta = await self.iniciar_cuenta()
+
+        await self.presencia.sembrar()
+        user = self.scope.get("user")
+        if user is not None and user.is_authenticated:
+            if await self.presencia.entrar(self.channel_name, user):
+                difusor.cambio(self.presencia, self.room_group_name, user.username, True)
         
-        players = await self.get_players_in_sala()
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'sala_update',
-                'players': players,
-                'tiempo': SalaConsumer.tiempo_compartido[self.sala_id]
-            }
-        )
+        await self.enviar_snapshot(estado_cuenta(cuenta))
+
+    async def enviar_snapshot(self, cuenta):
+        # Estado completo solo para este cliente; el resto recibe deltas
+        await self.send(text_data=json.dumps({
+            'type': 'sala_snapshot',
+            **(await self.presencia.snapshot()),
+            **cuenta
+        }))
+
+    async def iniciar_cuenta(self):
+        ahora = time.time()
+
+        def entrar(cuenta):
+            # Primera conexión (o la cuenta anterior ya terminó): reloj nuevo
+            if cuenta is None:
+                return {'deadline': ahora + DURACION_LOBBY, 'conexiones': 1}
+            deadline = cuenta['deadline']
+            if deadline <= ahora:
+                deadline = ahora + DURACION_LOBBY
+            return {'deadline': deadline, 'conexiones': cuenta['conexiones'] + 1}
+
+        cuenta = await self.store.actualizar(self.clave_cuenta, entrar)
+
+        local = SalaConsumer.cuentas.get(self.sala_id)
+        if local is None:
+            local = SalaConsumer.cuentas[self.sala_id] = CuentaRegresiva()
+        local.conexiones += 1
+        if local.tarea is None or local.tarea.done():
+            local.tarea = asyncio.create_task(
+                emitir_cuenta(self.store, self.clave_cuenta, self.room_group_name)
+            )
+
+        return cuenta
+
+    async def liberar_cuenta(self):
+        local = SalaConsumer.cuentas.get(self.sala_id)
+        if local is not None:
+            local.conexiones -= 1
+            if local.conexiones <= 0:
+                local.tarea.cancel()
+                del SalaConsumer.cuentas[self.sala_id]
+
+        def salir(cuenta):
+            if cuenta is None or cuenta['conexiones'] <= 1:
+                return None
+            return {'deadline': cuenta['deadline'], 'conexiones': cuenta['conexiones'] - 1}
+
+        await self.store.actualizar(self.clave_cuenta, salir)
+
+    async def cuenta_actual(self):
+        cuenta, _ = await self.store.get(self.clave_cuenta)
+        return estado_cuenta(cuenta)
     
     async def disconnect(self, close_code):
-        from .models import Sala, Jugador
+        if self.presencia is None:
+            return
+        await self.liberar_cuenta()
 
         try:
             user = self.scope["user"]
@@ -45,173 +207,421 @@ class SalaConsumer(AsyncWebsocketConsumer):
             if not user.is_authenticated:
                 await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
                 return
-            
-            # Obtener sala
-            sala = await database_sync_to_async(Sala.objects.get)(id=self.sala_id)
-
-            # Obtener jugador
-            jugador = await database_sync_to_async(Jugador.objects.get)(user=user)
-
-            # Remover jugador de la sala
-            await database_sync_to_async(sala.jugadores.remove)(jugador)
-
-            # Lista actualizada
-            players = await self.get_players_in_sala()
-
-            # Avisar a todos
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'sala_update',
-                    'players': players,
-                    'tiempo': SalaConsumer.tiempo_compartido.get(self.sala_id, 20)
-                }
-            )
 
-            # Si la sala queda vacía → desactivarla
-            if len(players) == 0:
-                sala.activa = False
-                await database_sync_to_async(sala.save)()
+            # Sacarlo del roster (la base se actualiza en lote) y avisar
+            if await self.presencia.salir(self.channel_name, user):
+                difusor.cambio(self.presencia, self.room_group_name, user.username, False)
 
-        except Exception as e:
-            print("Error al desconectar jugador:", e)
+        except Exception:
+            registrar_error('sala_desconectar', 'Error al desconectar jugador')
 
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
     
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def recibir(self, data):
+        # JSON ya parseado por ConsumidorRegulado (ver flujo.py)
         message_type = data.get('type')
         
-        if message_type == 'player_joined':
-            players = await self.get_players_in_sala()
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'sala_update',
-                    'players': players,
-                    'tiempo': SalaConsumer.tiempo_compartido.get(self.sala_id, 20)
-                }
-            )
-        
-        elif message_type == 'timer_update':
-            tiempo = data.get('tiempo', 20)
-            SalaConsumer.tiempo_compartido[self.sala_id] = tiempo
-            
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'timer_sync',
-                    'tiempo': tiempo
-                }
-            )
+        # El cliente pide el roster completo al entrar o si detecta un
+        # hueco en la secuencia de deltas
+        if message_type in ('player_joined', 'pedir_snapshot'):
+            await self.enviar_snapshot(await self.cuenta_actual())
     
-    async def sala_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'sala_update',
-            'players': event['players'],
-            'tiempo': event.get('tiempo', 20)
-        }))
+    # Los frames de grupo llegan ya codificados (ver difusion.py)
+    async def sala_delta(self, event):
+        await self.send(text_data=event['texto'])
     
     async def timer_sync(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'timer_sync',
-            'tiempo': event['tiempo']
-        }))
-    
-    @database_sync_to_async
-    def get_players_in_sala(self):
-        from .models import Sala
-        try:
-            sala = Sala.objects.get(id=self.sala_id)
-            return [jugador.nickname for jugador in sala.jugadores.all().distinct()]
-        except:
-            return []
+        # Un reloj viejo no sirve: se reemplaza si el cliente va atrasado
+        await self.enviar_estado('timer_sync', event['texto'])
 
 
 # ============================================================
 #   CONSUMIDOR DEL JUEGO KENO
 # ============================================================
-
-class GameConsumer(AsyncWebsocketConsumer):
+#
+# Sesiones reanudables: cada conexión recibe un token de sesión y el
+# boleto se guarda a nombre de la sesión, no del canal. Si el socket se
+# cae (cualquier cierre que no sea el normal, 1000) la sesión y su boleto
+# se conservan GRACIA_RECONEXION segundos; el cliente vuelve con
+# ?sesion=<token>&desde=<seq> y recibe solo los eventos numerados que se
+# perdió, desde un buffer circular por sala. Si el buffer ya no los tiene
+# recibe el estado actual de las confirmaciones.
+#
+# Al suspender, la sesión se anota en un mapa de suspendidas. El timer de
+# vencer_sesion es solo el camino rápido: conteo, boletos y abrir_sesion
+# cierran antes las suspendidas ya vencidas, así un worker caído no deja
+# boletos fantasma en la sala.
+
+GRACIA_RECONEXION = 30   # segundos que se guarda el boleto de quien se cayó
+TAMANO_BUFFER = 32       # eventos recientes por sala
+CIERRE_NORMAL = 1000
+# Eventos de estado: el último reemplaza a los anteriores en el buffer
+REEMPLAZABLES = frozenset({'estado_confirmaciones'})
+
+
+class EstadoJuego:
+    # Estado de una sala en el store compartido:
+    #   juego:<sala>:ronda                   → numero de ronda (CAS)
+    #   juego:<sala>:sesiones                → sesiones vivas, conectadas o en gracia (CAS)
+    #   juego:<sala>:sesion:<token>          → {'canal', 'usuario', 'vence'} (CAS)
+    #   juego:<sala>:suspendidas             → token → vence, sesiones en gracia
+    #   juego:<sala>:boletos                 → token de sesión → boleto
+    #   juego:<sala>:ronda:<n>:confirmados   → nickname → 1
+    #   juego:<sala>:sorteo                  → próximo sorteo (semilla aún secreta)
+    #   juego:<sala>:eventos                 → {'seq', 'base', 'eventos'} (CAS)
+    __slots__ = ('store', 'prefijo')
+
+    def __init__(self, store, sala_id):
+        self.store = store
+        self.prefijo = f'juego:{sala_id}:'
+
+    @property
+    def mapa_boletos(self):
+        return self.prefijo + 'boletos'
+
+    def mapa_confirmados(self, ronda):
+        return f'{self.prefijo}ronda:{ronda}:confirmados'
+
+    @property
+    def mapa_suspendidas(self):
+        return self.prefijo + 'suspendidas'
+
+    def clave_sesion(self, token):
+        return f'{self.prefijo}sesion:{token}'
+
+    async def ronda(self):
+        valor, _ = await self.store.get(self.prefijo + 'ronda')
+        return valor or 0
+
+    # ----------------------------------------------------
+    #   SESIONES
+    # ----------------------------------------------------
+
+    async def abrir_sesion(self, channel_name, usuario):
+        await self.vencer_suspendidas()
+        sesion = {'canal': channel_name, 'usuario': usuario, 'vence': None}
+        token = secrets.token_urlsafe(16)
+        while not await self.store.cas(self.clave_sesion(token), 0, sesion):
+            token = secrets.token_urlsafe(16)
+        await self.store.actualizar(self.prefijo + 'sesiones', lambda n: (n or 0) + 1)
+        return token
+
+    async def reanudar(self, token, channel_name, usuario):
+        # La sesión pasa a este canal; también si el socket viejo todavía
+        # no se dio por cerrado
+        clave = self.clave_sesion(token)
+        while True:
+            sesion, version = await self.store.get(clave)
+            if sesion is None or sesion['usuario'] != usuario:
+                return False
+            if await self.store.cas(clave, version, {**sesion, 'canal': channel_name, 'vence': None}):
+                await self.store.hdel(self.mapa_suspendidas, token)
+                return True
+
+    async def boleto(self, token):
+        boleto = await self.store.hget(self.mapa_boletos, token)
+        if boleto is None:
+            return None
+        return Boleto.desde_mascara(boleto['nickname'], boleto['mascara'])
+
+    async def suspender(self, token, channel_name):
+        # Empieza el período de gracia; False si otra conexión ya la tomó
+        clave = self.clave_sesion(token)
+        while True:
+            sesion, version = await self.store.get(clave)
+            if sesion is None or sesion['canal'] != channel_name:
+                return False
+            vence = time.time() + GRACIA_RECONEXION
+            if await self.store.cas(clave, version, {**sesion, 'canal': None, 'vence': vence}):
+                await self.store.hset(self.mapa_suspendidas, token, vence)
+                return True
+
+    async def cerrar_sesion(self, token, channel_name=None):
+        # Con channel_name: cierre normal de esa conexión. Sin él: solo si la
+        # sesión sigue suspendida y ya venció. Devuelve True si se cerró.
+        clave = self.clave_sesion(token)
+        while True:
+            sesion, version = await self.store.get(clave)
+            if sesion is None:
+                await self.store.hdel(self.mapa_suspendidas, token)
+                return False
+            if channel_name is not None and sesion['canal'] != channel_name:
+                return False
+            if channel_name is None and (sesion['canal'] is not None or sesion['vence'] > time.time()):
+                return False
+            if await self.store.cas(clave, version, None):
+                break
+
+        await self.store.hdel(self.mapa_suspendidas, token)
+        boleto = await self.store.hget(self.mapa_boletos, token)
+        if boleto is not None:
+            await self.store.hdel(self.mapa_boletos, token)
+            await self.store.hdel(self.mapa_confirmados(await self.ronda()), boleto['nickname'])
+
+        restantes = await self.store.actualizar(
+            self.prefijo + 'sesiones',
+            lambda n: (n or 1) - 1 or None
+        )
+        if restantes is None:
+            await self.store.borrar(self.prefijo)
+        return True
+
+    async def vencer_suspendidas(self):
+        # Sesiones en gracia cuyo timer se perdió (worker reiniciado)
+        ahora = time.time()
+        suspendidas = await self.store.hgetall(self.mapa_suspendidas)
+        for token, vence in suspendidas.items():
+            if vence <= ahora:
+                await self.cerrar_sesion(token)
+
+    # ----------------------------------------------------
+    #   EVENTOS NUMERADOS
+    # ----------------------------------------------------
+
+    async def registrar_evento(self, tipo, payload):
+        # Numera el evento y lo guarda en el buffer; devuelve (seq, texto).
+        # base: último seq que salió del buffer por tamaño
+        def agregar(buffer):
+            buffer = buffer or {'seq': 0, 'base': 0, 'eventos': []}
+            seq = buffer['seq'] + 1
+            eventos = [
+                evento for evento in buffer['eventos']
+                if not (tipo in REEMPLAZABLES and evento[1] == tipo)
+            ]
+            eventos.append([seq, tipo, codificar(tipo, {**payload, 'seq': seq})])
+            base = buffer['base']
+            if len(eventos) > TAMANO_BUFFER:
+                base = eventos[-TAMANO_BUFFER - 1][0]
+                eventos = eventos[-TAMANO_BUFFER:]
+            return {'seq': seq, 'base': base, 'eventos': eventos}
+
+        buffer = await self.store.actualizar(self.prefijo + 'eventos', agregar)
+        seq, _, texto = buffer['eventos'][-1]
+        return seq, texto
+
+    async def eventos_desde(self, desde):
+        # (seq actual, textos posteriores a desde, hay hueco)
+        buffer, _ = await self.store.get(self.prefijo + 'eventos')
+        seq = buffer['seq'] if buffer else 0
+        if desde is None or buffer is None:
+            return seq, [], desde is not None and desde != seq
+        textos = [texto for numero, _, texto in buffer['eventos'] if numero > desde]
+        return seq, textos, desde < buffer['base'] or desde > seq
+
+    async def confirmar(self, token, boleto):
+        ronda = await self.ronda()
+        await self.store.hset(self.mapa_boletos, token, {
+            'nickname': boleto.nickname,
+            'mascara': boleto.mascara
+        })
+        await self.store.hset(self.mapa_confirmados(ronda), boleto.nickname, 1)
+        return await self.conteo(ronda)
+
+    async def conteo(self, ronda):
+        await self.vencer_suspendidas()
+        total = await self.store.hlen(self.mapa_boletos)
+        confirmados = await self.store.hlen(self.mapa_confirmados(ronda))
+        return total, confirmados
+
+    async def reclamar_ronda(self, ronda):
+        # Solo un consumidor (de cualquier worker) gana el CAS y sortea
+        clave = self.prefijo + 'ronda'
+        valor, version = await self.store.get(clave)
+        if (valor or 0) != ronda:
+            return False
+        if not await self.store.cas(clave, version, ronda + 1):
+            return False
+        await self.store.borrar(f'{self.prefijo}ronda:{ronda}:')
+        return True
+
+    async def compromiso(self):
+        # Reserva el próximo sorteo de la sala (si no hay) y devuelve su
+        # compromiso, que se publica antes de que se confirmen boletos
+        clave = self.prefijo + 'sorteo'
+        while True:
+            valor, _ = await self.store.get(clave)
+            if valor is not None:
+                return valor['compromiso']
+            nuevo = pool.tomar().como_dict()
+            if await self.store.cas(clave, 0, nuevo):
+                return nuevo['compromiso']
+
+    async def revelar(self):
+        # Solo lo llama quien ganó reclamar_ronda: saca el sorteo comprometido
+        # y deja reservado el de la ronda siguiente
+        clave = self.prefijo + 'sorteo'
+        siguiente = pool.tomar()
+        while True:
+            valor, version = await self.store.get(clave)
+            if await self.store.cas(clave, version, siguiente.como_dict()):
+                actual = Sorteo.desde_dict(valor) if valor is not None else pool.tomar()
+                return actual, siguiente
+
+    async def boletos(self):
+        await self.vencer_suspendidas()
+        boletos = await self.store.hgetall(self.mapa_boletos)
+        return [
+            Boleto.desde_mascara(boleto['nickname'], boleto['mascara'])
+            for boleto in boletos.values()
+        ]
+
+
+async def difundir_evento(estado, group_name, tipo, payload, binario=None):
+    # Evento numerado: queda en el buffer de la sala para quien reanude.
+    # binario: seq → frame para clientes con subprotocolo binario
+    seq, texto = await estado.registrar_evento(tipo, payload)
+    evento = {'type': tipo, 'texto': texto, 'seq': seq}
+    if binario is not None:
+        evento['binario'] = binario(seq)
+    await enviar_evento(get_channel_layer(), group_name, evento)
+
+
+def confirmaciones(total, confirmados):
+    return {
+        'confirmados': confirmados,
+        'total': total,
+        'todos_listos': confirmados == total and total > 0
+    }
+
+
+async def anunciar_confirmaciones(estado, group_name, total, confirmados):
+    await difundir_evento(estado, group_name, 'estado_confirmaciones', confirmaciones(total, confirmados))
+
+
+async def vencer_sesion(estado, group_name, token):
+    # Si nadie reanudó la sesión en el período de gracia, su boleto sale
+    # de la ronda y los demás ven el nuevo conteo
+    await asyncio.sleep(GRACIA_RECONEXION)
+    try:
+        if await estado.cerrar_sesion(token):
+            total, confirmados = await estado.conteo(await estado.ronda())
+            await anunciar_confirmaciones(estado, group_name, total, confirmados)
+    except Exception:
+        registrar_error('vencer_sesion', 'Error cerrando sesion vencida')
+
+
+class GameConsumer(ConsumidorConStore, ConsumidorMedido, ConsumidorRegulado, AsyncWebsocketConsumer):
     
-    jugadores_listos = {}          # channel_name → {nickname, numeros}
-    jugadores_confirmados = set()  # nicknames confirmados
+    tipos_cliente = frozenset({'numeros_seleccionados', 'iniciar_sorteo'})
+    # Cada boleto confirmado se difunde a toda la sala
+    limites = {
+        'numeros_seleccionados': (5, 0.5),
+        'binario': (5, 0.5),
+        'iniciar_sorteo': (3, 1.0),
+    }
 
     async def connect(self):
-        self.game_group_name = 'game_room'
-        
+        self.sala_id = self.scope['url_route']['kwargs']['sala_id']
+        self.game_group_name = f'game_{self.sala_id}'
+
+        if self.store is None:
+            self.store = obtener_store()
+        self.estado = EstadoJuego(self.store, self.sala_id)
+        self.boleto = None
+        # Al arrancar el proceso reaplica rondas de diarios huérfanos
+        diario.iniciar()
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        token = query.get('sesion', [''])[0]
+        desde = query.get('desde', [''])[0]
+        user = self.scope.get('user')
+        usuario = user.id if user is not None and user.is_authenticated else None
+        self.nickname = await repositorio.nickname_de(user) if usuario is not None else None
+
+        reanudada = bool(token) and await self.estado.reanudar(token, self.channel_name, usuario)
+        if reanudada:
+            self.sesion = token
+            self.boleto = await self.estado.boleto(token)
+        else:
+            self.sesion = await self.estado.abrir_sesion(self.channel_name, usuario)
+
         await self.channel_layer.group_add(
             self.game_group_name,
             self.channel_name
         )
-        await self.accept()
+
+        # Subprotocolo binario opcional; sin él, todo sigue en JSON
+        self.binario = SUBPROTOCOLO in self.scope.get('subprotocols', [])
+        await self.accept(subprotocol=SUBPROTOCOLO if self.binario else None)
+
+        # Los eventos de grupo que ya salgan en la reanudación se saltan
+        seq, perdidos, hueco = await self.estado.eventos_desde(
+            int(desde) if reanudada and desde.isdigit() else None
+        )
+        self.seq_conexion = seq
 
         await self.send(text_data=json.dumps({
             "type": "connected",
-            "message": "Conexion establecida"
+            "message": "Conexion establecida",
+            "compromiso": await self.estado.compromiso(),
+            "sesion": self.sesion,
+            "reanudada": reanudada,
+            "seq": seq,
+            "boleto": list(self.boleto.numeros) if self.boleto else None
         }))
-        
-    async def disconnect(self, close_code):
 
-        if self.channel_name in GameConsumer.jugadores_listos:
-            nickname = GameConsumer.jugadores_listos[self.channel_name]['nickname']
+        for texto in perdidos:
+            await self.send(text_data=texto)
+        if hueco:
+            # El buffer ya no tiene lo que se perdió: estado actual
+            total, confirmados = await self.estado.conteo(await self.estado.ronda())
+            await self.send(text_data=codificar('estado_confirmaciones', {
+                **confirmaciones(total, confirmados),
+                'seq': seq
+            }))
+
+    async def disconnect(self, close_code):
+        if close_code == CIERRE_NORMAL:
+            # El cliente cerró a propósito: sin período de gracia
+            await self.estado.cerrar_sesion(self.sesion, self.channel_name)
+        elif await self.estado.suspender(self.sesion, self.channel_name):
+            asyncio.create_task(vencer_sesion(self.estado, self.game_group_name, self.sesion))
 
-            GameConsumer.jugadores_confirmados.discard(nickname)
-            del GameConsumer.jugadores_listos[self.channel_name]
-        
         await self.channel_layer.group_discard(
             self.game_group_name,
             self.channel_name
         )
         
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        # Frames binarios: solo boletos (subprotocolo keno.bin.v1)
+        try:
+            _, numeros = decodificar_boleto(bytes_data)
+        except FrameInvalido as e:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+            return
+        await self.confirmar_boleto(numeros)
+
+    async def recibir(self, data):
+        # JSON ya parseado por ConsumidorRegulado (ver flujo.py)
         message_type = data.get('type')
+        estado = self.estado
         
         # ----------------------------------------------------
         # 1. RECIBIR NUMEROS Y CONFIRMAR
         # ----------------------------------------------------
         if message_type == 'numeros_seleccionados':
-            nickname = data.get('nickname')
-            numeros = data.get('numeros', [])
-
-            GameConsumer.jugadores_listos[self.channel_name] = {
-                'nickname': nickname,
-                'numeros': numeros
-            }
-
-            GameConsumer.jugadores_confirmados.add(nickname)
-
-            total = len(GameConsumer.jugadores_listos)
-            confirmados = len(GameConsumer.jugadores_confirmados)
-            todos_listos = (confirmados == total and total > 0)
-
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'estado_confirmaciones',
-                    'confirmados': confirmados,
-                    'total': total,
-                    'todos_listos': todos_listos
-                }
-            )
-
-            await self.send(text_data=json.dumps({
-                'type': 'seleccion_confirmada',
-                'message': f'Has seleccionado {len(numeros)} numeros'
-            }))
+            await self.confirmar_boleto(data.get('numeros', []))
 
         # ----------------------------------------------------
         # 2. INICIAR SORTEO — SOLO SI TODOS ESTÁN LISTOS
         # ----------------------------------------------------
         elif message_type == 'iniciar_sorteo':
+            ronda = await estado.ronda()
+            total, confirmados = await estado.conteo(ronda)
 
-            total = len(GameConsumer.jugadores_listos)
-            confirmados = len(GameConsumer.jugadores_confirmados)
+            if total == 0:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'No hay jugadores confirmados'
+                }))
+                return
 
             if confirmados < total:
                 await self.send(text_data=json.dumps({
@@ -219,120 +629,97 @@ class GameConsumer(AsyncWebsocketConsumer):
                     'message': f'Faltan {total - confirmados} jugador(es) por confirmar'
                 }))
                 return
-            
-            numeros_ganadores = random.sample(range(1, 81), 20)
-            
-            resultados = []
-            for channel, jugador_data in GameConsumer.jugadores_listos.items():
-                nickname = jugador_data['nickname']
-                numeros_jugador = jugador_data['numeros']
-                
-                aciertos = len(set(numeros_jugador) & set(numeros_ganadores))
-                puntos = self.calcular_puntos(len(numeros_jugador), aciertos)
-                
-                resultados.append({
-                    'nickname': nickname,
-                    'aciertos': aciertos,
-                    'puntos': puntos,
-                    'numeros': numeros_jugador
-                })
-            
-            resultados.sort(key=lambda x: x['puntos'], reverse=True)
-
-            await self.guardar_partida(numeros_ganadores, resultados)
-
-            GameConsumer.jugadores_confirmados.clear()
-
-            await self.channel_layer.group_send(
+
+            # Otro jugador ya disparó este sorteo: el resultado llega por el
+            # grupo, no se repite el sorteo
+            if not await estado.reclamar_ronda(ronda):
+                return
+
+            boletos = await estado.boletos()
+
+            sala, tabla = await repositorio.sala_y_tabla(self.sala_id)
+
+            # El resultado ya estaba generado: se revela el sorteo comprometido
+            sorteo, siguiente = await estado.revelar()
+            fecha = timezone.now()
+            numeros_ganadores = list(sorteo.numeros)
+
+            resultados = liquidar_ronda(boletos, numeros_ganadores, tabla)
+
+            if sala is not None:
+                await self.anotar_ronda(sala, tabla, numeros_ganadores, resultados, sorteo, fecha)
+
+            await difundir_evento(
+                estado,
                 self.game_group_name,
+                'sorteo_completado',
                 {
-                    'type': 'sorteo_completado',
                     'numeros_ganadores': numeros_ganadores,
-                    'resultados': resultados
-                }
+                    'resultados': resultados,
+                    'semilla': sorteo.semilla.hex(),
+                    'compromiso': sorteo.compromiso,
+                    'siguiente_compromiso': siguiente.compromiso
+                },
+                binario=lambda seq: codificar_sorteo(
+                    numeros_ganadores, resultados, sorteo.semilla, siguiente.compromiso, seq
+                )
             )
-    
 
-    async def estado_confirmaciones(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'estado_confirmaciones',
-            'confirmados': event['confirmados'],
-            'total': event['total'],
-            'todos_listos': event['todos_listos']
-        }))
+    async def anotar_ronda(self, sala, tabla, numeros_ganadores, resultados, sorteo, fecha):
+        # Write-behind: con la ronda en el diario (fsync) se difunde sin
+        # esperar a la base (ver diario.py)
+        try:
+            await diario.anotar(sala.id, tabla.id, numeros_ganadores, resultados, sorteo, fecha)
+            return
+        except OSError:
+            registrar_error('diario', 'No se pudo anotar la ronda, se guarda directo')
+        try:
+            await repositorio.guardar_ronda(sala.id, tabla.id, numeros_ganadores, resultados, sorteo, fecha)
+        except Exception:
+            registrar_error('guardar_partida', 'Error guardando partida')
+
+    async def confirmar_boleto(self, numeros):
+        if self.nickname is None:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Debes iniciar sesion para jugar'
+            }))
+            return
+        try:
+            boleto = parsear_boleto(self.nickname, numeros)
+        except BoletoInvalido as e:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+            return
+
+        self.boleto = boleto
+        total, confirmados = await self.estado.confirmar(self.sesion, boleto)
+        await anunciar_confirmaciones(self.estado, self.game_group_name, total, confirmados)
 
-    async def sorteo_completado(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'sorteo_completado',
-            'numeros_ganadores': event['numeros_ganadores'],
-            'resultados': event['resultados']
+            'type': 'seleccion_confirmada',
+            'message': f'Has seleccionado {boleto.spots} numeros'
         }))
+    
+
+    def ya_enviado(self, event):
+        # Un evento que ya estaba en el buffer al conectar salió en la
+        # reanudación (o es anterior a la conexión): no se repite
+        return event['seq'] <= self.seq_conexion
 
-    # -------------------------
-    #  CALCULAR PUNTOS
-    # -------------------------
-    def calcular_puntos(self, numeros_seleccionados, aciertos):
-        if numeros_seleccionados == 1:
-            return 3 if aciertos == 1 else 0
-        elif numeros_seleccionados == 2:
-            return 15 if aciertos == 2 else 0
-        elif numeros_seleccionados == 3:
-            if aciertos == 3: return 45
-            elif aciertos == 2: return 5
-            else: return 0
-        elif numeros_seleccionados == 4:
-            if aciertos == 4: return 100
-            elif aciertos == 3: return 10
-            elif aciertos == 2: return 2
-            else: return 0
-        elif numeros_seleccionados == 5:
-            if aciertos == 5: return 500
-            elif aciertos == 4: return 50
-            elif aciertos == 3: return 5
-            else: return 0
-        elif numeros_seleccionados <= 10:
-            return aciertos * 50
-        elif numeros_seleccionados <= 15:
-            return aciertos * 100
+    # Los frames de grupo llegan ya codificados (ver difusion.py)
+    async def estado_confirmaciones(self, event):
+        if self.ya_enviado(event):
+            return
+        await self.enviar_estado('estado_confirmaciones', event['texto'])
+
+    async def sorteo_completado(self, event):
+        if self.ya_enviado(event):
+            return
+        # Sin binario: el sorteo no cabía en el frame (ver binario.py)
+        if self.binario and event.get('binario') is not None:
+            await self.send(bytes_data=event['binario'])
         else:
-            return aciertos * 150
-
-    # -------------------------
-    #  GUARDAR PARTIDA EN BD
-    # -------------------------
-    @database_sync_to_async
-    def guardar_partida(self, numeros_ganadores, resultados):
-        from .models import Partida, Apuesta, Jugador, Sala
-        
-        try:
-            sala = Sala.objects.filter(activa=True).first()
-            if not sala:
-                return
-            
-            partida = Partida.objects.create(
-                sala=sala,
-                numeros_sorteados=numeros_ganadores,
-                finalizada=True
-            )
-            
-            for resultado in resultados:
-                try:
-                    jugador = Jugador.objects.get(nickname=resultado['nickname'])
-                    
-                    Apuesta.objects.create(
-                        partida=partida,
-                        jugador=jugador,
-                        numeros_elegidos=resultado['numeros'],
-                        aciertos=resultado['aciertos'],
-                        puntos_ganados=resultado['puntos']
-                    )
-                    
-                    jugador.puntos_totales += resultado['puntos']
-                    jugador.partidas_jugadas += 1
-                    jugador.save()
-
-                except Jugador.DoesNotExist:
-                    continue
-                    
-        except Exception as e:
-            print(f"Error guardando partida: {e}")
+            await self.send(text_data=event['texto'])
@@ -0,0 +1,253 @@
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+from . import persistencia
+from .basedatos import cola_escritura
+from .metricas import errores, logger, pendientes_diario, registrar_error
+
+# ============================================================
+#   DIARIO DE LIQUIDACIONES (WRITE-BEHIND)
+# ============================================================
+#
+# Una ronda liquidada se anota en un archivo local (una línea JSON, con
+# fsync) y el resultado se difunde enseguida: los jugadores no esperan a
+# la base. Una tarea de fondo vuelca lo anotado a Partida/Apuesta/Jugador
+# en lotes, por la cola de escritura. Cuando no queda nada pendiente el
+# archivo se trunca.
+#
+# Cada proceso escribe su propio archivo y lo mantiene bloqueado (flock)
+# mientras vive. Al arrancar se reaplican los archivos que nadie tiene
+# bloqueados: son de procesos que terminaron, quizá con rondas sin volcar.
+# Reaplicar es idempotente (ver persistencia.guardar_lote), así que una
+# caída entre el volcado y el truncado no duplica nada. startup.sh
+# reaplica los huérfanos antes de arrancar el servidor (aplicar_diario).
+#
+# Un lote que falla se reintenta con espera creciente, hasta
+# MAX_INTENTOS veces; si sigue fallando se parte en mitades hasta aislar
+# la entrada que no entra, que se aparta a DESCARTADAS para no frenar las
+# rondas siguientes. aplicar_diario --descartadas las vuelve a intentar.
+
+MAX_LOTE = 32
+MAX_INTENTOS = 4
+REINTENTO = 1        # segundos de espera tras el primer fallo; se duplica
+ESPERA_MAXIMA = 30
+DESCARTADAS = 'descartadas.jsonl'   # fuera del patrón diario-*.jsonl
+
+
+def _linea(entrada):
+    return (json.dumps(entrada, separators=(',', ':')) + '\n').encode()
+
+
+def _entradas(archivo):
+    entradas = []
+    for numero, linea in enumerate(archivo, start=1):
+        try:
+            entradas.append(json.loads(linea))
+        except ValueError:
+            # Línea a medio escribir: la ronda no llegó a difundirse
+            errores.sumar('diario')
+            logger.error('Línea %d ilegible en %s', numero, archivo.name)
+    return entradas
+
+
+class Diario:
+
+    def __init__(self, directorio=None):
+        self._directorio = directorio
+        self._lock = threading.Lock()
+        self._archivo = None
+        self._escritas = 0
+        self._en_vuelo = 0
+        self._pendientes = []
+        self._recuperado = False
+        self.tarea = None
+
+    @property
+    def directorio(self):
+        return Path(self._directorio or settings.KENO_DIARIO_DIR)
+
+    # --------------------------------------------------------
+    #   ARCHIVO (en un hilo: write + fsync bloquean)
+    # --------------------------------------------------------
+
+    def _abrir(self):
+        if self._archivo is None:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            # Nombre único: nunca coincide con el de un proceso anterior
+            ruta = self.directorio / f'diario-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl'
+            archivo = open(ruta, 'ab')
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._archivo = archivo
+        return self._archivo
+
+    def _escribir(self, linea):
+        with self._lock:
+            archivo = self._abrir()
+            archivo.write(linea)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+            self._escritas += 1
+
+    def _truncar(self, escritas):
+        # Solo si no se anotó nada desde que se decidió truncar
+        with self._lock:
+            if self._archivo is None or self._escritas != escritas:
+                return
+            self._archivo.truncate(0)
+            os.fsync(self._archivo.fileno())
+
+    def _tomar_huerfano(self, ruta):
+        # Abre y bloquea el diario de un proceso terminado; None si sigue vivo
+        archivo = open(ruta, 'rb')
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            archivo.close()
+            return None, []
+        return archivo, _entradas(archivo)
+
+    def _descartar(self, archivo):
+        os.unlink(archivo.name)
+        archivo.close()
+
+    def _apartar(self, entradas):
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        with open(self.directorio / DESCARTADAS, 'ab') as archivo:
+            archivo.write(b''.join(_linea(entrada) for entrada in entradas))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+
+    def _tomar_descartadas(self):
+        # Se renombra antes de leer: lo que se aparte mientras tanto va a
+        # un archivo nuevo
+        ruta = self.directorio / DESCARTADAS
+        tomada = ruta.with_name(f'{DESCARTADAS}.{uuid.uuid4().hex[:8]}')
+        try:
+            os.replace(ruta, tomada)
+        except FileNotFoundError:
+            return None, []
+        with open(tomada, 'rb') as archivo:
+            return tomada, _entradas(archivo)
+
+    # --------------------------------------------------------
+    #   API ASINCRONA
+    # --------------------------------------------------------
+
+    async def anotar(self, sala_id, tabla_id, numeros_ganadores, resultados, sorteo, fecha):
+        # Vuelve cuando la ronda es durable; el volcado a la base va después.
+        # fecha: hora del sorteo, no la del volcado
+        entrada = {
+            'sala': sala_id,
+            'tabla': tabla_id,
+            'numeros': numeros_ganadores,
+            'resultados': resultados,
+            'sorteo': sorteo.como_dict(),
+            'fecha': fecha.isoformat(),
+        }
+        linea = _linea(entrada)
+        self._en_vuelo += 1
+        try:
+            await asyncio.to_thread(self._escribir, linea)
+        finally:
+            self._en_vuelo -= 1
+        self._pendientes.append(entrada)
+        pendientes_diario.sumar()
+        self.iniciar()
+
+    def iniciar(self):
+        # Arranca la tarea de fondo si no corre; la primera vez reaplica
+        # los diarios huérfanos
+        if self.tarea is None or self.tarea.done():
+            self.tarea = asyncio.create_task(self._volcar_periodicamente())
+
+    async def esperar(self):
+        # Hasta que todo lo anotado esté en la base
+        while self.tarea is not None and not self.tarea.done():
+            await asyncio.shield(self.tarea)
+
+    async def _volcar_periodicamente(self):
+        if not self._recuperado:
+            self._recuperado = True
+            try:
+                await self.recuperar()
+            except Exception:
+                registrar_error('diario', 'Error reaplicando diarios huérfanos')
+
+        while self._pendientes:
+            lote = self._pendientes[:MAX_LOTE]
+            await self._volcar(lote)
+            del self._pendientes[:len(lote)]
+            pendientes_diario.sumar(cantidad=-len(lote))
+
+            if not self._pendientes and not self._en_vuelo:
+                await asyncio.to_thread(self._truncar, self._escritas)
+
+    async def _volcar(self, lote):
+        # Guarda el lote o, si no entra, lo aparta; devuelve cuántas rondas
+        # se guardaron
+        espera = REINTENTO
+        for intento in range(1, MAX_INTENTOS + 1):
+            try:
+                return await cola_escritura.ejecutar(persistencia.guardar_lote, lote)
+            except Exception:
+                registrar_error('diario', 'Error volcando el diario de liquidaciones')
+            if intento < MAX_INTENTOS:
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, ESPERA_MAXIMA)
+
+        if len(lote) > 1:
+            mitad = len(lote) // 2
+            return await self._volcar(lote[:mitad]) + await self._volcar(lote[mitad:])
+
+        await asyncio.to_thread(self._apartar, lote)
+        errores.sumar('diario_descartadas')
+        logger.error('Ronda %s apartada en %s', lote[0]['sorteo']['compromiso'], DESCARTADAS)
+        return 0
+
+    async def reaplicar_descartadas(self):
+        # (guardadas, que siguen sin entrar); estas vuelven a DESCARTADAS
+        tomada, entradas = await asyncio.to_thread(self._tomar_descartadas)
+        if tomada is None:
+            return 0, 0
+        guardadas = 0
+        fallidas = []
+        for entrada in entradas:
+            try:
+                guardadas += await cola_escritura.ejecutar(persistencia.guardar_lote, [entrada])
+            except Exception:
+                registrar_error('diario', 'Error reaplicando una ronda descartada')
+                fallidas.append(entrada)
+        if fallidas:
+            await asyncio.to_thread(self._apartar, fallidas)
+        await asyncio.to_thread(os.unlink, tomada)
+        return guardadas, len(fallidas)
+
+    async def recuperar(self):
+        # Devuelve cuántas rondas se guardaron (las ya guardadas no cuentan)
+        rutas = await asyncio.to_thread(lambda: sorted(self.directorio.glob('diario-*.jsonl')))
+        propio = self._archivo.name if self._archivo is not None else None
+
+        aplicadas = 0
+        for ruta in rutas:
+            if str(ruta) == propio:
+                continue
+            archivo, entradas = await asyncio.to_thread(self._tomar_huerfano, ruta)
+            if archivo is None:
+                continue
+            guardadas = 0
+            for inicio in range(0, len(entradas), MAX_LOTE):
+                guardadas += await self._volcar(entradas[inicio:inicio + MAX_LOTE])
+            await asyncio.to_thread(self._descartar, archivo)
+            logger.info('Diario %s reaplicado: %d ronda(s) de %d', ruta.name, guardadas, len(entradas))
+            aplicadas += guardadas
+        return aplicadas
+
+
+diario = Diario()
@@ -0,0 +1,36 @@
+import json
+import time
+
+from .metricas import envio_capa
+
+# ============================================================
+#   DIFUSION A GRUPOS (CODIFICAR UNA SOLA VEZ)
+# ============================================================
+#
+# El mensaje se serializa a JSON una vez, al enviarlo al grupo, y cada
+# consumidor reenvía ese mismo texto a su socket. El texto es un str
+# inmutable: la capa de canales lo copia por referencia (deepcopy de un
+# str devuelve el mismo objeto), así que todos los miembros comparten el
+# mismo frame y Python lo libera cuando el último lo envía.
+
+
+def codificar(tipo, payload):
+    return json.dumps({'type': tipo, **payload})
+
+
+async def enviar_evento(channel_layer, group_name, evento):
+    # evento: {'type', 'texto', ...} ya codificado
+    inicio = time.perf_counter()
+    await channel_layer.group_send(group_name, evento)
+    envio_capa.observar(time.perf_counter() - inicio, 'group_send')
+
+
+async def difundir(channel_layer, group_name, tipo, binario=None, **payload):
+    # binario: versión ya codificada para clientes con subprotocolo binario
+    evento = {
+        'type': tipo,
+        'texto': codificar(tipo, payload)
+    }
+    if binario is not None:
+        evento['binario'] = binario
+    await enviar_evento(channel_layer, group_name, evento)
@@ -0,0 +1,180 @@
+import json
+import threading
+from dataclasses import dataclass
+
+from django.db.models import Case, F, Value, When
+
+from .liquidacion import NUMERO_MAX
+from .mascaras import numeros_de_columnas
+from .models import EstadisticaNumero, Partida
+
+# ============================================================
+#   ESTADISTICAS DE NUMEROS (CALIENTES Y FRIOS)
+# ============================================================
+#
+# La liquidación actualiza EstadisticaNumero en cada ronda, dentro de su
+# transacción: veces que salió cada número, cuántas en los últimos 100 y
+# 1000 sorteos, y el último sorteo en que salió (la ausencia es la
+# diferencia con el total). Leerlas cuesta 81 filas, nunca un recorrido
+# de las partidas.
+#
+# Las ventanas se mantienen sumando el sorteo nuevo y restando el que sale
+# de la ventana (el de hace 100 / 1000 sorteos, una fila por índice).
+#
+# El tablero en memoria es un espejo con el mismo esquema que el ranking:
+# se aplica cada ronda al confirmar la transacción y, si el total de
+# sorteos no coincide con la base (otro worker liquidó), se recarga.
+
+TOTAL = 0   # fila que cuenta los sorteos
+VENTANAS = (('ultimos_100', 100), ('ultimos_1000', 1000))
+CANTIDAD_DESTACADOS = 10
+
+
+@dataclass(frozen=True, slots=True)
+class CambioSorteo:
+    sorteo: int        # número de orden del sorteo: 1, 2, ...
+    numeros: tuple
+    salientes: tuple   # por ventana, números del sorteo que sale de ella
+
+
+def _sembrar():
+    EstadisticaNumero.objects.bulk_create(
+        [EstadisticaNumero(numero=n) for n in range(NUMERO_MAX + 1)],
+        ignore_conflicts=True
+    )
+
+
+def _numeros_de_hace(posiciones):
+    # Se llama antes de crear la Partida del sorteo nuevo: la más reciente
+    # es la de hace 1 sorteo
+    filas = (
+        Partida.objects.filter(finalizada=True).order_by('-id')
+        .values_list('sorteados_bajos', 'sorteados_altos')[posiciones - 1:posiciones]
+    )
+    return tuple(numeros_de_columnas(*filas[0])) if filas else ()
+
+
+def _delta(suman, restan):
+    return Case(
+        When(numero__in=suman, then=Value(1)),
+        When(numero__in=restan, then=Value(-1)),
+        default=Value(0)
+    )
+
+
+def registrar_sorteo(numeros):
+    # Va dentro de la transacción de la liquidación y ANTES de crear la
+    # Partida: el UPDATE del contador es la primera escritura, así que dos
+    # liquidaciones concurrentes se ordenan aquí y cada una ve las partidas
+    # anteriores completas
+    contador = EstadisticaNumero.objects.filter(numero=TOTAL)
+    if not contador.update(veces=F('veces') + 1):
+        _sembrar()
+        contador.update(veces=F('veces') + 1)
+    sorteo = contador.values_list('veces', flat=True).get()
+
+    numeros = tuple(sorted(numeros))
+    salientes = tuple(_numeros_de_hace(tamano) for _, tamano in VENTANAS)
+
+    cambios = {
+        'veces': F('veces') + _delta(numeros, ()),
+        'ultimo_sorteo': Case(When(numero__in=numeros, then=Value(sorteo)), default=F('ultimo_sorteo')),
+    }
+    afectados = set(numeros)
+    for (campo, _), saliendo in zip(VENTANAS, salientes):
+        # Un número que entra y sale a la vez no cambia
+        cambios[campo] = F(campo) + _delta(set(numeros) - set(saliendo), set(saliendo) - set(numeros))
+        afectados.update(saliendo)
+
+    EstadisticaNumero.objects.filter(numero__in=afectados).update(**cambios)
+    return CambioSorteo(sorteo, numeros, salientes)
+
+
+def sorteos_contados():
+    return EstadisticaNumero.objects.filter(numero=TOTAL).values_list('veces', flat=True).first() or 0
+
+
+class TableroNumeros:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sorteos = None
+        self._veces = [0] * (NUMERO_MAX + 1)
+        self._ultimo = [0] * (NUMERO_MAX + 1)
+        self._ventanas = [[0] * (NUMERO_MAX + 1) for _ in VENTANAS]
+        self._json = None
+
+    def _sincronizar(self, sorteos):
+        if self.sorteos == sorteos:
+            return
+        campos = [campo for campo, _ in VENTANAS]
+        filas = EstadisticaNumero.objects.values_list('numero', 'veces', 'ultimo_sorteo', *campos)
+        self.sorteos = 0
+        for numero, veces, ultimo, *ventanas in filas:
+            if numero == TOTAL:
+                self.sorteos = veces
+                continue
+            self._veces[numero] = veces
+            self._ultimo[numero] = ultimo
+            for conteo, valor in zip(self._ventanas, ventanas):
+                conteo[numero] = valor
+        self._json = None
+
+    def aplicar(self, cambio):
+        with self._lock:
+            if self.sorteos is None:
+                return
+            if cambio.sorteo != self.sorteos + 1:
+                # Falta algún sorteo (liquidado en otro worker): recargar
+                self.sorteos = None
+                return
+
+            for n in cambio.numeros:
+                self._veces[n] += 1
+                self._ultimo[n] = cambio.sorteo
+            for conteo, saliendo in zip(self._ventanas, cambio.salientes):
+                for n in cambio.numeros:
+                    conteo[n] += 1
+                for n in saliendo:
+                    conteo[n] -= 1
+
+            self.sorteos = cambio.sorteo
+            self._json = None
+
+    def json(self, sorteos):
+        # sorteos: total leído de la base; se serializa una vez por sorteo
+        with self._lock:
+            self._sincronizar(sorteos)
+            if self._json is None:
+                self._json = json.dumps(self._como_dict())
+            return self._json
+
+    def _como_dict(self):
+        numeros = []
+        for n in range(1, NUMERO_MAX + 1):
+            fila = {
+                'numero': n,
+                'veces': self._veces[n],
+                'ausencia': self.sorteos - self._ultimo[n] if self._ultimo[n] else None,
+            }
+            for (campo, _), conteo in zip(VENTANAS, self._ventanas):
+                fila[campo] = conteo[n]
+            numeros.append(fila)
+
+        # Calientes y fríos según la ventana corta; desempata la ausencia
+        # (un número que nunca salió es el más frío)
+        corta = VENTANAS[0][0]
+        orden = sorted(numeros, key=lambda fila: (
+            -fila[corta],
+            self.sorteos + 1 if fila['ausencia'] is None else fila['ausencia'],
+        ))
+        return {
+            'sorteos': self.sorteos,
+            'ventanas': [tamano for _, tamano in VENTANAS],
+            'numeros': numeros,
+            'calientes': [fila['numero'] for fila in orden[:CANTIDAD_DESTACADOS]],
+            'frios': [fila['numero'] for fila in orden[-CANTIDAD_DESTACADOS:][::-1]],
+        }
+
+
+tablero = TableroNumeros()
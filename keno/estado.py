@@ -0,0 +1,238 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# ============================================================
+#   ALMACEN DE ESTADO COMPARTIDO ENTRE WORKERS
+# ============================================================
+#
+# Los consumidores no guardan el estado del juego en atributos de clase:
+# lo leen y escriben en un backend. Con MemoriaBackend el estado vive en
+# el proceso (un solo worker); con SQLiteBackend vive en un archivo local
+# y varios procesos del servidor ASGI en el mismo host comparten las rondas.
+#
+# El backend ofrece dos tipos de datos:
+#   - claves con version, con compare-and-set atómico (cas)
+#   - mapas campo → valor (boletos, confirmaciones)
+
+
+class MemoriaBackend:
+    bloqueante = False
+
+    def __init__(self, **opciones):
+        self._lock = threading.Lock()
+        self._claves = {}   # clave → (valor, version)
+        self._mapas = {}    # mapa → {campo: valor}
+
+    def get(self, clave):
+        return self._claves.get(clave, (None, 0))
+
+    def cas(self, clave, version, valor):
+        with self._lock:
+            actual = self._claves.get(clave, (None, 0))[1]
+            if actual != version:
+                return False
+            if valor is None:
+                self._claves.pop(clave, None)
+            else:
+                self._claves[clave] = (valor, version + 1)
+            return True
+
+    def hset(self, mapa, campo, valor):
+        with self._lock:
+            self._mapas.setdefault(mapa, {})[campo] = valor
+
+    def hdel(self, mapa, campo):
+        with self._lock:
+            campos = self._mapas.get(mapa)
+            if campos is not None:
+                campos.pop(campo, None)
+                if not campos:
+                    del self._mapas[mapa]
+
+    def hget(self, mapa, campo):
+        return self._mapas.get(mapa, {}).get(campo)
+
+    def hgetall(self, mapa):
+        return dict(self._mapas.get(mapa, {}))
+
+    def hlen(self, mapa):
+        return len(self._mapas.get(mapa, ()))
+
+    def borrar(self, prefijo):
+        with self._lock:
+            for clave in [c for c in self._claves if c.startswith(prefijo)]:
+                del self._claves[clave]
+            for mapa in [m for m in self._mapas if m.startswith(prefijo)]:
+                del self._mapas[mapa]
+
+
+class SQLiteBackend:
+    # Archivo SQLite independiente de la base de Django. Cada hilo usa su
+    # propia conexión en modo autocommit; el CAS es un UPDATE condicionado
+    # a la version, que SQLite ejecuta de forma atómica.
+    bloqueante = True
+
+    def __init__(self, ruta, **opciones):
+        self.ruta = str(ruta)
+        self._local = threading.local()
+        conexion = self._conexion()
+        conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS claves (
+                clave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                version INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mapas (
+                mapa TEXT NOT NULL,
+                campo TEXT NOT NULL,
+                valor TEXT NOT NULL,
+                PRIMARY KEY (mapa, campo)
+            ) WITHOUT ROWID;
+        """)
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexion = conexion
+        return conexion
+
+    def get(self, clave):
+        fila = self._conexion().execute(
+            'SELECT valor, version FROM claves WHERE clave = ?', (clave,)
+        ).fetchone()
+        if fila is None:
+            return None, 0
+        return json.loads(fila[0]), fila[1]
+
+    def cas(self, clave, version, valor):
+        conexion = self._conexion()
+        if valor is None:
+            if version == 0:
+                return self.get(clave)[1] == 0
+            cursor = conexion.execute(
+                'DELETE FROM claves WHERE clave = ? AND version = ?', (clave, version)
+            )
+            return cursor.rowcount == 1
+
+        texto = json.dumps(valor)
+        if version == 0:
+            cursor = conexion.execute(
+                'INSERT INTO claves (clave, valor, version) VALUES (?, ?, 1) '
+                'ON CONFLICT (clave) DO NOTHING', (clave, texto)
+            )
+        else:
+            cursor = conexion.execute(
+                'UPDATE claves SET valor = ?, version = version + 1 '
+                'WHERE clave = ? AND version = ?', (texto, clave, version)
+            )
+        return cursor.rowcount == 1
+
+    def hset(self, mapa, campo, valor):
+        self._conexion().execute(
+            'INSERT INTO mapas (mapa, campo, valor) VALUES (?, ?, ?) '
+            'ON CONFLICT (mapa, campo) DO UPDATE SET valor = excluded.valor',
+            (mapa, campo, json.dumps(valor))
+        )
+
+    def hdel(self, mapa, campo):
+        self._conexion().execute(
+            'DELETE FROM mapas WHERE mapa = ? AND campo = ?', (mapa, campo)
+        )
+
+    def hget(self, mapa, campo):
+        fila = self._conexion().execute(
+            'SELECT valor FROM mapas WHERE mapa = ? AND campo = ?', (mapa, campo)
+        ).fetchone()
+        return json.loads(fila[0]) if fila is not None else None
+
+    def hgetall(self, mapa):
+        filas = self._conexion().execute(
+            'SELECT campo, valor FROM mapas WHERE mapa = ?', (mapa,)
+        )
+        return {campo: json.loads(valor) for campo, valor in filas}
+
+    def hlen(self, mapa):
+        return self._conexion().execute(
+            'SELECT COUNT(*) FROM mapas WHERE mapa = ?', (mapa,)
+        ).fetchone()[0]
+
+    def borrar(self, prefijo):
+        # Rango [prefijo, prefijo + U+FFFF) usa el indice de la clave primaria
+        fin = prefijo + '\uffff'
+        conexion = self._conexion()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            conexion.execute('DELETE FROM claves WHERE clave >= ? AND clave < ?', (prefijo, fin))
+            conexion.execute('DELETE FROM mapas WHERE mapa >= ? AND mapa < ?', (prefijo, fin))
+            conexion.execute('COMMIT')
+        except Exception:
+            conexion.execute('ROLLBACK')
+            raise
+
+
+class EstadoStore:
+    # Fachada asíncrona que usan los consumidores. Los backends bloqueantes
+    # (archivo) se ejecutan en un hilo para no frenar el event loop.
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def _llamar(self, metodo, *args):
+        funcion = getattr(self.backend, metodo)
+        if self.backend.bloqueante:
+            return await asyncio.to_thread(funcion, *args)
+        return funcion(*args)
+
+    async def get(self, clave):
+        return await self._llamar('get', clave)
+
+    async def cas(self, clave, version, valor):
+        return await self._llamar('cas', clave, version, valor)
+
+    async def actualizar(self, clave, funcion):
+        # Bucle de compare-and-set: funcion(valor_actual) → valor_nuevo
+        while True:
+            valor, version = await self.get(clave)
+            nuevo = funcion(valor)
+            if await self.cas(clave, version, nuevo):
+                return nuevo
+
+    async def hset(self, mapa, campo, valor):
+        await self._llamar('hset', mapa, campo, valor)
+
+    async def hdel(self, mapa, campo):
+        await self._llamar('hdel', mapa, campo)
+
+    async def hget(self, mapa, campo):
+        return await self._llamar('hget', mapa, campo)
+
+    async def hgetall(self, mapa):
+        return await self._llamar('hgetall', mapa)
+
+    async def hlen(self, mapa):
+        return await self._llamar('hlen', mapa)
+
+    async def borrar(self, prefijo):
+        await self._llamar('borrar', prefijo)
+
+
+_backends = {}
+
+
+def obtener_store():
+    # KENO_ESTADO = {'BACKEND': 'keno.estado.SQLiteBackend', 'OPTIONS': {'ruta': ...}}
+    config = getattr(settings, 'KENO_ESTADO', {})
+    ruta_backend = config.get('BACKEND', 'keno.estado.MemoriaBackend')
+    backend = _backends.get(ruta_backend)
+    if backend is None:
+        backend = import_string(ruta_backend)(**config.get('OPTIONS', {}))
+        _backends[ruta_backend] = backend
+    return EstadoStore(backend)
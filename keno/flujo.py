@@ -0,0 +1,181 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from .metricas import clientes_lentos, descartes_salida, mensajes_limitados, registrar_error
+
+# ============================================================
+#   CONTROL DE FLUJO POR CONEXION
+# ============================================================
+#
+# Entrada: el JSON se parsea una sola vez, aquí, y la cubeta de fichas
+# (ráfaga, mensajes por segundo) se elige por el 'type' parseado, el
+# mismo que ve el consumidor; un tipo fuera de tipos_cliente (o un frame
+# que no es un objeto JSON) usa la cubeta 'desconocido' y no se procesa.
+# Un mensaje sin ficha se descarta antes de llegar al consumidor; el
+# cliente recibe un aviso la primera vez.
+#
+# Salida: los frames no van directo al socket sino a una cola por
+# conexión que vacía una tarea propia. Así un cliente lento no frena al
+# consumidor (ni a la capa de canales, que descarta mensajes cuando el
+# canal se llena) y su atraso se puede medir. Con SALIDA_ALTA frames
+# pendientes, un frame de estado reemplaza al pendiente de su misma clase
+# (el intermedio ya no sirve); si la cola llega a SALIDA_MAXIMA o sigue
+# sobre la marca alta ATRASO_MAXIMO segundos, se cierra la conexión. El
+# cliente reconecta y se pone al día con la reanudación de sesión.
+#
+# El atraso se ve porque startup.sh corre Uvicorn con --ws websockets,
+# cuyo send espera a que el socket drene: con un cliente que no lee, la
+# tarea de vaciado queda esperando y los frames se juntan aquí. Daphne no
+# sirve para esto: entrega el frame a Twisted sin esperar, la cola se
+# vacía siempre al instante y el atraso queda en un buffer que esta capa
+# no ve (lo mismo con Uvicorn --ws wsproto).
+
+LIMITE_POR_DEFECTO = (5, 1.0)   # ráfaga, mensajes por segundo
+SALIDA_ALTA = 64
+SALIDA_MAXIMA = 512
+ATRASO_MAXIMO = 10   # segundos seguidos sobre la marca alta
+CIERRE_LENTO = 1013  # "try again later"
+
+
+class Cubeta:
+    __slots__ = ('capacidad', 'ritmo', 'fichas', 'ultimo', 'rechazos')
+
+    def __init__(self, capacidad, ritmo):
+        self.capacidad = capacidad
+        self.ritmo = ritmo
+        self.fichas = capacidad
+        self.ultimo = time.monotonic()
+        self.rechazos = 0   # seguidos, para avisar una sola vez
+
+    def tomar(self):
+        ahora = time.monotonic()
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultimo) * self.ritmo)
+        self.ultimo = ahora
+        if self.fichas >= 1:
+            self.fichas -= 1
+            self.rechazos = 0
+            return True
+        self.rechazos += 1
+        return False
+
+
+class ColaSalida:
+    # Frames pendientes de un socket: (clave, mensaje ASGI). clave no es
+    # None solo en frames de estado que se pueden reemplazar.
+
+    def __init__(self, send, consumidor):
+        self._send = send
+        self._consumidor = consumidor
+        self._frames = deque()
+        self._atrasada_desde = None
+        self.tarea = None
+        self.cortada = False
+
+    def __len__(self):
+        return len(self._frames)
+
+    async def poner(self, mensaje, clave=None):
+        # Hace de base_send del consumidor: no espera al socket
+        if self.cortada:
+            return
+        pendientes = len(self._frames)
+        if pendientes >= SALIDA_ALTA:
+            if self._atrasada_desde is None:
+                self._atrasada_desde = time.monotonic()
+            if pendientes >= SALIDA_MAXIMA or time.monotonic() - self._atrasada_desde > ATRASO_MAXIMO:
+                self.cortar()
+                return
+            if clave is not None:
+                self._quitar(clave)
+        else:
+            self._atrasada_desde = None
+
+        self._frames.append((clave, mensaje))
+        if self.tarea is None:
+            self.tarea = asyncio.create_task(self._vaciar())
+
+    def _quitar(self, clave):
+        antes = len(self._frames)
+        self._frames = deque(frame for frame in self._frames if frame[0] != clave)
+        if len(self._frames) < antes:
+            descartes_salida.sumar(self._consumidor, 'reemplazado', cantidad=antes - len(self._frames))
+
+    def cortar(self):
+        # Lo pendiente se descarta; el cierre sale después del frame en vuelo
+        descartes_salida.sumar(self._consumidor, 'lento', cantidad=len(self._frames))
+        clientes_lentos.sumar(self._consumidor)
+        self._frames.clear()
+        self._frames.append((None, {'type': 'websocket.close', 'code': CIERRE_LENTO}))
+        self.cortada = True
+        if self.tarea is None:
+            self.tarea = asyncio.create_task(self._vaciar())
+
+    async def _vaciar(self):
+        try:
+            while self._frames:
+                _, mensaje = self._frames.popleft()
+                await self._send(mensaje)
+        except Exception:
+            # El socket ya no está; el disconnect llega por receive
+            self._frames.clear()
+            self.cortada = True
+            registrar_error('salida', 'Error enviando al socket')
+        finally:
+            self.tarea = None
+
+    def cancelar(self):
+        if self.tarea is not None:
+            self.tarea.cancel()
+
+
+class ConsumidorRegulado:
+    # Mixin para AsyncWebsocketConsumer. Los objetos JSON llegan parseados a
+    # recibir(data); los frames binarios a receive(bytes_data=...).
+    # limites: tipo → (ráfaga, mensajes por segundo); los tipos que no
+    # figuran usan LIMITE_POR_DEFECTO.
+    limites = {}
+    tipos_cliente = frozenset()
+
+    async def __call__(self, scope, receive, send):
+        self.cubetas = {}
+        self.salida = ColaSalida(send, type(self).__name__)
+        try:
+            await super().__call__(scope, receive, self.salida.poner)
+        finally:
+            self.salida.cancelar()
+
+    async def websocket_receive(self, message):
+        data = None
+        if message.get('text') is not None:
+            try:
+                data = json.loads(message['text'])
+            except ValueError:
+                pass
+            tipo = data.get('type') if isinstance(data, dict) else None
+            if tipo not in self.tipos_cliente:
+                tipo, data = 'desconocido', None
+        else:
+            tipo = 'binario'
+
+        cubeta = self.cubetas.get(tipo)
+        if cubeta is None:
+            cubeta = self.cubetas[tipo] = Cubeta(*self.limites.get(tipo, LIMITE_POR_DEFECTO))
+        if cubeta.tomar():
+            if tipo == 'binario':
+                await self.receive(bytes_data=message['bytes'])
+            elif data is not None:
+                await self.recibir(data)
+            return
+
+        mensajes_limitados.sumar(type(self).__name__, tipo)
+        if cubeta.rechazos == 1:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Demasiados mensajes, espera un momento'
+            }))
+
+    async def enviar_estado(self, clave, texto):
+        # Frame de estado: con el cliente atrasado reemplaza al anterior
+        await self.salida.poner({'type': 'websocket.send', 'text': texto}, clave)
@@ -0,0 +1,181 @@
+import base64
+import binascii
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from .mascaras import numeros_de_columnas
+from .models import Apuesta, Partida
+
+# ============================================================
+#   HISTORIAL (PAGINACION POR CLAVE Y EXPORTACION EN STREAMING)
+# ============================================================
+#
+# Las páginas no usan OFFSET: el cursor es la última (fecha_inicio, id)
+# entregada y la siguiente página empieza estrictamente después. Cada
+# página cuesta lo mismo sin importar cuánto historial haya.
+#
+# La exportación es un generador asíncrono que lee la consulta por
+# chunks: con ASGI (Uvicorn) la respuesta sale bloque a bloque, uno por
+# chunk, y la memoria no crece con la cantidad de apuestas. Un generador
+# síncrono no sirve ahí: Django lo consume entero con
+# sync_to_async(list) antes de mandar el primer byte. Con WSGI (el
+# runserver de desarrollo) pasa lo inverso y el generador asíncrono se
+# junta entero; producción corre con ASGI.
+
+TAMANO_PAGINA = 50
+MAX_PAGINA = 500
+CHUNK_EXPORTACION = 2000
+
+CAMPOS_APUESTA = (
+    'partida_id', 'partida__fecha_inicio', 'partida__sala__codigo', 'jugador__nickname',
+    'elegidos_bajos', 'elegidos_altos', 'partida__sorteados_bajos', 'partida__sorteados_altos',
+    'aciertos', 'puntos_ganados', 'tabla_pagos__version',
+)
+COLUMNAS_APUESTA = (
+    'partida', 'fecha', 'sala', 'jugador',
+    'numeros_elegidos', 'numeros_sorteados', 'aciertos', 'puntos',
+    'tabla_pagos',
+)
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(fecha, id):
+    return base64.urlsafe_b64encode(f'{fecha.isoformat()}|{id}'.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    try:
+        fecha, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(fecha), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CursorInvalido('Cursor invalido')
+
+
+def _despues(cursor, campo_fecha='fecha_inicio'):
+    # Orden descendente: lo siguiente es lo más antiguo que el cursor
+    fecha, id = decodificar_cursor(cursor)
+    return Q(**{f'{campo_fecha}__lt': fecha}) | Q(**{campo_fecha: fecha, 'id__lt': id})
+
+
+def _pagina(filas, limite, clave):
+    # Se pide una fila de más para saber si hay página siguiente
+    filas = list(filas[:limite + 1])
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(*clave(filas[-1]))
+    return filas, siguiente
+
+
+def apuestas_de_jugador(jugador_id):
+    return Apuesta.objects.filter(jugador_id=jugador_id)
+
+
+def apuestas_de_sala(sala_id):
+    return Apuesta.objects.filter(partida__sala_id=sala_id)
+
+
+def pagina_apuestas(apuestas, cursor=None, limite=TAMANO_PAGINA):
+    apuestas = (
+        apuestas
+        .select_related('partida__sala', 'jugador', 'tabla_pagos')
+        .order_by('-partida__fecha_inicio', '-id')
+    )
+    # Desempate por id de la apuesta: una partida tiene varias apuestas
+    if cursor:
+        apuestas = apuestas.filter(_despues(cursor, 'partida__fecha_inicio'))
+
+    filas, siguiente = _pagina(apuestas, limite, lambda a: (a.partida.fecha_inicio, a.id))
+    return [{
+        'partida': apuesta.partida_id,
+        'fecha': apuesta.partida.fecha_inicio.isoformat(),
+        'sala': apuesta.partida.sala.codigo,
+        'jugador': apuesta.jugador.nickname,
+        'numeros_elegidos': apuesta.numeros_elegidos,
+        'numeros_sorteados': apuesta.partida.numeros_sorteados,
+        'aciertos': apuesta.aciertos,
+        'puntos': apuesta.puntos_ganados,
+        'tabla_pagos': apuesta.tabla_pagos.version if apuesta.tabla_pagos else None,
+    } for apuesta in filas], siguiente
+
+
+def pagina_partidas(sala_id, cursor=None, limite=TAMANO_PAGINA):
+    partidas = (
+        Partida.objects
+        .filter(sala_id=sala_id, finalizada=True)
+        .select_related('sala')
+        .order_by('-fecha_inicio', '-id')
+    )
+    if cursor:
+        partidas = partidas.filter(_despues(cursor))
+
+    filas, siguiente = _pagina(partidas, limite, lambda p: (p.fecha_inicio, p.id))
+    return [{
+        'partida': partida.id,
+        'fecha': partida.fecha_inicio.isoformat(),
+        'sala': partida.sala.codigo,
+        'numeros_sorteados': partida.numeros_sorteados,
+        'compromiso': partida.compromiso,
+        'semilla': partida.semilla,
+    } for partida in filas], siguiente
+
+
+# ------------------------------------------------------------
+#   EXPORTACION
+# ------------------------------------------------------------
+
+class _Eco:
+    # csv.writer escribe aquí y la fila vuelve como str (patrón de la
+    # documentación de Django para CSV en streaming)
+    def write(self, valor):
+        return valor
+
+
+def _fila_exportacion(valores):
+    (partida, fecha, sala, jugador, elegidos_bajos, elegidos_altos,
+     sorteados_bajos, sorteados_altos, aciertos, puntos, tabla) = valores
+    return (
+        partida, fecha.isoformat(), sala, jugador,
+        numeros_de_columnas(elegidos_bajos, elegidos_altos),
+        numeros_de_columnas(sorteados_bajos, sorteados_altos),
+        aciertos, puntos, tabla,
+    )
+
+
+async def _chunks_exportacion(apuestas):
+    # Lo mismo que QuerySet.aiterator, que con values_list ejecuta la
+    # consulta en el event loop (Django 5.2): cada chunk se lee en el hilo
+    # de la conexión, y el cursor sigue abierto entre uno y otro
+    filas = (
+        apuestas
+        .order_by('partida__fecha_inicio', 'id')
+        .values_list(*CAMPOS_APUESTA)
+        .iterator(chunk_size=CHUNK_EXPORTACION)
+    )
+    leer = sync_to_async(lambda: [_fila_exportacion(valores) for valores in islice(filas, CHUNK_EXPORTACION)])
+    while chunk := await leer():
+        yield chunk
+
+
+async def exportar_csv(apuestas):
+    # Un bloque de respuesta por chunk de la consulta, no uno por fila
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS_APUESTA)
+    async for chunk in _chunks_exportacion(apuestas):
+        yield ''.join(
+            escritor.writerow(' '.join(map(str, valor)) if isinstance(valor, list) else valor for valor in fila)
+            for fila in chunk
+        )
+
+
+async def exportar_ndjson(apuestas):
+    async for chunk in _chunks_exportacion(apuestas):
+        yield ''.join(json.dumps(dict(zip(COLUMNAS_APUESTA, fila))) + '\n' for fila in chunk)
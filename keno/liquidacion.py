@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+
+# ============================================================
+#   MOTOR DE LIQUIDACION (BOLETOS COMO MASCARAS DE BITS)
+# ============================================================
+#
+# Cada boleto se valida una sola vez al recibirlo y se guarda como
+# un entero de 80 bits (bit n-1 encendido => numero n elegido).
+# Al sortear, los aciertos de cada boleto son un AND + popcount.
+
+NUMERO_MIN = 1
+NUMERO_MAX = 80
+MAX_NUMEROS_BOLETO = 20
+NUMEROS_POR_SORTEO = 20
+MAX_NICKNAME = 50   # Jugador.nickname
+
+
+class BoletoInvalido(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class Boleto:
+    nickname: str
+    numeros: tuple   # ordenados y sin repetidos
+    mascara: int
+
+    @property
+    def spots(self):
+        return len(self.numeros)
+
+    @classmethod
+    def desde_mascara(cls, nickname, mascara):
+        return cls(nickname=nickname, numeros=tuple(mascara_a_numeros(mascara)), mascara=mascara)
+
+
+def numeros_a_mascara(numeros):
+    mascara = 0
+    for n in numeros:
+        mascara |= 1 << (n - 1)
+    return mascara
+
+
+def mascara_a_numeros(mascara):
+    numeros = []
+    while mascara:
+        bajo = mascara & -mascara
+        numeros.append(bajo.bit_length())
+        mascara ^= bajo
+    return numeros
+
+
+def parsear_boleto(nickname, numeros):
+    # Se valida todo antes de tocar el store: un boleto a medias dejaría
+    # un jugador sin confirmar en la ronda
+    if not isinstance(nickname, str) or not nickname.strip() or len(nickname) > MAX_NICKNAME:
+        raise BoletoInvalido('Nickname invalido')
+    if not isinstance(numeros, (list, tuple)):
+        raise BoletoInvalido('Formato de numeros invalido')
+
+    mascara = 0
+    for n in numeros:
+        # bool es subclase de int: se rechaza explicitamente
+        if not isinstance(n, int) or isinstance(n, bool):
+            raise BoletoInvalido('Los numeros deben ser enteros')
+        if n < NUMERO_MIN or n > NUMERO_MAX:
+            raise BoletoInvalido(f'Los numeros deben estar entre {NUMERO_MIN} y {NUMERO_MAX}')
+        mascara |= 1 << (n - 1)
+
+    spots = mascara.bit_count()
+    if spots == 0:
+        raise BoletoInvalido('Debes seleccionar al menos 1 numero')
+    if spots > MAX_NUMEROS_BOLETO:
+        raise BoletoInvalido(f'Puedes seleccionar maximo {MAX_NUMEROS_BOLETO} numeros')
+
+    return Boleto(
+        nickname=nickname,
+        numeros=tuple(mascara_a_numeros(mascara)),
+        mascara=mascara,
+    )
+
+
+def liquidar_ronda(boletos, numeros_ganadores, tabla):
+    mascara_ganadora = numeros_a_mascara(numeros_ganadores)
+
+    boletos = list(boletos)
+    aciertos = [(b.mascara & mascara_ganadora).bit_count() for b in boletos]
+    puntos = tabla.puntos_lote([b.spots for b in boletos], aciertos)
+
+    resultados = [
+        {
+            'nickname': boleto.nickname,
+            'aciertos': aciertos_boleto,
+            'puntos': puntos_boleto,
+            'numeros': list(boleto.numeros)
+        }
+        for boleto, aciertos_boleto, puntos_boleto in zip(boletos, aciertos, puntos)
+    ]
+
+    resultados.sort(key=lambda x: x['puntos'], reverse=True)
+    return resultados
@@ -0,0 +1,26 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from keno.diario import DESCARTADAS, diario
+
+
+class Command(BaseCommand):
+    help = 'Reaplica en la base las rondas de diarios de liquidación huérfanos (procesos terminados)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--descartadas', action='store_true',
+            help=f'Reintenta también las rondas apartadas en {DESCARTADAS}'
+        )
+
+    def handle(self, *args, **options):
+        # Los diarios de procesos vivos están bloqueados y no se tocan
+        aplicadas = async_to_sync(diario.recuperar)()
+        self.stdout.write(f'Directorio: {diario.directorio}')
+        self.stdout.write(self.style.SUCCESS(f'Rondas guardadas: {aplicadas}'))
+
+        if options['descartadas']:
+            guardadas, fallidas = async_to_sync(diario.reaplicar_descartadas)()
+            self.stdout.write(self.style.SUCCESS(f'Descartadas guardadas: {guardadas}'))
+            if fallidas:
+                self.stderr.write(f'Siguen sin entrar: {fallidas} (quedan en {DESCARTADAS})')
@@ -0,0 +1,77 @@
+import random
+import time
+from copy import deepcopy
+
+from django.core.management.base import BaseCommand
+
+from keno.difusion import codificar
+from keno.liquidacion import NUMEROS_POR_SORTEO, liquidar_ronda, parsear_boleto
+from keno.pagos import TABLA_CLASICA
+
+
+class Command(BaseCommand):
+    help = 'Compara el CPU por difusión de sorteo_completado: JSON por receptor vs. una vez'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jugadores', type=int, default=1000)
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def handle(self, *args, **options):
+        jugadores = options['jugadores']
+        repeticiones = options['repeticiones']
+
+        boletos = [
+            parsear_boleto(f'jugador{i}', random.sample(range(1, 81), random.randint(1, 20)))
+            for i in range(jugadores)
+        ]
+        numeros_ganadores = random.sample(range(1, 81), NUMEROS_POR_SORTEO)
+        resultados = liquidar_ronda(boletos, numeros_ganadores, TABLA_CLASICA)
+
+        payload = {'numeros_ganadores': numeros_ganadores, 'resultados': resultados}
+        evento_datos = {'type': 'sorteo_completado', **payload}
+        evento_texto = {'type': 'sorteo_completado', 'texto': codificar('sorteo_completado', payload)}
+
+        # Codificación, igual con cualquier capa. Antes: cada consumidor hacía
+        # json.dumps del evento. Ahora: una vez, al difundir.
+        def codificar_por_receptor():
+            for _ in range(jugadores):
+                codificar('sorteo_completado', payload)
+
+        def codificar_una_vez():
+            codificar('sorteo_completado', payload)
+
+        # Transporte, solo la capa en memoria: hace deepcopy del evento por
+        # receptor. Copiar el dict recorre todos los resultados; copiar el
+        # str es devolver la referencia. Con Redis la capa serializa el
+        # evento en ambos casos y esta parte no aplica.
+        def copiar_datos():
+            for _ in range(jugadores):
+                deepcopy(evento_datos)
+
+        def copiar_texto():
+            for _ in range(jugadores):
+                deepcopy(evento_texto)
+
+        cod_antes = self.medir(codificar_por_receptor, repeticiones)
+        cod_ahora = self.medir(codificar_una_vez, repeticiones)
+        capa_antes = self.medir(copiar_datos, repeticiones)
+        capa_ahora = self.medir(copiar_texto, repeticiones)
+
+        self.stdout.write(f'Jugadores por sala: {jugadores} (ms CPU por difusión)')
+        self.stdout.write(f'{"":<28} {"antes":>9} {"ahora":>9} {"mejora":>7}')
+        for nombre, antes, ahora in (
+            ('Codificación JSON', cod_antes, cod_ahora),
+            ('Copia en capa en memoria', capa_antes, capa_ahora),
+            ('Total con capa en memoria', cod_antes + capa_antes, cod_ahora + capa_ahora),
+        ):
+            self.stdout.write(f'{nombre:<28} {antes * 1000:>9.2f} {ahora * 1000:>9.2f} {antes / ahora:>6.1f}x')
+        self.stdout.write(
+            'Con Redis solo se ahorra la codificación: la capa serializa el evento '
+            'en ambos casos (no medido aquí) y ese costo no cambia'
+        )
+
+    def medir(self, funcion, repeticiones):
+        inicio = time.process_time()
+        for _ in range(repeticiones):
+            funcion()
+        return (time.process_time() - inicio) / repeticiones
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+from asgiref.sync import SyncToAsync
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from keno import repositorio
+from keno.basedatos import base_descartable
+from keno.estado import EstadoStore, MemoriaBackend
+from keno.models import Jugador, Sala
+from keno.pagos import tabla_para_sala
+from keno.presencia import Presencia, escritor
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados)) - 1))]
+
+
+class Command(BaseCommand):
+    help = 'Compara la cola del executor de la base: un salto por consulta vs. repositorio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--eventos', type=int, default=500)
+        parser.add_argument('--concurrencia', type=int, default=100)
+
+    def handle(self, *args, **options):
+        # Base descartable en archivo con WAL (ver basedatos.py); las consultas
+        # síncronas de los consumidores van al single_thread_executor de
+        # asgiref, como bajo el servidor ASGI
+        with base_descartable():
+            self.sala, self.usuarios, self.jugadores = self.crear_datos(options['eventos'])
+            asyncio.run(self.correr(options['concurrencia']))
+
+    def crear_datos(self, cantidad):
+        usuarios = User.objects.bulk_create([
+            User(username=f'bench{i}', password='!') for i in range(cantidad)
+        ])
+        jugadores = Jugador.objects.bulk_create([
+            Jugador(user=user, nickname=user.username) for user in usuarios
+        ])
+        sala = Sala.objects.create(codigo='BENCH', creador=jugadores[0])
+        sala.jugadores.add(*jugadores)
+        return sala, usuarios, jugadores
+
+    async def correr(self, concurrencia):
+        self.stdout.write(
+            f'{"Evento":<38} {"p50 ms":>8} {"p95 ms":>8} {"cola max":>8} {"cola media":>10} {"eventos/s":>10}'
+        )
+        sala_id = self.sala.id
+
+        # --- Desconexión: código original, cinco saltos por evento ---
+        async def desconectar_antes(user):
+            sala = await database_sync_to_async(Sala.objects.get)(id=sala_id)
+            jugador = await database_sync_to_async(Jugador.objects.get)(user=user)
+            await database_sync_to_async(sala.jugadores.remove)(jugador)
+            players = await database_sync_to_async(
+                lambda: [j.nickname for j in Sala.objects.get(id=sala_id).jugadores.all().distinct()]
+            )()
+            if not players:
+                sala.activa = False
+                await database_sync_to_async(sala.save)()
+
+        await self.medir('desconexión (consultas separadas)', desconectar_antes, self.usuarios, concurrencia)
+        await database_sync_to_async(self.sala.jugadores.add)(*self.jugadores)
+
+        # --- Desconexión actual: roster en el store y escritura en lote ---
+        presencia = Presencia(EstadoStore(MemoriaBackend()), str(sala_id))
+        await presencia.sembrar()
+
+        async def desconectar_ahora(user):
+            # Los miembros sembrados desde la base tienen el canal 'db'
+            await presencia.salir('db', user)
+
+        await self.medir('desconexión (roster + lote)', desconectar_ahora, self.usuarios, concurrencia)
+        if escritor.tarea is not None:
+            escritor.tarea.cancel()
+        await self.medir('  escritura en lote de la anterior', lambda _: escritor.vaciar(), [None], 1)
+
+        # --- Entrada con cambios pendientes: escribir y leer la sala ---
+        lotes = [({sala_id: {user.id: True}}, set()) for user in self.usuarios]
+
+        async def sembrar_antes(lote):
+            await repositorio.aplicar_membresia(*lote)
+            await database_sync_to_async(lambda: list(repositorio._miembros(sala_id)))()
+
+        async def sembrar_ahora(lote):
+            await repositorio.aplicar_y_leer_miembros(*lote, sala_id)
+
+        await self.medir('sembrar (escribir + leer)', sembrar_antes, lotes, concurrencia)
+        await self.medir('sembrar (un salto)', sembrar_ahora, lotes, concurrencia)
+
+        # --- Sala y tabla de pagos del sorteo ---
+        @database_sync_to_async
+        def sala_y_tabla_antes(_):
+            sala = Sala.objects.filter(id=sala_id).select_related('tabla_pagos').first()
+            return sala, tabla_para_sala(sala)
+
+        await self.medir('sala y tabla (sync, 2 consultas)', sala_y_tabla_antes, self.usuarios, concurrencia)
+        await self.medir('sala y tabla (ORM async, 1 consulta)',
+                         lambda _: repositorio.sala_y_tabla(sala_id), self.usuarios, concurrencia)
+
+    async def medir(self, nombre, evento, argumentos, concurrencia):
+        cola = SyncToAsync.single_thread_executor._work_queue
+        muestras, latencias = [], []
+        terminado = asyncio.Event()
+
+        async def muestrear():
+            while not terminado.is_set():
+                muestras.append(cola.qsize())
+                await asyncio.sleep(0.001)
+
+        limite = asyncio.Semaphore(concurrencia)
+
+        async def uno(argumento):
+            async with limite:
+                inicio = time.perf_counter()
+                await evento(argumento)
+                latencias.append(time.perf_counter() - inicio)
+
+        monitor = asyncio.create_task(muestrear())
+        inicio = time.perf_counter()
+        await asyncio.gather(*(uno(argumento) for argumento in argumentos))
+        duracion = time.perf_counter() - inicio
+        terminado.set()
+        await monitor
+
+        self.stdout.write(
+            f'{nombre:<38} {percentil(latencias, 50) * 1000:>8.2f} {percentil(latencias, 95) * 1000:>8.2f} '
+            f'{max(muestras):>8} {sum(muestras) / len(muestras):>10.1f} {len(latencias) / duracion:>10.0f}'
+        )
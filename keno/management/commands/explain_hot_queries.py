@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from keno.models import Apuesta, Jugador, Sala
+
+
+class Command(BaseCommand):
+    help = 'Muestra el plan de ejecución de las consultas más frecuentes'
+
+    def consultas(self):
+        jugador = Jugador.objects.order_by('id').values_list('id', flat=True).first() or 1
+        return [
+            ('Sala activa (sala / liquidación)',
+             Sala.objects.filter(activa=True).order_by('pk')[:1]),
+            ('Login por email',
+             User.objects.filter(email='jugador@keno.test')),
+            ('Ranking por puntos',
+             Jugador.objects.order_by('-puntos_totales', 'id')[:50]),
+            ('Historial de apuestas por jugador y partida',
+             Apuesta.objects.filter(jugador_id=jugador).order_by('partida')),
+        ]
+
+    def handle(self, *args, **options):
+        for nombre, queryset in self.consultas():
+            self.stdout.write(self.style.MIGRATE_HEADING(nombre))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain())
+            self.stdout.write('')
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import random
+import re
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import path
+
+from keno.basedatos import base_descartable
+from keno.binario import SUBPROTOCOLO
+from keno.consumer import GameConsumer, SalaConsumer
+from keno.diario import diario
+from keno.estado import EstadoStore, MemoriaBackend
+from keno.models import Jugador, Sala
+from keno.presencia import VENTANA_DELTAS, escritor
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+# ============================================================
+#   PRUEBA DE CARGA DE LOS CONSUMIDORES
+# ============================================================
+#
+# Simula N jugadores por sala dentro del mismo proceso: cada uno entra al
+# lobby (SalaConsumer), abre el juego (GameConsumer), confirma su boleto y
+# espera el sorteo. Corre sobre una base de prueba descartable, así que no
+# toca los datos reales.
+#
+# Mide:
+#   - latencia desde que el jugador confirma hasta que le llega su
+#     sorteo_completado (p50/p95/p99)
+#   - latencia de entrada al lobby (hasta recibir sala_snapshot)
+#   - mensajes entregados a los clientes por segundo
+#   - pico de memoria del proceso
+
+TIPO = re.compile(r'"type":\s*"([a-z_]+)"')
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def memoria_pico_mb():
+    if resource is None:
+        return None
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ConUsuario:
+    # Reemplaza al AuthMiddlewareStack: fija el usuario del scope
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        return await self.app(dict(scope, user=self.user), receive, send)
+
+
+class Cliente:
+    # Un jugador simulado. Un lector por conexión vacía la cola de salida,
+    # cuenta mensajes y marca cuándo llega cada tipo que se está esperando.
+
+    def __init__(self, comunicador):
+        self.comunicador = comunicador
+        self.recibidos = 0
+        self.esperas = {}
+        self.tarea = None
+
+    async def conectar(self, timeout):
+        conectado, _ = await self.comunicador.connect(timeout=timeout)
+        if not conectado:
+            raise RuntimeError('Conexión rechazada')
+        self.tarea = asyncio.create_task(self.leer())
+
+    async def leer(self):
+        cola = self.comunicador.output_queue
+        while True:
+            mensaje = await cola.get()
+            if mensaje['type'] != 'websocket.send':
+                return
+            ahora = time.perf_counter()
+            self.recibidos += 1
+
+            if mensaje.get('bytes') is not None:
+                tipo = 'sorteo_completado'
+            else:
+                # Solo el tipo: no se paga el json.loads de cada resultado
+                encontrado = TIPO.search(mensaje['text'], 0, 64)
+                tipo = encontrado.group(1) if encontrado else None
+
+            espera = self.esperas.pop(tipo, None)
+            if espera is not None and not espera.done():
+                espera.set_result(ahora)
+
+    def esperar(self, tipo):
+        espera = asyncio.get_running_loop().create_future()
+        self.esperas[tipo] = espera
+        return espera
+
+    async def enviar(self, **mensaje):
+        await self.comunicador.send_to(text_data=json.dumps(mensaje))
+
+    async def cerrar(self):
+        await self.comunicador.disconnect()
+        if self.tarea is not None:
+            self.tarea.cancel()
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga: N jugadores por sala en SalaConsumer y GameConsumer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jugadores', type=int, nargs='+', default=[10, 100, 500],
+                            help='Jugadores por sala; uno o varios valores')
+        parser.add_argument('--salas', type=int, default=1)
+        parser.add_argument('--rondas', type=int, default=3)
+        parser.add_argument('--binario', action='store_true',
+                            help=f'Los clientes negocian {SUBPROTOCOLO}')
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--json', action='store_true',
+                            help='Una línea JSON por corrida (para comparar versiones)')
+
+    def handle(self, *args, **options):
+        # Las rondas de la prueba se anotan en un diario temporal: con ids de
+        # la base de prueba, nunca deben reaplicarse en la base real
+        with tempfile.TemporaryDirectory() as directorio, override_settings(KENO_DIARIO_DIR=directorio):
+            with base_descartable():
+                async_to_sync(self.correr_todo)(options)
+
+    async def correr_todo(self, options):
+        try:
+            await self.correr_corridas(options)
+        finally:
+            # El diario se vuelca antes de destruir la base de prueba
+            await diario.esperar()
+
+    async def correr_corridas(self, options):
+        if not options['json']:
+            self.stdout.write(
+                f'{"Jugadores":>9} {"Salas":>5} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                f'{"lobby p95":>9} {"msgs/s":>9} {"pico MB":>8} {"perdidos":>8}'
+            )
+        for jugadores in options['jugadores']:
+            resultado = await self.correr(jugadores, options)
+            if options['json']:
+                self.stdout.write(json.dumps(resultado))
+            else:
+                pico = resultado['memoria_pico_mb']
+                self.stdout.write(
+                    f'{resultado["jugadores"]:>9} {resultado["salas"]:>5} '
+                    f'{resultado["p50_ms"]:>8.1f} {resultado["p95_ms"]:>8.1f} {resultado["p99_ms"]:>8.1f} '
+                    f'{resultado["lobby_p95_ms"]:>9.1f} {resultado["mensajes_por_segundo"]:>9.0f} '
+                    f'{"n/d" if pico is None else f"{pico:.0f}":>8} {resultado["perdidos"]:>8}'
+                )
+
+    async def correr(self, jugadores, options):
+        salas, rondas, timeout = options['salas'], options['rondas'], options['timeout']
+
+        # Estado en memoria nuevo por corrida; la capa de canales es la configurada
+        store = EstadoStore(MemoriaBackend())
+        juego = URLRouter([path('ws/game/<int:sala_id>/', GameConsumer.as_asgi(store=store))])
+        lobby = URLRouter([path('ws/sala/<str:sala_id>/', SalaConsumer.as_asgi(store=store))])
+
+        grupos = await self.crear_jugadores(jugadores, salas)
+        subprotocolos = [SUBPROTOCOLO] if options['binario'] else None
+
+        inicio = time.perf_counter()
+        clientes = []
+        latencias_lobby = []
+        latencias = []
+        perdidos = 0
+
+        for sala, usuarios in grupos:
+            en_lobby, lobby_ms = await self.entrar_lobby(lobby, sala, usuarios, timeout)
+            latencias_lobby.extend(lobby_ms)
+            en_juego = []
+            for user in usuarios:
+                cliente = Cliente(WebsocketCommunicator(
+                    ConUsuario(juego, user), f'/ws/game/{sala.id}/', subprotocols=subprotocolos
+                ))
+                await cliente.conectar(timeout)
+                en_juego.append(cliente)
+            clientes.append((sala, usuarios, en_lobby, en_juego))
+
+        # Las salas juegan en paralelo, cada una sus rondas en orden
+        por_sala = await asyncio.gather(*(
+            self.jugar(usuarios, en_juego, rondas, timeout)
+            for _, usuarios, _, en_juego in clientes
+        ))
+        for lat, sin_sorteo in por_sala:
+            latencias.extend(lat)
+            perdidos += sin_sorteo
+
+        duracion = time.perf_counter() - inicio
+        mensajes = sum(
+            cliente.recibidos
+            for _, _, en_lobby, en_juego in clientes
+            for cliente in en_lobby + en_juego
+        )
+
+        for _, _, en_lobby, en_juego in clientes:
+            await asyncio.gather(*(cliente.cerrar() for cliente in en_lobby + en_juego))
+        # Deltas y membresías pendientes antes de pasar a la siguiente corrida
+        await asyncio.sleep(VENTANA_DELTAS * 2)
+        await escritor.vaciar()
+
+        return {
+            'jugadores': jugadores,
+            'salas': salas,
+            'rondas': rondas,
+            'binario': options['binario'],
+            'p50_ms': percentil(latencias, 50) * 1000,
+            'p95_ms': percentil(latencias, 95) * 1000,
+            'p99_ms': percentil(latencias, 99) * 1000,
+            'lobby_p95_ms': percentil(latencias_lobby, 95) * 1000,
+            'mensajes': mensajes,
+            'mensajes_por_segundo': mensajes / duracion if duracion else 0.0,
+            'duracion_s': duracion,
+            'memoria_pico_mb': memoria_pico_mb(),
+            'perdidos': perdidos,
+        }
+
+    async def entrar_lobby(self, lobby, sala, usuarios, timeout):
+        clientes, latencias = [], []
+        for user in usuarios:
+            cliente = Cliente(WebsocketCommunicator(ConUsuario(lobby, user), f'/ws/sala/{sala.id}/'))
+            inicio = time.perf_counter()
+            # El snapshot es el primer mensaje: se lee antes de arrancar el lector
+            conectado, _ = await cliente.comunicador.connect(timeout=timeout)
+            if not conectado:
+                raise RuntimeError('Conexión rechazada')
+            await cliente.comunicador.receive_from(timeout=timeout)
+            latencias.append(time.perf_counter() - inicio)
+            cliente.recibidos = 1
+            cliente.tarea = asyncio.create_task(cliente.leer())
+            clientes.append(cliente)
+        return clientes, latencias
+
+    async def jugar(self, usuarios, clientes, rondas, timeout):
+        latencias, perdidos = [], 0
+        for _ in range(rondas):
+            # Todos confirman a la vez
+            confirmaciones = [cliente.esperar('seleccion_confirmada') for cliente in clientes]
+            sorteos = [cliente.esperar('sorteo_completado') for cliente in clientes]
+            enviados = []
+            for user, cliente in zip(usuarios, clientes):
+                enviados.append(time.perf_counter())
+                await cliente.enviar(
+                    type='numeros_seleccionados',
+                    nickname=user.username,
+                    numeros=random.sample(range(1, 81), random.randint(1, 10))
+                )
+            await asyncio.wait_for(asyncio.gather(*confirmaciones), timeout)
+
+            await clientes[0].enviar(type='iniciar_sorteo')
+            hechos, _ = await asyncio.wait(sorteos, timeout=timeout)
+            for enviado, sorteo in zip(enviados, sorteos):
+                if sorteo in hechos:
+                    latencias.append(sorteo.result() - enviado)
+                else:
+                    sorteo.cancel()
+                    perdidos += 1
+        return latencias, perdidos
+
+    async def crear_jugadores(self, jugadores, salas):
+
+        @database_sync_to_async
+        def crear():
+            prefijo = f'carga{User.objects.count()}_'
+            base = Sala.objects.count()
+            # Contraseña inutilizable: evita el hash, que domina con miles de usuarios
+            usuarios = User.objects.bulk_create([
+                User(username=f'{prefijo}{i}', password='!')
+                for i in range(jugadores * salas)
+            ])
+            perfiles = Jugador.objects.bulk_create([
+                Jugador(user=user, nickname=user.username) for user in usuarios
+            ])
+            grupos = []
+            for s in range(salas):
+                miembros = usuarios[s * jugadores:(s + 1) * jugadores]
+                sala = Sala.objects.create(
+                    codigo=f'CARGA{base + s}',
+                    creador=perfiles[s * jugadores]
+                )
+                grupos.append((sala, miembros))
+            return grupos
+
+        return await crear()
@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from keno.models import TablaPagos
+from keno.pagos import compilar, tabla_para_sala
+
+try:
+    import numpy as np
+
+    from keno.simulacion import resumir, simular
+except ImportError:   # numpy está en requirements.txt; solo lo usa este comando
+    np = None
+
+
+class Command(BaseCommand):
+    help = 'Monte Carlo vectorizado: RTP y frecuencia de aciertos por cantidad de spots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rondas', type=int, default=10_000_000)
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--tabla', help='Versión de TablaPagos; por defecto la vigente')
+        parser.add_argument('--apuesta', type=float, default=1,
+                            help='Puntos apostados por boleto (para el RTP)')
+        parser.add_argument('--semilla', type=int, help='Para repetir una corrida exacta')
+        parser.add_argument('--distribucion', action='store_true',
+                            help='Muestra la frecuencia de cada cantidad de aciertos')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('simulate_keno necesita numpy (pip install -r requirements.txt)')
+
+        tabla = self.tabla(options['tabla'])
+        rondas, procesos = options['rondas'], max(1, options['procesos'])
+
+        # Una SeedSequence hija por proceso: flujos independientes y repetibles
+        semillas = np.random.SeedSequence(options['semilla']).spawn(procesos)
+        partes = [rondas // procesos + (1 if i < rondas % procesos else 0) for i in range(procesos)]
+
+        inicio = time.perf_counter()
+        if procesos == 1:
+            histograma = simular(semillas[0], partes[0])
+        else:
+            with ProcessPoolExecutor(max_workers=procesos) as executor:
+                histograma = sum(executor.map(simular, semillas, partes))
+        duracion = time.perf_counter() - inicio
+
+        self.stdout.write(
+            f'Tabla {tabla.version} | {rondas:,} rondas | {procesos} proceso(s) | '
+            f'{duracion:.1f} s ({rondas / duracion:,.0f} rondas/s)'
+        )
+        self.stdout.write(f'{"Spots":>5} {"RTP":>9} {"IC 95%":>10} {"P(premio)":>10}')
+        for fila in resumir(histograma, tabla.pagos, options['apuesta']):
+            self.stdout.write(
+                f'{fila["spots"]:>5} {fila["rtp"]:>9.4f} {"±" + format(fila["ic95"], ".4f"):>10} '
+                f'{fila["prob_premio"]:>10.4%}'
+            )
+            if options['distribucion']:
+                self.stdout.write('      ' + '  '.join(
+                    f'{aciertos}:{frecuencia:.2e}' for aciertos, frecuencia in enumerate(fila['frecuencias'])
+                ))
+
+    def tabla(self, version):
+        if version is None:
+            return tabla_para_sala(None)
+        try:
+            return compilar(TablaPagos.objects.get(version=version))
+        except TablaPagos.DoesNotExist:
+            raise CommandError(f'No existe la tabla de pagos {version!r}')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from keno.mascaras import numeros_de_columnas
+from keno.models import Partida
+from keno.sorteo import compromiso_de, derivar_numeros
+
+
+class Command(BaseCommand):
+    help = 'Re-deriva los números de cada partida desde su semilla y comprueba el compromiso'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partida', type=int, nargs='+', help='Solo estas partidas (id)')
+
+    def handle(self, *args, **options):
+        partidas = Partida.objects.exclude(semilla='').order_by('id')
+        if options['partida']:
+            partidas = partidas.filter(id__in=options['partida'])
+
+        verificadas = 0
+        fallidas = []
+        filas = partidas.values_list('id', 'semilla', 'compromiso', 'sorteados_bajos', 'sorteados_altos')
+        for partida_id, semilla, compromiso, bajos, altos in filas.iterator(chunk_size=2000):
+            try:
+                semilla = bytes.fromhex(semilla)
+            except ValueError:
+                fallidas.append((partida_id, 'semilla ilegible'))
+                continue
+
+            if compromiso_de(semilla) != compromiso:
+                fallidas.append((partida_id, 'el compromiso no corresponde a la semilla'))
+            # Se guarda el conjunto, no el orden de salida
+            elif sorted(derivar_numeros(semilla)) != numeros_de_columnas(bajos, altos):
+                fallidas.append((partida_id, 'los números no salen de la semilla'))
+            else:
+                verificadas += 1
+
+        sin_semilla = Partida.objects.filter(semilla='').count()
+        self.stdout.write(f'Verificadas: {verificadas}')
+        self.stdout.write(f'Sin semilla (anteriores al commit-reveal): {sin_semilla}')
+
+        for partida_id, motivo in fallidas:
+            self.stderr.write(f'Partida {partida_id}: {motivo}')
+        if fallidas:
+            raise CommandError(f'{len(fallidas)} partida(s) no verifican')
+        self.stdout.write(self.style.SUCCESS('Todos los sorteos verifican'))
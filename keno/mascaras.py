@@ -0,0 +1,78 @@
+from django.db import models
+from django.db.models import F, Q
+from django.db.models.lookups import Exact, GreaterThan
+
+from .liquidacion import mascara_a_numeros, numeros_a_mascara
+
+# ============================================================
+#   CONJUNTOS DE NUMEROS COMO MASCARAS DE BITS EN LA BASE
+# ============================================================
+#
+# Un conjunto de números 1..80 es una máscara de 80 bits (bit n-1 →
+# número n). No entra en un entero de 64 bits con signo, así que se guarda
+# en dos columnas BigInteger de 40 bits: <prefijo>_bajos (1..40) y
+# <prefijo>_altos (41..80).
+#
+# El modelo expone el conjunto como lista ordenada con conjunto_numeros(),
+# y el QuerySet filtra con operaciones de bits en SQL, sin leer las filas:
+#   Apuesta.objects.con_numero(17)
+#   Partida.objects.con_todos([3, 17, 42])
+
+BITS_MITAD = 40
+MASCARA_MITAD = (1 << BITS_MITAD) - 1
+
+
+def dividir(mascara):
+    return mascara & MASCARA_MITAD, mascara >> BITS_MITAD
+
+
+def unir(bajos, altos):
+    return bajos | (altos << BITS_MITAD)
+
+
+def columnas(prefijo):
+    return f'{prefijo}_bajos', f'{prefijo}_altos'
+
+
+def numeros_de_columnas(bajos, altos):
+    return mascara_a_numeros(unir(bajos, altos))
+
+
+def conjunto_numeros(prefijo):
+    # property: Django acepta properties como argumentos del constructor,
+    # así que Modelo(numeros=[...]) y create(numeros=[...]) siguen valiendo
+    bajos, altos = columnas(prefijo)
+
+    def leer(self):
+        return numeros_de_columnas(getattr(self, bajos), getattr(self, altos))
+
+    def escribir(self, numeros):
+        parte_baja, parte_alta = dividir(numeros_a_mascara(numeros))
+        setattr(self, bajos, parte_baja)
+        setattr(self, altos, parte_alta)
+
+    return property(leer, escribir)
+
+
+class NumerosQuerySet(models.QuerySet):
+    prefijo_numeros = None   # lo define cada modelo
+
+    def _partes(self, numeros):
+        return zip(columnas(self.prefijo_numeros), dividir(numeros_a_mascara(numeros)))
+
+    def con_todos(self, numeros):
+        # (columna & parte) == parte en cada mitad
+        return self.filter(*[
+            Exact(F(columna).bitand(parte), parte)
+            for columna, parte in self._partes(numeros) if parte
+        ])
+
+    def con_alguno(self, numeros):
+        condicion = Q()
+        for columna, parte in self._partes(numeros):
+            if parte:
+                condicion |= Q(GreaterThan(F(columna).bitand(parte), 0))
+        return self.filter(condicion) if condicion else self.none()
+
+    def con_numero(self, numero):
+        return self.con_todos([numero])
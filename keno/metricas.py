@@ -0,0 +1,278 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+logger = logging.getLogger('keno')
+
+# ============================================================
+#   METRICAS (FORMATO DE TEXTO DE PROMETHEUS)
+# ============================================================
+#
+# Contadores, gauges e histogramas en memoria del proceso, expuestos en
+# /metrics sin depender de un colector externo. Con varios workers cada
+# proceso expone los suyos (Prometheus los agrega por instancia).
+#
+# Los consumidores heredan de ConsumidorMedido, que envuelve cada mensaje
+# (receive, connect/disconnect y handlers de grupo) y registra:
+#   - duración por consumidor y tipo de mensaje
+#   - consultas ORM y su tiempo durante ese mensaje
+#   - conexiones activas por sala
+# difundir() registra la latencia de group_send en la capa de canales.
+# El control de flujo (flujo.py) cuenta mensajes limitados, frames
+# descartados y clientes lentos desconectados.
+
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BUCKETS_LOTE = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ''
+    pares = ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores))
+    return '{' + pares + '}'
+
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series = {}
+        REGISTRO.append(self)
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+        with self._lock:
+            series = list(self._series.items())
+        for valores, serie in sorted(series):
+            lineas.extend(self._lineas(valores, serie))
+        return lineas
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def sumar(self, *valores, cantidad=1):
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + cantidad
+
+    def _lineas(self, valores, total):
+        yield f'{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}'
+
+
+class Gauge(Metrica):
+    tipo = 'gauge'
+
+    def sumar(self, *valores, cantidad=1):
+        with self._lock:
+            total = self._series.get(valores, 0) + cantidad
+            # Las series en cero se quitan: las salas cerradas no se acumulan
+            if total:
+                self._series[valores] = total
+            else:
+                self._series.pop(valores, None)
+
+    def _lineas(self, valores, total):
+        yield f'{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}'
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(buckets)
+
+    def observar(self, valor, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                # [conteo por bucket (+Inf al final), suma, total]
+                serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _lineas(self, valores, serie):
+        conteos, suma, total = serie
+        acumulado = 0
+        for limite, conteo in zip(self.buckets + ('+Inf',), conteos):
+            acumulado += conteo
+            etiquetas = _etiquetas(self.etiquetas + ('le',), valores + (limite,))
+            yield f'{self.nombre}_bucket{etiquetas} {acumulado}'
+        etiquetas = _etiquetas(self.etiquetas, valores)
+        yield f'{self.nombre}_sum{etiquetas} {suma}'
+        yield f'{self.nombre}_count{etiquetas} {total}'
+
+
+REGISTRO = []
+
+duracion_mensaje = Histograma(
+    'keno_mensaje_duracion_segundos',
+    'Tiempo de manejo de un mensaje del consumidor',
+    ('consumidor', 'tipo')
+)
+consultas_mensaje = Histograma(
+    'keno_mensaje_consultas',
+    'Consultas ORM ejecutadas al manejar un mensaje',
+    ('consumidor', 'tipo'),
+    buckets=BUCKETS_CONSULTAS
+)
+tiempo_consultas_mensaje = Histograma(
+    'keno_mensaje_consultas_segundos',
+    'Tiempo en consultas ORM al manejar un mensaje',
+    ('consumidor', 'tipo')
+)
+conexiones = Gauge(
+    'keno_conexiones_activas',
+    'WebSockets abiertos por consumidor y sala',
+    ('consumidor', 'sala')
+)
+envio_capa = Histograma(
+    'keno_capa_envio_segundos',
+    'Latencia de envío a la capa de canales',
+    ('operacion',)
+)
+lote_escritura = Histograma(
+    'keno_escritura_lote',
+    'Trabajos confirmados en una misma transacción de la cola de escritura',
+    buckets=BUCKETS_LOTE
+)
+espera_escritura = Histograma(
+    'keno_escritura_espera_segundos',
+    'Tiempo desde que se encola una escritura hasta que se confirma'
+)
+pendientes_diario = Gauge(
+    'keno_diario_pendientes',
+    'Rondas anotadas en el diario y aún no volcadas a la base'
+)
+mensajes_limitados = Contador(
+    'keno_mensajes_limitados_total',
+    'Mensajes de clientes descartados por superar el límite de ritmo',
+    ('consumidor', 'tipo')
+)
+descartes_salida = Contador(
+    'keno_salida_descartes_total',
+    'Frames de salida reemplazados o descartados por atraso del cliente',
+    ('consumidor', 'motivo')
+)
+clientes_lentos = Contador(
+    'keno_clientes_lentos_total',
+    'Conexiones cerradas por quedarse atrás en la cola de salida',
+    ('consumidor',)
+)
+errores = Contador(
+    'keno_errores_total',
+    'Excepciones capturadas y registradas',
+    ('origen',)
+)
+
+
+def exponer():
+    lineas = []
+    for metrica in REGISTRO:
+        lineas.extend(metrica.exponer())
+    return '\n'.join(lineas) + '\n'
+
+
+def registrar_error(origen, mensaje):
+    # Reemplaza los print(): queda en el log con traceback y en /metrics
+    errores.sumar(origen)
+    logger.exception(mensaje)
+
+
+# ------------------------------------------------------------
+#   CONSULTAS ORM POR MENSAJE
+# ------------------------------------------------------------
+#
+# Cada mensaje abre una medición en un ContextVar; asgiref copia el
+# contexto al hilo de database_sync_to_async, así que el execute_wrapper
+# de la conexión suma sobre el mismo objeto.
+
+_medicion = ContextVar('keno_medicion', default=None)
+
+
+class MedicionConsultas:
+    __slots__ = ('cantidad', 'segundos')
+
+    def __init__(self):
+        self.cantidad = 0
+        self.segundos = 0.0
+
+
+def contar_consulta(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.cantidad += 1
+        medicion.segundos += time.perf_counter() - inicio
+
+
+def instalar_en_conexion(sender, connection, **kwargs):
+    # Receptor de connection_created (ver apps.py)
+    if contar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(contar_consulta)
+
+
+# ------------------------------------------------------------
+#   CONSUMIDORES
+# ------------------------------------------------------------
+
+TIPO_JSON = re.compile(r'"type"\s*:\s*"([A-Za-z_]{1,40})"')
+
+
+class ConsumidorMedido:
+    # Mixin para AsyncWebsocketConsumer. tipos_cliente limita las etiquetas
+    # a los tipos conocidos: un cliente no puede crear series arbitrarias.
+    tipos_cliente = frozenset()
+
+    def tipo_metrica(self, message):
+        tipo = message['type']
+        if tipo != 'websocket.receive':
+            return tipo
+        if message.get('bytes') is not None:
+            return 'binario'
+        encontrado = TIPO_JSON.search(message.get('text') or '', 0, 128)
+        if encontrado and encontrado.group(1) in self.tipos_cliente:
+            return encontrado.group(1)
+        return 'desconocido'
+
+    def sala_metrica(self):
+        return str(self.scope['url_route']['kwargs'].get('sala_id', ''))
+
+    async def dispatch(self, message):
+        consumidor = type(self).__name__
+        tipo = self.tipo_metrica(message)
+        medicion = MedicionConsultas()
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            duracion_mensaje.observar(time.perf_counter() - inicio, consumidor, tipo)
+            consultas_mensaje.observar(medicion.cantidad, consumidor, tipo)
+            tiempo_consultas_mensaje.observar(medicion.segundos, consumidor, tipo)
+            _medicion.reset(token)
+
+    async def websocket_connect(self, message):
+        conexiones.sumar(type(self).__name__, self.sala_metrica())
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        conexiones.sumar(type(self).__name__, self.sala_metrica(), cantidad=-1)
+        await super().websocket_disconnect(message)
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def crear_tabla_clasica(apps, schema_editor):
+    # Copia congelada de las reglas de calcular_puntos
+    TablaPagos = apps.get_model('keno', 'TablaPagos')
+    pagos = [[0] * 21 for _ in range(21)]
+    pagos[1][1] = 3
+    pagos[2][2] = 15
+    pagos[3][3], pagos[3][2] = 45, 5
+    pagos[4][4], pagos[4][3], pagos[4][2] = 100, 10, 2
+    pagos[5][5], pagos[5][4], pagos[5][3] = 500, 50, 5
+    for spots in range(6, 21):
+        multiplicador = 50 if spots <= 10 else 100 if spots <= 15 else 150
+        for aciertos in range(spots + 1):
+            pagos[spots][aciertos] = aciertos * multiplicador
+    TablaPagos.objects.get_or_create(
+        version='clasica-v1',
+        defaults={'pagos': pagos, 'predeterminada': True}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TablaPagos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=30, unique=True)),
+                ('pagos', models.JSONField()),
+                ('predeterminada', models.BooleanField(default=False)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='apuesta',
+            name='tabla_pagos',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='keno.tablapagos'),
+        ),
+        migrations.AddField(
+            model_name='sala',
+            name='tabla_pagos',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='keno.tablapagos'),
+        ),
+        migrations.RunPython(crear_tabla_clasica, migrations.RunPython.noop),
+    ]
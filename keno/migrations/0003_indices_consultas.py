@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0002_tabla_pagos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='apuesta',
+            index=models.Index(fields=['jugador', 'partida'], name='apuesta_jugador_partida_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jugador',
+            index=models.Index(fields=['-puntos_totales', 'id'], name='jugador_puntos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sala',
+            index=models.Index(condition=models.Q(('activa', True)), fields=['id'], name='sala_activa_idx'),
+        ),
+        # login_view busca User por email; auth_user no trae ese indice
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS keno_auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX IF EXISTS keno_auth_user_email_idx',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0003_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partida',
+            name='compromiso',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='partida',
+            name='semilla',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
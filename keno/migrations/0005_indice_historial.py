@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0004_sorteo_commit_reveal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='partida',
+            index=models.Index(fields=['sala', '-fecha_inicio', '-id'], name='partida_sala_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+LOTE = 2000
+
+
+# Copias congeladas de keno.mascaras: la migración no depende del código actual
+def _a_columnas(numeros):
+    mascara = 0
+    for n in numeros or ():
+        if isinstance(n, int) and 1 <= n <= 80:
+            mascara |= 1 << (n - 1)
+    return mascara & ((1 << 40) - 1), mascara >> 40
+
+
+def _a_lista(bajos, altos):
+    mascara = bajos | (altos << 40)
+    return [n for n in range(1, 81) if mascara >> (n - 1) & 1]
+
+
+def _convertir(modelo, origen, bajos, altos):
+    pendientes = []
+    for fila in modelo.objects.only('id', origen).iterator(chunk_size=LOTE):
+        parte_baja, parte_alta = _a_columnas(getattr(fila, origen))
+        setattr(fila, bajos, parte_baja)
+        setattr(fila, altos, parte_alta)
+        pendientes.append(fila)
+        if len(pendientes) == LOTE:
+            modelo.objects.bulk_update(pendientes, [bajos, altos])
+            pendientes = []
+    if pendientes:
+        modelo.objects.bulk_update(pendientes, [bajos, altos])
+
+
+def _restaurar(modelo, destino, bajos, altos):
+    pendientes = []
+    for fila in modelo.objects.only('id', bajos, altos).iterator(chunk_size=LOTE):
+        setattr(fila, destino, _a_lista(getattr(fila, bajos), getattr(fila, altos)))
+        pendientes.append(fila)
+        if len(pendientes) == LOTE:
+            modelo.objects.bulk_update(pendientes, [destino])
+            pendientes = []
+    if pendientes:
+        modelo.objects.bulk_update(pendientes, [destino])
+
+
+def listas_a_mascaras(apps, schema_editor):
+    _convertir(apps.get_model('keno', 'Partida'), 'numeros_sorteados', 'sorteados_bajos', 'sorteados_altos')
+    _convertir(apps.get_model('keno', 'Apuesta'), 'numeros_elegidos', 'elegidos_bajos', 'elegidos_altos')
+
+
+def mascaras_a_listas(apps, schema_editor):
+    # El orden de salida de las bolas no se guarda en la máscara: vuelve ordenado
+    _restaurar(apps.get_model('keno', 'Partida'), 'numeros_sorteados', 'sorteados_bajos', 'sorteados_altos')
+    _restaurar(apps.get_model('keno', 'Apuesta'), 'numeros_elegidos', 'elegidos_bajos', 'elegidos_altos')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0005_indice_historial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partida',
+            name='sorteados_bajos',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='partida',
+            name='sorteados_altos',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='apuesta',
+            name='elegidos_bajos',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='apuesta',
+            name='elegidos_altos',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(listas_a_mascaras, mascaras_a_listas),
+        migrations.RemoveField(
+            model_name='partida',
+            name='numeros_sorteados',
+        ),
+        migrations.RemoveField(
+            model_name='apuesta',
+            name='numeros_elegidos',
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:33
+
+from collections import deque
+
+from django.db import migrations, models
+
+LOTE = 2000
+
+
+# Copia congelada: recorre las partidas existentes una vez y deja las
+# estadísticas como si la liquidación las hubiera mantenido desde siempre
+def _numeros(bajos, altos):
+    mascara = bajos | (altos << 40)
+    return [n for n in range(1, 81) if mascara >> (n - 1) & 1]
+
+
+def reconstruir(apps, schema_editor):
+    Partida = apps.get_model('keno', 'Partida')
+    EstadisticaNumero = apps.get_model('keno', 'EstadisticaNumero')
+
+    veces = [0] * 81
+    ultimo = [0] * 81
+    recientes = deque(maxlen=1000)
+    sorteo = 0
+    filas = (
+        Partida.objects.filter(finalizada=True).order_by('id')
+        .values_list('sorteados_bajos', 'sorteados_altos')
+    )
+    for bajos, altos in filas.iterator(chunk_size=LOTE):
+        sorteo += 1
+        numeros = _numeros(bajos, altos)
+        recientes.append(numeros)
+        for n in numeros:
+            veces[n] += 1
+            ultimo[n] = sorteo
+
+    ventanas = {100: [0] * 81, 1000: [0] * 81}
+    for posicion, numeros in enumerate(reversed(recientes)):
+        for tamano, conteo in ventanas.items():
+            if posicion < tamano:
+                for n in numeros:
+                    conteo[n] += 1
+
+    EstadisticaNumero.objects.bulk_create([EstadisticaNumero(numero=0, veces=sorteo)] + [
+        EstadisticaNumero(
+            numero=n, veces=veces[n], ultimo_sorteo=ultimo[n],
+            ultimos_100=ventanas[100][n], ultimos_1000=ventanas[1000][n],
+        )
+        for n in range(1, 81)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0006_numeros_como_mascaras'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaNumero',
+            fields=[
+                ('numero', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('veces', models.IntegerField(default=0)),
+                ('ultimos_100', models.IntegerField(default=0)),
+                ('ultimos_1000', models.IntegerField(default=0)),
+                ('ultimo_sorteo', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(reconstruir, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0007_estadisticas_numeros'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='partida',
+            constraint=models.UniqueConstraint(condition=models.Q(('compromiso', ''), _negated=True), fields=('compromiso',), name='partida_compromiso_unico'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keno', '0008_compromiso_unico'),
+    ]
+
+    # auto_now_add → default: la columna no cambia (el default es de Python),
+    # así que solo se actualiza el estado y SQLite no reconstruye la tabla
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='partida',
+                    name='fecha_inicio',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .mascaras import NumerosQuerySet, conjunto_numeros
+
 
 class Jugador(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -8,35 +13,124 @@ class Jugador(models.Model):
     partidas_jugadas = models.IntegerField(default=0)
     fecha_registro = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Ranking: orden por puntos descendente
+            models.Index(fields=['-puntos_totales', 'id'], name='jugador_puntos_idx'),
+        ]
+
     def __str__(self):
         return self.nickname
 
+
+class TablaPagos(models.Model):
+    version = models.CharField(max_length=30, unique=True)
+    pagos = models.JSONField()  # Matriz pagos[spots][aciertos], 21 x 21
+    predeterminada = models.BooleanField(default=False)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def clean(self):
+        from .pagos import validar_pagos
+        try:
+            validar_pagos(self.pagos)
+        except ValueError as e:
+            raise ValidationError({'pagos': str(e)})
+
+    def __str__(self):
+        return f"Tabla de pagos {self.version}"
+
+
 class Sala(models.Model):
     codigo = models.CharField(max_length=10, unique=True)
     creador = models.ForeignKey(Jugador, on_delete=models.CASCADE, related_name='salas_creadas')
     jugadores = models.ManyToManyField(Jugador, related_name='salas')
     max_jugadores = models.IntegerField(default=10)
+    tabla_pagos = models.ForeignKey(TablaPagos, on_delete=models.PROTECT, null=True, blank=True)
     activa = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Sala.objects.filter(activa=True).first(): solo las salas activas
+            models.Index(fields=['id'], condition=models.Q(activa=True), name='sala_activa_idx'),
+        ]
+
     def __str__(self):
         return f"Sala {self.codigo}"
 
+
+class PartidaQuerySet(NumerosQuerySet):
+    prefijo_numeros = 'sorteados'
+
+
+class ApuestaQuerySet(NumerosQuerySet):
+    prefijo_numeros = 'elegidos'
+
+
 class Partida(models.Model):
     sala = models.ForeignKey(Sala, on_delete=models.CASCADE)
-    numeros_sorteados = models.JSONField(default=list)  # Lista de 20 números ganadores
-    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    # 20 números ganadores como máscara de 80 bits (ver mascaras.py)
+    sorteados_bajos = models.BigIntegerField(default=0)
+    sorteados_altos = models.BigIntegerField(default=0)
+    # Hora del sorteo; la liquidación la pasa explícita (ver diario.py)
+    fecha_inicio = models.DateTimeField(default=timezone.now, editable=False)
     finalizada = models.BooleanField(default=False)
+    # Commit-reveal (ver sorteo.py); vacíos en partidas anteriores
+    semilla = models.CharField(max_length=64, blank=True, default='')
+    compromiso = models.CharField(max_length=64, blank=True, default='')
+
+    objects = PartidaQuerySet.as_manager()
+    numeros_sorteados = conjunto_numeros('sorteados')
+
+    class Meta:
+        indexes = [
+            # Historial de una sala, de la partida más nueva a la más vieja
+            models.Index(fields=['sala', '-fecha_inicio', '-id'], name='partida_sala_fecha_idx'),
+        ]
+        constraints = [
+            # Identifica la ronda al reaplicar el diario de liquidaciones
+            models.UniqueConstraint(
+                fields=['compromiso'],
+                condition=~models.Q(compromiso=''),
+                name='partida_compromiso_unico'
+            ),
+        ]
 
     def __str__(self):
         return f"Partida {self.id} - Sala {self.sala.codigo}"
 
+
 class Apuesta(models.Model):
     partida = models.ForeignKey(Partida, on_delete=models.CASCADE)
     jugador = models.ForeignKey(Jugador, on_delete=models.CASCADE)
-    numeros_elegidos = models.JSONField(default=list)  # Lista de hasta 20 números
+    # Hasta 20 números como máscara de 80 bits (ver mascaras.py)
+    elegidos_bajos = models.BigIntegerField(default=0)
+    elegidos_altos = models.BigIntegerField(default=0)
     aciertos = models.IntegerField(default=0)
     puntos_ganados = models.IntegerField(default=0)
+    tabla_pagos = models.ForeignKey(TablaPagos, on_delete=models.PROTECT, null=True, blank=True)
+
+    objects = ApuestaQuerySet.as_manager()
+    numeros_elegidos = conjunto_numeros('elegidos')
+
+    class Meta:
+        indexes = [
+            # Historial de un jugador por partida
+            models.Index(fields=['jugador', 'partida'], name='apuesta_jugador_partida_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.jugador.nickname} - {self.aciertos} aciertos"
+
+
+class EstadisticaNumero(models.Model):
+    # Una fila por número (1..80) mantenida por la liquidación; la fila 0
+    # lleva en 'veces' la cantidad de sorteos contados (ver estadisticas.py)
+    numero = models.PositiveSmallIntegerField(primary_key=True)
+    veces = models.IntegerField(default=0)
+    ultimos_100 = models.IntegerField(default=0)
+    ultimos_1000 = models.IntegerField(default=0)
+    ultimo_sorteo = models.IntegerField(default=0)   # 0: nunca salió
 
     def __str__(self):
-        return f"{self.jugador.nickname} - {self.aciertos} aciertos"
\ No newline at end of file
+        return f"Número {self.numero}: {self.veces} veces"
@@ -0,0 +1,107 @@
+from array import array
+from operator import itemgetter
+
+from .liquidacion import MAX_NUMEROS_BOLETO
+
+# ============================================================
+#   TABLAS DE PAGOS (PAYTABLES)
+# ============================================================
+#
+# Una tabla de pagos es una matriz pagos[spots][aciertos] de
+# (MAX_NUMEROS_BOLETO + 1) x (MAX_NUMEROS_BOLETO + 1). Se compila una
+# sola vez a un arreglo plano para que cada consulta sea un indice.
+
+DIMENSION = MAX_NUMEROS_BOLETO + 1
+VERSION_CLASICA = 'clasica-v1'
+# Tope de un pago: cabe en el u32 del frame binario y, sumado ronda a
+# ronda, tarda en acercarse al IntegerField de los acumulados
+MAX_PAGO = 1_000_000
+
+
+def pagos_clasicos():
+    # Reglas originales de GameConsumer.calcular_puntos
+    pagos = [[0] * DIMENSION for _ in range(DIMENSION)]
+    pagos[1][1] = 3
+    pagos[2][2] = 15
+    pagos[3][3], pagos[3][2] = 45, 5
+    pagos[4][4], pagos[4][3], pagos[4][2] = 100, 10, 2
+    pagos[5][5], pagos[5][4], pagos[5][3] = 500, 50, 5
+    for spots in range(6, DIMENSION):
+        multiplicador = 50 if spots <= 10 else 100 if spots <= 15 else 150
+        for aciertos in range(spots + 1):
+            pagos[spots][aciertos] = aciertos * multiplicador
+    return pagos
+
+
+def validar_pagos(pagos):
+    if not isinstance(pagos, list) or len(pagos) != DIMENSION:
+        raise ValueError(f'La tabla debe tener {DIMENSION} filas (0 a {MAX_NUMEROS_BOLETO} spots)')
+
+    for spots, fila in enumerate(pagos):
+        if not isinstance(fila, list) or len(fila) != DIMENSION:
+            raise ValueError(f'La fila {spots} debe tener {DIMENSION} columnas')
+        for aciertos, valor in enumerate(fila):
+            if not isinstance(valor, int) or isinstance(valor, bool) or valor < 0:
+                raise ValueError(f'Pago invalido en [{spots}][{aciertos}]')
+            if valor > MAX_PAGO:
+                raise ValueError(f'[{spots}][{aciertos}]: el pago maximo es {MAX_PAGO}')
+            if aciertos > spots and valor != 0:
+                raise ValueError(f'[{spots}][{aciertos}]: no puede haber mas aciertos que spots')
+
+
+class TablaPagosCompilada:
+    __slots__ = ('id', 'version', 'pagos', 'plano')
+
+    def __init__(self, version, pagos, id=None):
+        validar_pagos(pagos)
+        self.id = id
+        self.version = version
+        self.pagos = tuple(tuple(fila) for fila in pagos)
+        self.plano = array('q', (valor for fila in pagos for valor in fila))
+
+    def puntos(self, spots, aciertos):
+        return self.plano[spots * DIMENSION + aciertos]
+
+    def puntos_lote(self, spots, aciertos):
+        # Consulta de todo un lote de boletos en una sola pasada
+        indices = [s * DIMENSION + a for s, a in zip(spots, aciertos)]
+        if not indices:
+            return []
+        if len(indices) == 1:
+            return [self.plano[indices[0]]]
+        return list(itemgetter(*indices)(self.plano))
+
+
+TABLA_CLASICA = TablaPagosCompilada(VERSION_CLASICA, pagos_clasicos())
+
+# id de TablaPagos → tabla compilada. Las tablas son inmutables una vez
+# creadas, así que la cache nunca queda obsoleta.
+_compiladas = {}
+
+
+def tabla_compilada(tabla_id):
+    # La tabla ya compilada en este proceso, o None
+    return _compiladas.get(tabla_id)
+
+
+def compilar(tabla):
+    compilada = _compiladas.get(tabla.id)
+    if compilada is None:
+        compilada = TablaPagosCompilada(tabla.version, tabla.pagos, id=tabla.id)
+        _compiladas[tabla.id] = compilada
+    return compilada
+
+
+def tabla_para_sala(sala):
+    from .models import TablaPagos
+
+    if sala is not None and sala.tabla_pagos_id is not None:
+        ya_compilada = tabla_compilada(sala.tabla_pagos_id)
+        if ya_compilada is not None:
+            return ya_compilada
+        return compilar(sala.tabla_pagos)
+
+    tabla = TablaPagos.objects.filter(predeterminada=True).order_by('-id').first()
+    if tabla is None:
+        return TABLA_CLASICA
+    return compilar(tabla)
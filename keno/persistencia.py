@@ -0,0 +1,113 @@
+from collections import defaultdict
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .estadisticas import registrar_sorteo, tablero
+from .metricas import errores, logger
+from .models import Apuesta, Jugador, Partida, Sala
+from .ranking import leaderboard
+from .sorteo import Sorteo
+
+# ============================================================
+#   PERSISTENCIA DE RONDAS (EN LOTE)
+# ============================================================
+#
+# Una ronda cuesta un numero fijo de consultas sin importar cuantos
+# jugadores tenga: crear Partida, traer jugadores, bulk_create de
+# apuestas y un solo UPDATE con F() para los acumulados. Las estadísticas
+# de números suman otras cinco (ver estadisticas.py).
+
+
+def _incremento(por_jugador, campo):
+    # Agrupa ids por valor de incremento para que el CASE sea corto
+    grupos = defaultdict(list)
+    for jugador_id, valor in por_jugador.items():
+        grupos[valor].append(jugador_id)
+
+    if len(grupos) == 1:
+        (valor,) = grupos
+        return F(campo) + Value(valor)
+
+    return F(campo) + Case(
+        *[When(id__in=ids, then=Value(valor)) for valor, ids in grupos.items()],
+        default=Value(0),
+    )
+
+
+def guardar_ronda(sala_id, tabla_id, numeros_ganadores, resultados, sorteo=None, fecha=None):
+    # fecha: hora del sorteo; una ronda volcada tarde no toma la hora del volcado
+    with transaction.atomic():
+        # Primero: ordena las liquidaciones concurrentes (ver estadisticas.py)
+        cambio = registrar_sorteo(numeros_ganadores)
+
+        partida = Partida.objects.create(
+            sala_id=sala_id,
+            numeros_sorteados=numeros_ganadores,
+            finalizada=True,
+            fecha_inicio=fecha or timezone.now(),
+            semilla=sorteo.semilla.hex() if sorteo else '',
+            compromiso=sorteo.compromiso if sorteo else ''
+        )
+
+        nicknames = {resultado['nickname'] for resultado in resultados}
+        jugadores = Jugador.objects.only('id', 'nickname').in_bulk(nicknames, field_name='nickname')
+
+        apuestas = []
+        puntos = defaultdict(int)
+        partidas = defaultdict(int)
+        for resultado in resultados:
+            jugador = jugadores.get(resultado['nickname'])
+            if jugador is None:
+                continue
+
+            apuestas.append(Apuesta(
+                partida=partida,
+                jugador=jugador,
+                numeros_elegidos=resultado['numeros'],
+                aciertos=resultado['aciertos'],
+                puntos_ganados=resultado['puntos'],
+                tabla_pagos_id=tabla_id
+            ))
+            puntos[jugador.id] += resultado['puntos']
+            partidas[jugador.id] += 1
+
+        if apuestas:
+            Apuesta.objects.bulk_create(apuestas)
+            Jugador.objects.filter(id__in=list(partidas)).update(
+                puntos_totales=_incremento(puntos, 'puntos_totales'),
+                partidas_jugadas=_incremento(partidas, 'partidas_jugadas')
+            )
+
+        transaction.on_commit(lambda: leaderboard.aplicar(partida.id, dict(puntos)))
+        transaction.on_commit(lambda: tablero.aplicar(cambio))
+
+    return partida
+
+
+def guardar_lote(entradas):
+    # Vuelca entradas del diario de liquidaciones (ver diario.py). Es
+    # idempotente: una ronda se reconoce por el compromiso de su sorteo
+    # (único en Partida) y las que ya están guardadas se saltan.
+    compromisos = [entrada['sorteo']['compromiso'] for entrada in entradas]
+    guardadas = set(Partida.objects.filter(compromiso__in=compromisos).values_list('compromiso', flat=True))
+    salas = set(Sala.objects.filter(id__in={entrada['sala'] for entrada in entradas}).values_list('id', flat=True))
+
+    aplicadas = 0
+    for entrada in entradas:
+        sorteo = Sorteo.desde_dict(entrada['sorteo'])
+        if sorteo.compromiso in guardadas:
+            continue
+        if entrada['sala'] not in salas:
+            # La sala se borró después de jugar: la ronda no tiene dónde ir
+            errores.sumar('diario')
+            logger.error('Ronda %s de una sala inexistente (%s)', sorteo.compromiso, entrada['sala'])
+            continue
+        # Las entradas anteriores a la fecha en el diario toman la hora actual
+        fecha = datetime.fromisoformat(entrada['fecha']) if 'fecha' in entrada else None
+        guardar_ronda(entrada['sala'], entrada['tabla'], entrada['numeros'], entrada['resultados'], sorteo, fecha)
+        guardadas.add(sorteo.compromiso)
+        aplicadas += 1
+    return aplicadas
@@ -0,0 +1,186 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+
+from . import repositorio
+from .difusion import difundir
+from .metricas import registrar_error
+
+# ============================================================
+#   PRESENCIA DE JUGADORES EN SALA
+# ============================================================
+#
+# El roster de cada sala vive en el store (mapas nickname → 1 y
+# nickname → canales abiertos) y se siembra desde Sala.jugadores una sola
+# vez. Conectar y desconectar son O(1) y no tocan la base: los cambios de
+# membresía se acumulan y se escriben en lote cada INTERVALO_ESCRITURA
+# segundos.
+#
+# Los clientes reciben un snapshot del roster al conectar y después solo
+# deltas (entran/salen) numerados; los cambios que llegan juntos se
+# agrupan en un solo mensaje.
+
+INTERVALO_ESCRITURA = 2
+VENTANA_DELTAS = 0.1
+
+
+class EscritorMembresia:
+    # Cambios pendientes de este worker: sala_id → {user_id: presente}
+
+    def __init__(self):
+        self.pendientes = {}
+        self.desactivar = set()
+        self.tarea = None
+
+    def registrar(self, sala_id, user_id, presente):
+        self.pendientes.setdefault(sala_id, {})[user_id] = presente
+        if presente:
+            self.desactivar.discard(sala_id)
+        self._programar()
+
+    def sala_vacia(self, sala_id):
+        self.desactivar.add(sala_id)
+        self._programar()
+
+    def _programar(self):
+        if self.tarea is None or self.tarea.done():
+            self.tarea = asyncio.create_task(self._escribir_periodicamente())
+
+    async def _escribir_periodicamente(self):
+        while self.pendientes or self.desactivar:
+            await asyncio.sleep(INTERVALO_ESCRITURA)
+            await self.vaciar()
+
+    def _tomar(self, sala_id):
+        cambios = self.pendientes.pop(sala_id, None)
+        desactivar = {sala_id} & self.desactivar
+        self.desactivar -= desactivar
+        return ({sala_id: cambios} if cambios else {}), desactivar
+
+    async def vaciar(self):
+        lote, self.pendientes = self.pendientes, {}
+        desactivar, self.desactivar = self.desactivar, set()
+        if not lote and not desactivar:
+            return
+        try:
+            await repositorio.aplicar_membresia(lote, desactivar)
+        except Exception:
+            registrar_error('membresia', 'Error guardando membresia de sala')
+
+    async def miembros(self, sala_id):
+        # Lo pendiente de la sala se escribe antes de leerla, en el mismo
+        # salto a la base; sin pendientes es una lectura asíncrona
+        lote, desactivar = self._tomar(sala_id)
+        if not lote and not desactivar:
+            return await repositorio.miembros_sala(sala_id)
+        try:
+            return await repositorio.aplicar_y_leer_miembros(lote, desactivar, sala_id)
+        except Exception:
+            registrar_error('membresia', 'Error guardando membresia de sala')
+            return await repositorio.miembros_sala(sala_id)
+
+
+escritor = EscritorMembresia()
+
+
+class Presencia:
+    #   presencia:<sala>:roster            → nickname → 1 (orden de llegada)
+    #   presencia:<sala>:canales:<nick>    → canal (o 'db') → 1
+    #   presencia:<sala>:sembrada          → 1 cuando ya se cargó desde la base
+    #   presencia:<sala>:seq               → secuencia de deltas del roster
+    __slots__ = ('store', 'sala_id', 'prefijo', 'mapa')
+
+    def __init__(self, store, sala_id):
+        self.store = store
+        self.sala_id = sala_id
+        self.prefijo = f'presencia:{sala_id}:'
+        self.mapa = self.prefijo + 'roster'
+
+    def mapa_canales(self, nickname):
+        return f'{self.prefijo}canales:{nickname}'
+
+    async def sembrar(self):
+        valor, _ = await self.store.get(self.prefijo + 'sembrada')
+        if valor:
+            return
+
+        for user_id, nickname in await escritor.miembros(self.sala_id):
+            await self.store.hset(self.mapa_canales(nickname), 'db', 1)
+            await self.store.hset(self.mapa, nickname, 1)
+        await self.store.actualizar(self.prefijo + 'sembrada', lambda _: 1)
+
+    async def entrar(self, channel_name, user):
+        # Devuelve True si el jugador no estaba en el roster
+        canales = self.mapa_canales(user.username)
+        estaba = await self.store.hlen(canales) > 0
+        await self.store.hdel(canales, 'db')
+        await self.store.hset(canales, channel_name, 1)
+        if not estaba:
+            await self.store.hset(self.mapa, user.username, 1)
+        escritor.registrar(self.sala_id, user.id, True)
+        return not estaba
+
+    async def salir(self, channel_name, user):
+        # Devuelve True si el jugador ya no tiene conexiones en la sala
+        canales = self.mapa_canales(user.username)
+        await self.store.hdel(canales, channel_name)
+
+        # Sigue en la sala si tiene otra pestaña abierta
+        if await self.store.hlen(canales) > 0:
+            return False
+
+        await self.store.hdel(self.mapa, user.username)
+        escritor.registrar(self.sala_id, user.id, False)
+
+        if await self.store.hlen(self.mapa) == 0:
+            await self.store.borrar(self.prefijo)
+            escritor.sala_vacia(self.sala_id)
+        return True
+
+    async def jugadores(self):
+        return list(await self.store.hgetall(self.mapa))
+
+    async def snapshot(self):
+        seq, _ = await self.store.get(self.prefijo + 'seq')
+        return {'players': await self.jugadores(), 'seq': seq or 0}
+
+    async def siguiente_seq(self):
+        return await self.store.actualizar(self.prefijo + 'seq', lambda n: (n or 0) + 1)
+
+
+class DifusorRoster:
+    # Junta las altas y bajas de una sala durante VENTANA_DELTAS segundos
+    # y las manda en un solo sala_delta numerado.
+
+    def __init__(self):
+        self.pendientes = {}   # sala_id → {nickname: presente}
+        self.tareas = {}
+
+    def cambio(self, presencia, room_group_name, nickname, presente):
+        sala_id = presencia.sala_id
+        self.pendientes.setdefault(sala_id, {})[nickname] = presente
+        tarea = self.tareas.get(sala_id)
+        if tarea is None or tarea.done():
+            self.tareas[sala_id] = asyncio.create_task(
+                self._emitir(presencia, room_group_name)
+            )
+
+    async def _emitir(self, presencia, room_group_name):
+        await asyncio.sleep(VENTANA_DELTAS)
+        cambios = self.pendientes.pop(presencia.sala_id, {})
+        self.tareas.pop(presencia.sala_id, None)
+        if not cambios:
+            return
+
+        seq = await presencia.siguiente_seq()
+        await difundir(
+            get_channel_layer(),
+            room_group_name,
+            'sala_delta',
+            seq=seq,
+            entran=[nickname for nickname, presente in cambios.items() if presente],
+            salen=[nickname for nickname, presente in cambios.items() if not presente]
+        )
+
+
+difusor = DifusorRoster()
@@ -0,0 +1,51 @@
+import json
+from math import comb
+
+from .liquidacion import MAX_NUMEROS_BOLETO, NUMERO_MAX, NUMEROS_POR_SORTEO
+
+# ============================================================
+#   PROBABILIDADES EXACTAS (HIPERGEOMETRICA)
+# ============================================================
+#
+# P(k aciertos | s spots) = C(s, k) * C(80 - s, 20 - k) / C(80, 20)
+#
+# La matriz no depende de la tabla de pagos y se calcula una vez al
+# importar. El valor esperado sí depende de la tabla: se calcula una vez
+# por version y se guarda ya serializado, porque una tabla no cambia
+# después de creada.
+
+_TOTAL = comb(NUMERO_MAX, NUMEROS_POR_SORTEO)
+
+# PROBABILIDADES[s][k], s = 0..20, k = 0..20
+PROBABILIDADES = [
+    [
+        comb(spots, aciertos) * comb(NUMERO_MAX - spots, NUMEROS_POR_SORTEO - aciertos) / _TOTAL
+        for aciertos in range(MAX_NUMEROS_BOLETO + 1)
+    ]
+    for spots in range(MAX_NUMEROS_BOLETO + 1)
+]
+
+_por_version = {}
+
+
+def tabla_probabilidades(tabla):
+    # tabla: TablaPagosCompilada; devuelve el JSON listo para servir
+    texto = _por_version.get(tabla.version)
+    if texto is not None:
+        return texto
+
+    spots = []
+    for s in range(1, MAX_NUMEROS_BOLETO + 1):
+        probabilidades = PROBABILIDADES[s][:s + 1]
+        pagos = tabla.pagos[s][:s + 1]
+        spots.append({
+            'spots': s,
+            'probabilidades': probabilidades,
+            'pagos': list(pagos),
+            'esperado': sum(p * pago for p, pago in zip(probabilidades, pagos)),
+            'prob_premio': sum(p for p, pago in zip(probabilidades, pagos) if pago > 0),
+        })
+
+    texto = json.dumps({'version': tabla.version, 'spots': spots})
+    _por_version[tabla.version] = texto
+    return texto
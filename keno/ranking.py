@@ -0,0 +1,170 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.db.models import Case, F, FloatField, Max, Value, When
+from django.db.models.functions import Cast
+
+from .models import Jugador, Partida
+
+# ============================================================
+#   RANKING (CACHE ORDENADA, ACTUALIZADA POR LA LIQUIDACION)
+# ============================================================
+#
+# Se guarda en memoria una lista ordenada de (-puntos, id), partida en
+# bloques: mover a un jugador cuesta O(B + n/B) en vez de O(n). La
+# liquidación aplica los cambios de cada ronda sin recalcular todo. La
+# version es (ultima partida, ultimo jugador): si no coincide con la base
+# (otro worker liquidó, o hay jugadores nuevos) la cache se reconstruye.
+# Un cambio de puntos fuera de la liquidación (admin, shell) guarda el
+# Jugador con save(): post_save invalida la cache de este proceso.
+
+TAMANO_PAGINA = 50
+TAMANO_BLOQUE = 512
+
+
+class ListaOrdenada:
+    # Valores únicos y ordenados en bloques de TAMANO_BLOQUE a 2 x TAMANO_BLOQUE
+
+    def __init__(self, valores=()):
+        ordenados = sorted(valores)
+        self._bloques = [ordenados[i:i + TAMANO_BLOQUE] for i in range(0, len(ordenados), TAMANO_BLOQUE)]
+        self._maximos = [bloque[-1] for bloque in self._bloques]
+        self._largo = len(ordenados)
+
+    def __len__(self):
+        return self._largo
+
+    def agregar(self, valor):
+        if not self._bloques:
+            self._bloques, self._maximos = [[valor]], [valor]
+            self._largo = 1
+            return
+        i = min(bisect_left(self._maximos, valor), len(self._bloques) - 1)
+        bloque = self._bloques[i]
+        insort(bloque, valor)
+        self._maximos[i] = bloque[-1]
+        if len(bloque) > 2 * TAMANO_BLOQUE:
+            self._bloques[i:i + 1] = [bloque[:TAMANO_BLOQUE], bloque[TAMANO_BLOQUE:]]
+            self._maximos[i:i + 1] = [bloque[TAMANO_BLOQUE - 1], bloque[-1]]
+        self._largo += 1
+
+    def quitar(self, valor):
+        i = bisect_left(self._maximos, valor)
+        bloque = self._bloques[i]
+        del bloque[bisect_left(bloque, valor)]
+        if bloque:
+            self._maximos[i] = bloque[-1]
+        else:
+            del self._bloques[i], self._maximos[i]
+        self._largo -= 1
+
+    def menores(self, valor):
+        # Cuántos valores son menores que valor
+        i = bisect_left(self._maximos, valor)
+        cantidad = sum(len(bloque) for bloque in self._bloques[:i])
+        if i < len(self._bloques):
+            cantidad += bisect_left(self._bloques[i], valor)
+        return cantidad
+
+    def rebanada(self, inicio, fin):
+        valores = []
+        recorrido = 0
+        for bloque in self._bloques:
+            if recorrido >= fin:
+                break
+            if recorrido + len(bloque) > inicio:
+                valores.extend(bloque[max(0, inicio - recorrido):fin - recorrido])
+            recorrido += len(bloque)
+        return valores
+
+
+def version_actual():
+    ultima = Partida.objects.filter(finalizada=True).order_by('-id').values('id', 'fecha_inicio').first()
+    ultimo_jugador = Jugador.objects.aggregate(ultimo=Max('id'))['ultimo']
+    if ultima is None:
+        return (None, ultimo_jugador), None
+    return (ultima['id'], ultimo_jugador), ultima['fecha_inicio']
+
+
+class Leaderboard:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._orden = ListaOrdenada()   # (-puntos, id)
+        self._puntos = {}   # id → puntos
+
+    def sincronizar(self, version):
+        with self._lock:
+            if self.version == version:
+                return
+            self._puntos = dict(Jugador.objects.values_list('id', 'puntos_totales'))
+            self._orden = ListaOrdenada((-puntos, jugador_id) for jugador_id, puntos in self._puntos.items())
+            # Una ronda liquidada entre la lectura de version y la carga ya está
+            # en los puntos: con la version vieja, aplicar la sumaría dos veces.
+            # Esa carga sirve para esta página pero no se marca
+            actual, _ = version_actual()
+            self.version = version if actual == version else None
+
+    def invalidar(self):
+        with self._lock:
+            self.version = None
+
+    def aplicar(self, partida_id, cambios):
+        # cambios: jugador_id → puntos ganados en la ronda
+        with self._lock:
+            if self.version is None:
+                return
+            ultima_partida, ultimo_jugador = self.version
+            if ultima_partida is not None and partida_id != ultima_partida + 1:
+                # Falta alguna ronda (liquidada en otro worker): reconstruir
+                self.version = None
+                return
+
+            for jugador_id, delta in cambios.items():
+                anterior = self._puntos.get(jugador_id)
+                if anterior is None:
+                    self.version = None
+                    return
+                if not delta:
+                    continue
+                self._orden.quitar((-anterior, jugador_id))
+                self._puntos[jugador_id] = anterior + delta
+                self._orden.agregar((-(anterior + delta), jugador_id))
+
+            self.version = (partida_id, ultimo_jugador)
+
+    def total(self):
+        return len(self._orden)
+
+    def pagina(self, numero, tamano=TAMANO_PAGINA):
+        inicio = (numero - 1) * tamano
+        with self._lock:
+            return [jugador_id for _, jugador_id in self._orden.rebanada(inicio, inicio + tamano)]
+
+    def posicion(self, jugador_id):
+        # Cantidad de jugadores con más puntos + 1
+        with self._lock:
+            puntos = self._puntos.get(jugador_id)
+            if puntos is None:
+                return None
+            return self._orden.menores((-puntos,)) + 1
+
+
+leaderboard = Leaderboard()
+
+
+def invalidar_ranking(sender, **kwargs):
+    # Receptor de post_save / post_delete de Jugador (ver apps.py)
+    leaderboard.invalidar()
+
+
+def filas_pagina(ids):
+    # El promedio se calcula en la base, solo para las filas de la página
+    promedio = Case(
+        When(partidas_jugadas=0, then=Value(0.0)),
+        default=Cast('puntos_totales', FloatField()) / F('partidas_jugadas'),
+        output_field=FloatField()
+    )
+    jugadores = Jugador.objects.filter(id__in=ids).annotate(promedio=promedio).in_bulk()
+    return [jugadores[jugador_id] for jugador_id in ids if jugador_id in jugadores]
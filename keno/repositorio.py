@@ -0,0 +1,132 @@
+from django.db import transaction
+from django.db.models import Subquery
+
+from . import persistencia
+from .basedatos import cola_escritura
+from .models import Jugador, Sala, TablaPagos
+from .pagos import TABLA_CLASICA, compilar, tabla_compilada
+
+# ============================================================
+#   REPOSITORIO ASINCRONO DE LOS CONSUMIDORES
+# ============================================================
+#
+# Todo el acceso a la base desde los consumidores pasa por aquí, con una
+# sola ida al hilo de la base por evento:
+#   - las lecturas usan el ORM asíncrono (afirst, async for), una consulta
+#   - las escrituras necesitan transaction.atomic, que el ORM asíncrono no
+#     soporta: van en una sola función síncrona, un solo salto a la cola de
+#     escritura (ver basedatos.py)
+#
+# Antes cada consulta era su propio database_sync_to_async y con muchas
+# conexiones y desconexiones la cola del executor (un solo hilo) crecía.
+
+
+def _tabla_defecto():
+    return TablaPagos.objects.filter(predeterminada=True).order_by('-id').values('id')[:1]
+
+
+async def _tabla_por_id(tabla_id):
+    if tabla_id is None:
+        return TABLA_CLASICA
+    ya_compilada = tabla_compilada(tabla_id)
+    if ya_compilada is not None:
+        return ya_compilada
+    # Solo la primera vez por proceso: las tablas compiladas se cachean
+    return compilar(await TablaPagos.objects.aget(id=tabla_id))
+
+
+async def sala_y_tabla(sala_id):
+    # Sala, su tabla propia y la tabla por defecto en una sola consulta
+    sala = await (
+        Sala.objects
+        .select_related('tabla_pagos')
+        .annotate(tabla_defecto_id=Subquery(_tabla_defecto()))
+        .filter(id=sala_id)
+        .afirst()
+    )
+    if sala is None:
+        defecto = await _tabla_defecto().afirst()
+        return None, await _tabla_por_id(defecto['id'] if defecto else None)
+    if sala.tabla_pagos_id is not None:
+        return sala, compilar(sala.tabla_pagos)
+    return sala, await _tabla_por_id(sala.tabla_defecto_id)
+
+
+def _miembros(sala_id):
+    return (
+        Sala.jugadores.through.objects
+        .filter(sala_id=sala_id)
+        .order_by('id')
+        .values_list('jugador__user_id', 'jugador__nickname')
+    )
+
+
+async def nickname_de(user):
+    # El boleto juega con el nickname del usuario autenticado, nunca con
+    # el que manda el cliente
+    nickname = await Jugador.objects.filter(user_id=user.id).values_list('nickname', flat=True).afirst()
+    return nickname or user.username
+
+
+async def sala_existe(sala_id):
+    if not str(sala_id).isdigit():
+        return False
+    return await Sala.objects.filter(id=sala_id).aexists()
+
+
+async def miembros_sala(sala_id):
+    if not str(sala_id).isdigit():
+        return []
+    return [fila async for fila in _miembros(sala_id)]
+
+
+def _aplicar_membresia(lote, desactivar):
+    # lote: sala_id → {user_id: presente}; desactivar: salas que quedaron vacías
+    Miembro = Sala.jugadores.through
+    user_ids = {user_id for cambios in lote.values() for user_id in cambios}
+    jugadores = dict(Jugador.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    # Una sala inexistente haría fallar el lote entero en el COMMIT (las FK
+    # de SQLite son diferidas): se descarta antes de escribir
+    ids = [int(sala_id) for sala_id in lote if str(sala_id).isdigit()]
+    existentes = set(Sala.objects.filter(id__in=ids).values_list('id', flat=True))
+
+    with transaction.atomic():
+        for sala_id, cambios in lote.items():
+            if not str(sala_id).isdigit() or int(sala_id) not in existentes:
+                continue
+            salen = [jugadores[u] for u, presente in cambios.items() if not presente and u in jugadores]
+            entran = [jugadores[u] for u, presente in cambios.items() if presente and u in jugadores]
+
+            if salen:
+                Miembro.objects.filter(sala_id=sala_id, jugador_id__in=salen).delete()
+            if entran:
+                Miembro.objects.bulk_create(
+                    [Miembro(sala_id=sala_id, jugador_id=jugador_id) for jugador_id in entran],
+                    ignore_conflicts=True
+                )
+
+        ids = [sala_id for sala_id in desactivar if str(sala_id).isdigit()]
+        if ids:
+            Sala.objects.filter(id__in=ids).update(activa=False)
+
+
+async def aplicar_membresia(lote, desactivar):
+    return await cola_escritura.ejecutar(_aplicar_membresia, lote, desactivar)
+
+
+def _aplicar_y_leer_miembros(lote, desactivar, sala_id):
+    _aplicar_membresia(lote, desactivar)
+    if not str(sala_id).isdigit():
+        return []
+    return list(_miembros(sala_id))
+
+
+async def aplicar_y_leer_miembros(lote, desactivar, sala_id):
+    # Escribe lo pendiente de la sala y lee sus miembros en el mismo salto
+    return await cola_escritura.ejecutar(_aplicar_y_leer_miembros, lote, desactivar, sala_id)
+
+
+async def guardar_ronda(sala_id, tabla_id, numeros_ganadores, resultados, sorteo=None, fecha=None):
+    return await cola_escritura.ejecutar(
+        persistencia.guardar_ronda, sala_id, tabla_id, numeros_ganadores, resultados, sorteo, fecha
+    )
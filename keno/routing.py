@@ -2,6 +2,6 @@ from django.urls import path
 from . import consumer
 
 websocket_urlpatterns = [
-    path('ws/game/', consumer.GameConsumer.as_asgi()),
+    path('ws/game/<int:sala_id>/', consumer.GameConsumer.as_asgi()),
     path('ws/sala/<str:sala_id>/', consumer.SalaConsumer.as_asgi()),
 ]
\ No newline at end of file
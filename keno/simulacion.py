@@ -0,0 +1,68 @@
+import numpy as np
+
+from .liquidacion import MAX_NUMEROS_BOLETO, NUMERO_MAX, NUMEROS_POR_SORTEO
+
+# ============================================================
+#   SIMULACION MONTE CARLO VECTORIZADA
+# ============================================================
+#
+# Como el sorteo es uniforme, la distribución de aciertos solo depende de
+# cuántos números eligió el jugador, no de cuáles. Se fija el boleto de
+# s spots en los números 1..s y cada ronda simulada sirve para los 20
+# tamaños de boleto a la vez:
+#
+#   claves  = uniforme(lote, 80)          el sorteo son las 20 claves menores
+#   salio   = claves <= 20ª menor clave
+#   aciertos[:, s-1] = cumsum(salio[:, :20])[:, s-1]
+#
+# Cada proceso devuelve solo el histograma spots x aciertos; los pagos se
+# aplican después sobre el histograma (exacto y sin costo por ronda).
+
+LOTE = 200_000
+
+
+def simular(semilla, rondas, lote=LOTE):
+    # semilla: np.random.SeedSequence (o entero); devuelve histograma int64
+    # de forma (MAX_NUMEROS_BOLETO, MAX_NUMEROS_BOLETO + 1): fila s-1, columna aciertos
+    rng = np.random.default_rng(semilla)
+    histograma = np.zeros((MAX_NUMEROS_BOLETO, MAX_NUMEROS_BOLETO + 1), dtype=np.int64)
+    desplazamiento = np.arange(MAX_NUMEROS_BOLETO) * (MAX_NUMEROS_BOLETO + 1)
+
+    restantes = rondas
+    while restantes > 0:
+        n = min(lote, restantes)
+        claves = rng.random((n, NUMERO_MAX))
+        umbral = np.partition(claves, NUMEROS_POR_SORTEO - 1, axis=1)[:, NUMEROS_POR_SORTEO - 1:NUMEROS_POR_SORTEO]
+        salio = claves[:, :MAX_NUMEROS_BOLETO] <= umbral
+        aciertos = np.cumsum(salio, axis=1, dtype=np.int16)
+
+        # Un solo bincount para las 20 filas: índice plano spots x aciertos
+        indices = (aciertos + desplazamiento).ravel()
+        histograma += np.bincount(indices, minlength=histograma.size).reshape(histograma.shape)
+        restantes -= n
+
+    return histograma
+
+
+def resumir(histograma, pagos, apuesta=1):
+    # pagos: matriz [spots][aciertos] de la tabla (fila 0 sin uso)
+    pagos = np.asarray(pagos, dtype=np.float64)[1:]
+    rondas = histograma.sum(axis=1)
+    frecuencias = histograma / rondas[:, None]
+
+    media = (frecuencias * pagos).sum(axis=1)
+    varianza = (frecuencias * pagos ** 2).sum(axis=1) - media ** 2
+    error = np.sqrt(np.maximum(varianza, 0) / rondas)
+
+    filas = []
+    for indice in range(len(pagos)):
+        spots = indice + 1
+        filas.append({
+            'spots': spots,
+            'rondas': int(rondas[indice]),
+            'rtp': media[indice] / apuesta,
+            'ic95': 1.96 * error[indice] / apuesta,
+            'prob_premio': float(frecuencias[indice][pagos[indice] > 0].sum()),
+            'frecuencias': frecuencias[indice, :spots + 1].tolist(),
+        })
+    return filas
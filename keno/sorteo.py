@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import secrets
+from collections import deque
+from dataclasses import dataclass
+
+from .liquidacion import NUMERO_MAX, NUMERO_MIN, NUMEROS_POR_SORTEO
+
+# ============================================================
+#   MOTOR DE SORTEOS (COMMIT-REVEAL)
+# ============================================================
+#
+# Cada sorteo sale de una semilla de 32 bytes del CSPRNG del sistema
+# (secrets). Los números se derivan de la semilla de forma determinista,
+# así que cualquiera puede verificarlos:
+#
+#   compromiso = sha256(semilla)            se publica antes de la ronda
+#   numeros    = derivar_numeros(semilla)   la semilla se revela al final
+#
+# Derivación: flujo SHA-256 en modo contador sobre la semilla y un
+# Fisher-Yates parcial sobre 1..80 con rechazo para que cada índice sea
+# uniforme. El orden resultante es el orden de salida de las bolas.
+#
+# El pool guarda sorteos ya generados: iniciar_sorteo solo saca uno.
+
+BYTES_SEMILLA = 32
+TAMANO_POOL = 64
+DOMINIO = b'keno-sorteo-v1'
+
+
+def compromiso_de(semilla):
+    return hashlib.sha256(semilla).hexdigest()
+
+
+def _flujo(semilla):
+    contador = 0
+    while True:
+        yield from hashlib.sha256(DOMINIO + semilla + contador.to_bytes(8, 'big')).digest()
+        contador += 1
+
+
+def derivar_numeros(semilla, cantidad=NUMEROS_POR_SORTEO):
+    flujo = _flujo(semilla)
+    bolsa = list(range(NUMERO_MIN, NUMERO_MAX + 1))
+    for i in range(cantidad):
+        restantes = len(bolsa) - i
+        # Se descartan los bytes del tramo final para no sesgar el módulo
+        limite = 256 - 256 % restantes
+        byte = next(flujo)
+        while byte >= limite:
+            byte = next(flujo)
+        j = i + byte % restantes
+        bolsa[i], bolsa[j] = bolsa[j], bolsa[i]
+    return bolsa[:cantidad]
+
+
+@dataclass(frozen=True, slots=True)
+class Sorteo:
+    semilla: bytes
+    compromiso: str
+    numeros: tuple
+
+    @classmethod
+    def nuevo(cls):
+        semilla = secrets.token_bytes(BYTES_SEMILLA)
+        return cls(semilla, compromiso_de(semilla), tuple(derivar_numeros(semilla)))
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(bytes.fromhex(datos['semilla']), datos['compromiso'], tuple(datos['numeros']))
+
+    def como_dict(self):
+        # Forma serializable para el store compartido
+        return {'semilla': self.semilla.hex(), 'compromiso': self.compromiso, 'numeros': list(self.numeros)}
+
+
+class PoolSorteos:
+    # Buffer acotado de sorteos listos. Cuando baja de la mitad se rellena
+    # en el siguiente ciclo del event loop, fuera del mensaje que lo vació.
+
+    def __init__(self, tamano=TAMANO_POOL):
+        self.tamano = tamano
+        self._listos = deque()
+        self._rellenando = False
+
+    def __len__(self):
+        return len(self._listos)
+
+    def rellenar(self):
+        while len(self._listos) < self.tamano:
+            self._listos.append(Sorteo.nuevo())
+        self._rellenando = False
+
+    def tomar(self):
+        try:
+            sorteo = self._listos.popleft()
+        except IndexError:
+            # Pool vacío (arranque): se genera en línea
+            sorteo = Sorteo.nuevo()
+        if len(self._listos) < self.tamano // 2:
+            self._programar_relleno()
+        return sorteo
+
+    def _programar_relleno(self):
+        if self._rellenando:
+            return
+        self._rellenando = True
+        try:
+            asyncio.get_running_loop().call_soon(self.rellenar)
+        except RuntimeError:
+            self.rellenar()
+
+
+pool = PoolSorteos()
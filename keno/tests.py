@@ -1,101 +1,1735 @@
-from django.shortcuts import render, redirect
-from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.models import User
-from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-from .models import Jugador, Sala
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
 import random
-import string
-
-def index(request):
-    return render(request, "index.html")
-
-def login_view(request):
-    if request.method == 'POST':
-        email = request.POST.get('email')
-        password = request.POST.get('password')
-        
-        # Buscar usuario por email
-        try:
-            user = User.objects.get(email=email)
-            user = authenticate(request, username=user.username, password=password)
-            
-            if user is not None:
-                login(request, user)
-                return redirect('sala')
-            else:
-                messages.error(request, 'Contraseña incorrecta')
-        except User.DoesNotExist:
-            messages.error(request, 'Email no registrado')
-    
-    return render(request, "login.html")
-
-def register_view(request):
-    if request.method == 'POST':
-        username = request.POST.get('username')
-        email = request.POST.get('email')
-        password = request.POST.get('password')
-        
-        # Validaciones básicas
-        if User.objects.filter(username=username).exists():
-            messages.error(request, 'El nombre de usuario ya existe')
-            return render(request, "register.html")
-        
-        if User.objects.filter(email=email).exists():
-            messages.error(request, 'El email ya está registrado')
-            return render(request, "register.html")
-        
-        # Crear usuario
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password
-        )
-        
-        # Crear perfil de jugador
+import re
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from fractions import Fraction
+from math import comb
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+
+from . import repositorio, views
+from .binario import (
+    BOLETO, BYTES_MASCARA, SUBPROTOCOLO, FrameInvalido, codificar_sorteo, decodificar_boleto, mascara_a_bytes,
+)
+from .basedatos import ColaEscritura
+from .consumer import (
+    DURACION_TURNO, TAMANO_BUFFER, EstadoJuego, GameConsumer, SalaConsumer, soltar_turno, tomar_turno,
+)
+from .diario import Diario, diario
+from .estado import EstadoStore, MemoriaBackend, SQLiteBackend
+from .estadisticas import TableroNumeros, sorteos_contados, tablero
+from .flujo import CIERRE_LENTO, SALIDA_ALTA, SALIDA_MAXIMA, ColaSalida, ConsumidorRegulado, Cubeta
+from .historial import CursorInvalido, codificar_cursor, decodificar_cursor, pagina_partidas
+from .liquidacion import BoletoInvalido, liquidar_ronda, numeros_a_mascara, parsear_boleto
+from .metricas import Contador, Gauge, Histograma, exponer
+from .models import Apuesta, EstadisticaNumero, Jugador, Partida, Sala, TablaPagos
+from .pagos import (
+    DIMENSION, MAX_PAGO, TABLA_CLASICA, VERSION_CLASICA, TablaPagosCompilada,
+    compilar, pagos_clasicos, tabla_compilada, tabla_para_sala, validar_pagos,
+)
+from .persistencia import guardar_lote, guardar_ronda
+from .presencia import VENTANA_DELTAS, DifusorRoster, EscritorMembresia, Presencia
+from .ranking import TAMANO_BLOQUE, Leaderboard, ListaOrdenada, leaderboard, version_actual
+from .sorteo import Sorteo, compromiso_de, derivar_numeros
+
+
+@override_settings(KENO_DIARIO_DIR=tempfile.mkdtemp())
+class EstadoCompartidoTests(TransactionTestCase):
+    # Dos "workers": cada uno con su propio store y su propia conexión al
+    # mismo archivo SQLite, como dos procesos del servidor en el mismo host.
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.ruta = os.path.join(directorio, 'estado.sqlite3')
+
+        jugadores = []
+        self.usuarios = {}
+        for nickname in ('ana', 'bob'):
+            user = User.objects.create_user(nickname, f'{nickname}@keno.test', 'clave')
+            jugadores.append(Jugador.objects.create(user=user, nickname=nickname))
+            self.usuarios[nickname] = user
+        self.sala = Sala.objects.create(codigo='TEST01', creador=jugadores[0])
+
+    def aplicacion(self, store):
+        return URLRouter([
+            path('ws/game/<int:sala_id>/', GameConsumer.as_asgi(store=store)),
+        ])
+
+    def comunicador(self, aplicacion, url, nickname, subprotocols=None):
+        # Hace de AuthMiddlewareStack: el boleto juega con el usuario del scope
+        user = self.usuarios[nickname]
+
+        async def con_usuario(scope, receive, send):
+            return await aplicacion(dict(scope, user=user), receive, send)
+
+        return WebsocketCommunicator(con_usuario, url, subprotocols=subprotocols)
+
+    async def esperar_sorteo(self, comunicador):
+        # Un pedido que llega tras el sorteo recibe un error, no otro sorteo
+        while True:
+            mensaje = await comunicador.receive_json_from(timeout=5)
+            if mensaje['type'] == 'sorteo_completado':
+                return mensaje
+
+    def test_dos_consumidores_comparten_la_ronda(self):
+        worker_a = self.aplicacion(EstadoStore(SQLiteBackend(self.ruta)))
+        worker_b = self.aplicacion(EstadoStore(SQLiteBackend(self.ruta)))
+        url = f'/ws/game/{self.sala.id}/'
+
+        async def jugar():
+            ana = self.comunicador(worker_a, url, 'ana')
+            bob = self.comunicador(worker_b, url, 'bob')
+            await ana.connect()
+            await bob.connect()
+            await ana.receive_json_from()
+            await bob.receive_json_from()
+
+            await ana.send_json_to({'type': 'numeros_seleccionados', 'nickname': 'ana', 'numeros': [1, 2, 3]})
+            await ana.receive_json_from()   # seleccion_confirmada
+            await ana.receive_json_from()   # estado_confirmaciones
+            await bob.receive_json_from()
+
+            await bob.send_json_to({'type': 'numeros_seleccionados', 'nickname': 'bob', 'numeros': [4, 5]})
+            await bob.receive_json_from()
+            # El worker B ve el boleto que registró el worker A
+            estado = await bob.receive_json_from()
+            await ana.receive_json_from()
+
+            # Ambos piden el sorteo a la vez: solo uno debe sortear
+            await ana.send_json_to({'type': 'iniciar_sorteo'})
+            await bob.send_json_to({'type': 'iniciar_sorteo'})
+            resultado_ana = await self.esperar_sorteo(ana)
+            resultado_bob = await self.esperar_sorteo(bob)
+            repetido = not await ana.receive_nothing(timeout=0.3)
+            # La ronda se difunde antes de llegar a la base (ver diario.py)
+            await diario.esperar()
+
+            await ana.disconnect()
+            await bob.disconnect()
+            return estado, resultado_ana, resultado_bob, repetido
+
+        estado, resultado_ana, resultado_bob, repetido = async_to_sync(jugar)()
+
+        self.assertEqual(estado['type'], 'estado_confirmaciones')
+        self.assertEqual((estado['confirmados'], estado['total']), (2, 2))
+        self.assertTrue(estado['todos_listos'])
+
+        self.assertEqual(resultado_ana['type'], 'sorteo_completado')
+        self.assertEqual(resultado_ana['numeros_ganadores'], resultado_bob['numeros_ganadores'])
+        self.assertFalse(repetido)
+        self.assertEqual(Partida.objects.count(), 1)
+        self.assertEqual(Apuesta.objects.count(), 2)
+
+    def test_reanudar_recibe_lo_perdido(self):
+        aplicacion = self.aplicacion(EstadoStore(MemoriaBackend()))
+        url = f'/ws/game/{self.sala.id}/'
+
+        async def jugar():
+            ana = self.comunicador(aplicacion, url, 'ana')
+            await ana.connect()
+            conectado = await ana.receive_json_from()
+            await ana.send_json_to({'type': 'numeros_seleccionados', 'numeros': [1, 2, 3]})
+            await ana.receive_json_from()
+            estado = await ana.receive_json_from()
+            # Se cae el socket (no es el cierre normal): la sesión queda en gracia
+            await ana.disconnect(code=1006)
+
+            bob = self.comunicador(aplicacion, url, 'bob')
+            await bob.connect()
+            await bob.receive_json_from()
+            await bob.send_json_to({'type': 'numeros_seleccionados', 'numeros': [4, 5]})
+            await bob.receive_json_from()
+            await bob.receive_json_from()
+
+            ana = self.comunicador(aplicacion, f"{url}?sesion={conectado['sesion']}&desde={estado['seq']}", 'ana')
+            await ana.connect()
+            reanudado = await ana.receive_json_from()
+            perdido = await ana.receive_json_from()
+            nada_mas = await ana.receive_nothing(timeout=0.2)
+            await ana.disconnect()
+            await bob.disconnect()
+            return conectado, reanudado, perdido, nada_mas
+
+        conectado, reanudado, perdido, nada_mas = async_to_sync(jugar)()
+
+        self.assertTrue(reanudado['reanudada'])
+        self.assertEqual(reanudado['sesion'], conectado['sesion'])
+        self.assertEqual(reanudado['boleto'], [1, 2, 3])
+        # El boleto de ana siguió contando mientras estaba caída
+        self.assertEqual(perdido['type'], 'estado_confirmaciones')
+        self.assertEqual((perdido['confirmados'], perdido['total']), (2, 2))
+        self.assertEqual(perdido['seq'], reanudado['seq'])
+        self.assertTrue(nada_mas)
+
+    def test_hueco_en_el_buffer_manda_el_estado_actual(self):
+        store = EstadoStore(MemoriaBackend())
+        aplicacion = self.aplicacion(store)
+        url = f'/ws/game/{self.sala.id}/'
+
+        async def jugar():
+            ana = self.comunicador(aplicacion, url, 'ana')
+            await ana.connect()
+            conectado = await ana.receive_json_from()
+            await ana.disconnect(code=1006)
+
+            # Mientras tanto la sala sigue: el buffer se desborda
+            estado = EstadoJuego(store, self.sala.id)
+            for i in range(TAMANO_BUFFER + 3):
+                await estado.registrar_evento('sorteo_completado', {'numero': i})
+
+            ana = self.comunicador(aplicacion, f"{url}?sesion={conectado['sesion']}&desde={conectado['seq']}", 'ana')
+            await ana.connect()
+            reanudado = await ana.receive_json_from()
+            mensajes = [await ana.receive_json_from() for _ in range(TAMANO_BUFFER + 1)]
+            await ana.disconnect()
+            return reanudado, mensajes
+
+        reanudado, mensajes = async_to_sync(jugar)()
+        self.assertTrue(reanudado['reanudada'])
+        self.assertEqual([m['seq'] for m in mensajes[:-1]], list(range(4, TAMANO_BUFFER + 4)))
+        self.assertEqual(mensajes[-1]['type'], 'estado_confirmaciones')
+        self.assertEqual(mensajes[-1]['seq'], reanudado['seq'])
+
+    def test_cliente_binario_y_cliente_json_en_la_misma_sala(self):
+        aplicacion = self.aplicacion(EstadoStore(MemoriaBackend()))
+        url = f'/ws/game/{self.sala.id}/'
+
+        async def jugar():
+            ana = self.comunicador(aplicacion, url, 'ana', subprotocols=[SUBPROTOCOLO])
+            bob = self.comunicador(aplicacion, url, 'bob')
+            _, protocolo_ana = await ana.connect()
+            _, protocolo_bob = await bob.connect()
+            await ana.receive_json_from()
+            await bob.receive_json_from()
+
+            # El nickname del frame se ignora: juega el usuario de la sesión
+            await ana.send_to(bytes_data=frame_boleto('otro', [3, 1, 2]))
+            confirmado = await ana.receive_json_from()
+            await ana.receive_json_from()
+            await bob.receive_json_from()
+            await bob.send_json_to({'type': 'numeros_seleccionados', 'numeros': [4, 5]})
+            for _ in range(2):
+                await bob.receive_json_from()
+            await ana.receive_json_from()
+
+            await ana.send_to(bytes_data=b'\x01')
+            error = await ana.receive_json_from()
+
+            await bob.send_json_to({'type': 'iniciar_sorteo'})
+            binario = await ana.receive_output(timeout=5)
+            texto = await self.esperar_sorteo(bob)
+            await diario.esperar()
+            await ana.disconnect()
+            await bob.disconnect()
+            return protocolo_ana, protocolo_bob, confirmado, error, binario, texto
+
+        protocolo_ana, protocolo_bob, confirmado, error, binario, texto = async_to_sync(jugar)()
+
+        self.assertEqual((protocolo_ana, protocolo_bob), (SUBPROTOCOLO, None))
+        self.assertEqual(confirmado['type'], 'seleccion_confirmada')
+        self.assertEqual(error['type'], 'error')
+        self.assertEqual(Apuesta.objects.get(jugador__nickname='ana').numeros_elegidos, [1, 2, 3])
+
+        # El mismo sorteo, uno en binario y el otro en JSON
+        self.assertIsNone(binario.get('text'))
+        sorteo = leer_sorteo(binario['bytes'])
+        self.assertEqual(sorteo['numeros_ganadores'], texto['numeros_ganadores'])
+        self.assertEqual(sorteo['resultados'], [
+            {k: r[k] for k in ('nickname', 'aciertos', 'puntos', 'numeros')} for r in texto['resultados']
+        ])
+        self.assertEqual(sorteo['semilla'], texto['semilla'])
+        self.assertEqual(sorteo['siguiente_compromiso'], texto['siguiente_compromiso'])
+        self.assertEqual(sorteo['seq'], texto['seq'])
+
+    def test_sesion_de_otro_usuario_no_se_reanuda(self):
+        aplicacion = self.aplicacion(EstadoStore(MemoriaBackend()))
+        url = f'/ws/game/{self.sala.id}/'
+
+        async def jugar():
+            ana = self.comunicador(aplicacion, url, 'ana')
+            await ana.connect()
+            conectado = await ana.receive_json_from()
+            await ana.disconnect(code=1006)
+
+            bob = self.comunicador(aplicacion, f"{url}?sesion={conectado['sesion']}&desde=0", 'bob')
+            await bob.connect()
+            respuesta = await bob.receive_json_from()
+            await bob.disconnect()
+            return conectado, respuesta
+
+        conectado, respuesta = async_to_sync(jugar)()
+        self.assertFalse(respuesta['reanudada'])
+        self.assertNotEqual(respuesta['sesion'], conectado['sesion'])
+
+
+def frame_boleto(nickname, numeros):
+    datos = nickname.encode('utf-8')
+    return bytes((BOLETO, len(datos))) + datos + mascara_a_bytes(numeros_a_mascara(numeros))
+
+
+def leer_sorteo(frame):
+    # Lee un frame sorteo_completado según el formato de binario.py
+    numeros_ganadores = list(frame[1:21])
+    (registros,) = struct.unpack_from('<H', frame, 21)
+    posicion = 23
+    resultados = []
+    for _ in range(registros):
+        largo = frame[posicion]
+        nickname = frame[posicion + 1:posicion + 1 + largo].decode('utf-8')
+        posicion += 1 + largo
+        aciertos, puntos = struct.unpack_from('<BI', frame, posicion)
+        posicion += 5
+        mascara = int.from_bytes(frame[posicion:posicion + BYTES_MASCARA], 'little')
+        posicion += BYTES_MASCARA
+        numeros = [n for n in range(1, 81) if mascara >> (n - 1) & 1]
+        resultados.append({'nickname': nickname, 'aciertos': aciertos, 'puntos': puntos, 'numeros': numeros})
+    resto = frame[posicion:]
+    sorteo = {'numeros_ganadores': numeros_ganadores, 'resultados': resultados}
+    if len(resto) >= 64:
+        sorteo['semilla'] = resto[:32].hex()
+        sorteo['siguiente_compromiso'] = resto[32:64].hex()
+        resto = resto[64:]
+    if resto:
+        (sorteo['seq'],) = struct.unpack('<I', resto)
+    return sorteo
+
+
+class BinarioTests(SimpleTestCase):
+
+    def setUp(self):
+        self.ganadores = derivar_numeros(b'\x07' * 32)
+        self.resultados = [
+            {'nickname': 'ana', 'aciertos': 3, 'puntos': 45, 'numeros': [1, 40, 80]},
+            {'nickname': 'ñandú', 'aciertos': 0, 'puntos': 0, 'numeros': list(range(61, 81))},
+        ]
+
+    def test_boleto_ida_y_vuelta(self):
+        for numeros in ([1], [80], [1, 80], list(range(1, 21)), list(range(61, 81))):
+            with self.subTest(numeros=numeros):
+                self.assertEqual(decodificar_boleto(frame_boleto('ñandú', numeros)), ('ñandú', numeros))
+
+    def test_boletos_mal_formados(self):
+        valido = frame_boleto('ana', [1, 2, 3])
+        for frame in (b'', b'\x01', b'\x02' + valido[1:], valido[:-1], valido + b'\x00'):
+            with self.subTest(frame=frame):
+                with self.assertRaises(FrameInvalido):
+                    decodificar_boleto(frame)
+
+    def test_sorteo_ida_y_vuelta(self):
+        semilla = b'\x07' * 32
+        siguiente = compromiso_de(b'\x08' * 32)
+
+        sorteo = leer_sorteo(codificar_sorteo(self.ganadores, self.resultados, semilla, siguiente, 1234))
+        self.assertEqual(sorteo, {
+            'numeros_ganadores': self.ganadores,
+            'resultados': self.resultados,
+            'semilla': semilla.hex(),
+            'siguiente_compromiso': siguiente,
+            'seq': 1234,
+        })
+        # Semilla y secuencia son opcionales
+        self.assertEqual(leer_sorteo(codificar_sorteo(self.ganadores, self.resultados)),
+                         {'numeros_ganadores': self.ganadores, 'resultados': self.resultados})
+
+    def test_lo_que_no_cabe_sale_en_json(self):
+        puntos_enormes = [dict(self.resultados[0], puntos=2 ** 32)]
+        demasiados = self.resultados[:1] * 65536
+        self.assertIsNone(codificar_sorteo(self.ganadores, puntos_enormes))
+        self.assertIsNone(codificar_sorteo(self.ganadores, demasiados))
+        self.assertIsNotNone(codificar_sorteo(self.ganadores, self.resultados[:1] * 65535))
+
+    def test_el_consumer_cae_a_json_sin_frame(self):
+        consumer = GameConsumer()
+        consumer.seq_conexion = 0
+        consumer.send = mock.AsyncMock()
+        evento = {'seq': 1, 'texto': '{"type": "sorteo_completado"}', 'binario': None}
+
+        for binario, frame, esperado in ((True, b'\x02', {'bytes_data': b'\x02'}),
+                                         (True, None, {'text_data': evento['texto']}),
+                                         (False, b'\x02', {'text_data': evento['texto']})):
+            with self.subTest(binario=binario, frame=frame):
+                consumer.binario = binario
+                async_to_sync(consumer.sorteo_completado)(dict(evento, binario=frame))
+                consumer.send.assert_awaited_with(**esperado)
+
+
+class SalaTests(TransactionTestCase):
+    # El escritor de membresías usa la cola de escritura (otro hilo): hacen
+    # falta datos confirmados
+
+    def setUp(self):
+        self.jugadores = crear_jugadores(3)
+        self.sala = Sala.objects.create(codigo='LOBBY1', creador=self.jugadores[0])
+        self.url = f'/ws/sala/{self.sala.id}/'
+        self.store = EstadoStore(MemoriaBackend())
+        self.aplicacion = URLRouter([
+            path('ws/sala/<str:sala_id>/', SalaConsumer.as_asgi(store=self.store)),
+        ])
+        # Un escritor propio: sus cambios se vacían a mano, sin esperar el intervalo
+        self.escritor = EscritorMembresia()
+        parche = mock.patch('keno.presencia.escritor', self.escritor)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def comunicador(self, jugador, url=None):
+        user = jugador.user
+
+        async def con_usuario(scope, receive, send):
+            return await self.aplicacion(dict(scope, user=user), receive, send)
+
+        return WebsocketCommunicator(con_usuario, url or self.url)
+
+    async def recibir(self, comunicador, tipo):
+        # El reloj del lobby llega intercalado con todo lo demás
+        while True:
+            mensaje = await comunicador.receive_json_from(timeout=2)
+            if mensaje['type'] == tipo:
+                return mensaje
+
+    async def vaciar_escritor(self):
+        if self.escritor.tarea is not None:
+            self.escritor.tarea.cancel()
+        await self.escritor.vaciar()
+
+    def miembros(self):
+        return set(self.sala.jugadores.values_list('nickname', flat=True))
+
+    def test_sala_inexistente_rechaza_la_conexion(self):
+        async def conectar(url):
+            comunicador = self.comunicador(self.jugadores[0], url)
+            conectado, _ = await comunicador.connect()
+            return conectado
+
+        for url in ('/ws/sala/999999/', '/ws/sala/abc/'):
+            with self.subTest(url=url):
+                self.assertFalse(async_to_sync(conectar)(url))
+        self.assertEqual(self.escritor.pendientes, {})
+
+    def test_entrar_y_salir_de_la_sala(self):
+        ana, bob, _ = self.jugadores
+
+        async def jugar():
+            ana_1 = self.comunicador(ana)
+            await ana_1.connect()
+            inicial = await self.recibir(ana_1, 'sala_snapshot')
+            # Su propia alta; si bob entrara en la misma ventana irían juntas
+            await self.recibir(ana_1, 'sala_delta')
+            bob_1 = self.comunicador(bob)
+            await bob_1.connect()
+            con_bob = await self.recibir(bob_1, 'sala_snapshot')
+            entra = await self.recibir(ana_1, 'sala_delta')
+            await self.recibir(bob_1, 'sala_delta')
+
+            # Las altas no tocan la base hasta que el escritor vacía
+            antes = await sync_to_async(self.miembros)()
+            await self.vaciar_escritor()
+            despues = await sync_to_async(self.miembros)()
+
+            # Con otra pestaña abierta, cerrar una no saca al jugador
+            ana_2 = self.comunicador(ana)
+            await ana_2.connect()
+            await self.recibir(ana_2, 'sala_snapshot')
+            await ana_1.disconnect()
+            await ana_2.send_json_to({'type': 'pedir_snapshot'})
+            sigue = await self.recibir(ana_2, 'sala_snapshot')
+            await ana_2.disconnect()
+            sale = await self.recibir(bob_1, 'sala_delta')
+
+            await self.vaciar_escritor()
+            al_salir = await sync_to_async(self.miembros)()
+            await bob_1.disconnect()
+            return inicial, con_bob, entra, antes, despues, sigue, sale, al_salir
+
+        inicial, con_bob, entra, antes, despues, sigue, sale, al_salir = async_to_sync(jugar)()
+
+        self.assertEqual(inicial['players'], ['jugador0'])
+        self.assertEqual(con_bob['players'], ['jugador0', 'jugador1'])
+        self.assertEqual((entra['entran'], entra['salen']), (['jugador1'], []))
+        self.assertEqual((antes, despues), (set(), {'jugador0', 'jugador1'}))
+        self.assertEqual(sigue['players'], ['jugador0', 'jugador1'])
+        self.assertEqual((sale['entran'], sale['salen']), ([], ['jugador0']))
+        self.assertEqual(al_salir, {'jugador1'})
+
+    def test_snapshot_y_despues_deltas_numerados(self):
+        ana, bob, carla = self.jugadores
+
+        async def jugar():
+            ana_1 = self.comunicador(ana)
+            await ana_1.connect()
+            primero = await self.recibir(ana_1, 'sala_snapshot')
+            propio = await self.recibir(ana_1, 'sala_delta')
+
+            bob_1 = self.comunicador(bob)
+            await bob_1.connect()
+            con_bob = await self.recibir(bob_1, 'sala_snapshot')
+            delta_bob = await self.recibir(ana_1, 'sala_delta')
+
+            # carla llega al salir bob: ana se pierde el delta y pide el roster
+            carla_1 = self.comunicador(carla)
+            await carla_1.connect()
+            await bob_1.disconnect()
+            delta = await self.recibir(carla_1, 'sala_delta')
+            await ana_1.send_json_to({'type': 'pedir_snapshot'})
+            al_dia = await self.recibir(ana_1, 'sala_snapshot')
+
+            await ana_1.disconnect()
+            await carla_1.disconnect()
+            await self.vaciar_escritor()
+            return primero, propio, con_bob, delta_bob, delta, al_dia
+
+        primero, propio, con_bob, delta_bob, delta, al_dia = async_to_sync(jugar)()
+
+        # El snapshot ya incluye al jugador; el seq dice qué deltas faltan
+        self.assertEqual((primero['players'], primero['seq']), (['jugador0'], 0))
+        self.assertEqual(propio['seq'], 1)
+        self.assertEqual(con_bob['seq'], 1)
+        self.assertEqual(delta_bob['seq'], 2)
+        # Entrada y salida en la misma ventana salen en un solo delta
+        self.assertEqual((delta['seq'], delta['entran'], delta['salen']), (3, ['jugador2'], ['jugador1']))
+        self.assertEqual((al_dia['players'], al_dia['seq']), (['jugador0', 'jugador2'], 3))
+
+    @mock.patch('keno.consumer.INTERVALO_SYNC', 0.1)
+    def test_un_solo_reloj_por_sala(self):
+        ana, bob, _ = self.jugadores
+
+        async def escuchar(comunicador, segundos):
+            llegadas = []
+            fin = time.monotonic() + segundos
+            # receive_nothing espera sin cancelar al consumidor, como sí
+            # hace el timeout de receive_json_from
+            while (restante := fin - time.monotonic()) > 0:
+                if await comunicador.receive_nothing(timeout=restante):
+                    break
+                mensaje = await comunicador.receive_json_from()
+                if mensaje['type'] == 'timer_sync':
+                    llegadas.append((time.monotonic(), mensaje['deadline']))
+            return llegadas
+
+        async def jugar():
+            ana_1 = self.comunicador(ana)
+            bob_1 = self.comunicador(bob)
+            await ana_1.connect()
+            await bob_1.connect()
+            llegadas_ana, llegadas_bob = await asyncio.gather(escuchar(ana_1, 0.55), escuchar(bob_1, 0.55))
+            cuenta = SalaConsumer.cuentas[str(self.sala.id)]
+            locales = (cuenta.conexiones, cuenta.tarea.done())
+
+            await ana_1.disconnect()
+            await bob_1.disconnect()
+            await self.vaciar_escritor()
+            restante, _ = await self.store.get(f'sala:{self.sala.id}:cuenta')
+            return llegadas_ana, llegadas_bob, locales, restante
+
+        llegadas_ana, llegadas_bob, locales, restante = async_to_sync(jugar)()
+
+        # Una tarea para las dos conexiones de este worker
+        self.assertEqual(locales, (2, False))
+        # Un solo flujo: ni ráfagas duplicadas ni relojes distintos
+        self.assertGreaterEqual(len(llegadas_ana), 4)
+        self.assertLessEqual(len(llegadas_ana), 7)
+        for anterior, siguiente in zip(llegadas_ana, llegadas_ana[1:]):
+            self.assertGreater(siguiente[0] - anterior[0], 0.05)
+        self.assertEqual({deadline for _, deadline in llegadas_ana + llegadas_bob}, {llegadas_ana[0][1]})
+        # Al irse el último, la tarea y la cuenta compartida desaparecen
+        self.assertNotIn(str(self.sala.id), SalaConsumer.cuentas)
+        self.assertIsNone(restante)
+
+    def test_un_solo_worker_emite_el_reloj(self):
+        clave = f'sala:{self.sala.id}:cuenta:emisor'
+
+        async def como(emisor, accion):
+            with mock.patch('keno.consumer.EMISOR', emisor):
+                return await accion(self.store, clave)
+
+        async def turnos():
+            resultados = [
+                await como('a', tomar_turno),
+                await como('b', tomar_turno),
+                await como('a', tomar_turno),   # el dueño renueva
+            ]
+            # b no puede soltar un turno ajeno
+            await como('b', soltar_turno)
+            resultados.append(await como('b', tomar_turno))
+
+            # a murió sin soltarlo: b lo toma cuando vence
+            with mock.patch('keno.consumer.time.time', return_value=time.time() + DURACION_TURNO + 1):
+                resultados.append(await como('b', tomar_turno))
+            resultados.append(await como('a', tomar_turno))
+
+            await como('b', soltar_turno)
+            resultados.append(await como('a', tomar_turno))
+            return resultados
+
+        self.assertEqual(async_to_sync(turnos)(), [True, False, True, False, True, False, True])
+
+    def test_el_roster_se_siembra_de_la_base(self):
+        self.sala.jugadores.add(self.jugadores[2])
+
+        async def jugar():
+            ana = self.comunicador(self.jugadores[0])
+            await ana.connect()
+            snapshot = await self.recibir(ana, 'sala_snapshot')
+            await ana.disconnect()
+            return snapshot
+
+        self.assertEqual(async_to_sync(jugar)()['players'], ['jugador2', 'jugador0'])
+
+    def test_el_escritor_escribe_en_lote(self):
+        ana, bob, carla = self.jugadores
+        otra = Sala.objects.create(codigo='LOBBY2', creador=ana)
+        otra.jugadores.add(carla)
+
+        async def cambios():
+            self.escritor.registrar(self.sala.id, ana.user_id, True)
+            self.escritor.registrar(self.sala.id, bob.user_id, True)
+            self.escritor.registrar(self.sala.id, ana.user_id, False)
+            self.escritor.registrar(otra.id, carla.user_id, False)
+            self.escritor.registrar(999999, carla.user_id, True)
+            self.escritor.sala_vacia(otra.id)
+            self.escritor.tarea.cancel()
+            with mock.patch('keno.repositorio.cola_escritura.ejecutar',
+                            wraps=repositorio.cola_escritura.ejecutar) as ejecutar:
+                await self.escritor.vaciar()
+            return ejecutar.call_count
+
+        # Una sola escritura para todos los cambios; la sala inexistente no
+        # tira abajo el lote
+        self.assertEqual(async_to_sync(cambios)(), 1)
+        self.assertEqual(self.miembros(), {'jugador1'})
+        otra.refresh_from_db()
+        self.assertEqual((list(otra.jugadores.all()), otra.activa), ([], False))
+        self.assertEqual((self.escritor.pendientes, self.escritor.desactivar), ({}, set()))
+
+    def test_leer_miembros_escribe_antes_lo_pendiente_de_la_sala(self):
+        ana, bob, _ = self.jugadores
+        otra = Sala.objects.create(codigo='LOBBY2', creador=ana)
+
+        async def leer():
+            self.escritor.registrar(self.sala.id, ana.user_id, True)
+            self.escritor.registrar(otra.id, bob.user_id, True)
+            self.escritor.tarea.cancel()
+            return await self.escritor.miembros(self.sala.id)
+
+        miembros = async_to_sync(leer)()
+        self.assertEqual(miembros, [(ana.user_id, 'jugador0')])
+        # Lo de la otra sala sigue pendiente
+        self.assertEqual(self.escritor.pendientes, {otra.id: {bob.user_id: True}})
+        self.assertFalse(otra.jugadores.exists())
+
+
+class DifusorRosterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = EstadoStore(MemoriaBackend())
+        self.difusor = DifusorRoster()
+        parche = mock.patch('keno.presencia.difundir', new_callable=mock.AsyncMock)
+        self.difundir = parche.start()
+        self.addCleanup(parche.stop)
+
+    def deltas(self):
+        return [(llamada.args[1], llamada.kwargs) for llamada in self.difundir.await_args_list]
+
+    def test_los_cambios_de_una_ventana_salen_juntos(self):
+        sala_1, sala_2 = Presencia(self.store, 1), Presencia(self.store, 2)
+
+        async def cambios():
+            self.difusor.cambio(sala_1, 'sala_1', 'ana', True)
+            self.difusor.cambio(sala_1, 'sala_1', 'bob', True)
+            self.difusor.cambio(sala_1, 'sala_1', 'ana', False)
+            self.difusor.cambio(sala_2, 'sala_2', 'carla', True)
+            await asyncio.sleep(VENTANA_DELTAS * 2)
+            self.difusor.cambio(sala_1, 'sala_1', 'ana', True)
+            await asyncio.sleep(VENTANA_DELTAS * 2)
+            return await sala_1.snapshot(), await sala_2.snapshot()
+
+        snapshot_1, snapshot_2 = async_to_sync(cambios)()
+
+        # Cada sala numera sus deltas por separado, sin saltos
+        self.assertEqual(self.deltas(), [
+            ('sala_1', {'seq': 1, 'entran': ['bob'], 'salen': ['ana']}),
+            ('sala_2', {'seq': 1, 'entran': ['carla'], 'salen': []}),
+            ('sala_1', {'seq': 2, 'entran': ['ana'], 'salen': []}),
+        ])
+        self.assertEqual((snapshot_1['seq'], snapshot_2['seq']), (2, 1))
+        self.assertEqual((self.difusor.pendientes, self.difusor.tareas), ({}, {}))
+
+    def test_el_seq_es_compartido_por_los_workers(self):
+        # Dos difusores (dos procesos) sobre el mismo store
+        otro = DifusorRoster()
+
+        async def cambios():
+            self.difusor.cambio(Presencia(self.store, 1), 'sala_1', 'ana', True)
+            otro.cambio(Presencia(self.store, 1), 'sala_1', 'bob', True)
+            await asyncio.sleep(VENTANA_DELTAS * 2)
+
+        async_to_sync(cambios)()
+        self.assertEqual(sorted(kwargs['seq'] for _, kwargs in self.deltas()), [1, 2])
+
+
+# Una muestra del formato de texto de Prometheus: nombre{etiquetas} valor
+MUESTRA_PROMETHEUS = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? \S+$')
+
+
+@override_settings(KENO_METRICS_TOKEN='secreto')
+class MetricasTests(SimpleTestCase):
+
+    def pedir(self, user, **cabeceras):
+        pedido = RequestFactory().get('/metrics', **cabeceras)
+        pedido.user = user
+        return views.metricas(pedido)
+
+    def test_quien_puede_ver_las_metricas(self):
+        casos = [
+            ('anonimo', AnonymousUser(), {}, 403),
+            ('jugador', User(username='ana'), {}, 403),
+            ('staff', User(username='admin', is_staff=True), {}, 200),
+            ('token', AnonymousUser(), {'HTTP_AUTHORIZATION': 'Bearer secreto'}, 200),
+            ('token incorrecto', AnonymousUser(), {'HTTP_AUTHORIZATION': 'Bearer otro'}, 403),
+            ('sin Bearer', AnonymousUser(), {'HTTP_AUTHORIZATION': 'secreto'}, 403),
+        ]
+        for caso, user, cabeceras, estado in casos:
+            with self.subTest(caso):
+                self.assertEqual(self.pedir(user, **cabeceras).status_code, estado)
+
+    @override_settings(KENO_METRICS_TOKEN='')
+    def test_sin_token_configurado_solo_staff(self):
+        self.assertEqual(self.pedir(AnonymousUser(), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def metricas_de_prueba(self):
+        contador = Contador('prueba_total', 'Un contador', ('origen',))
+        gauge = Gauge('prueba_abiertas', 'Un gauge', ('sala',))
+        histograma = Histograma('prueba_segundos', 'Un histograma', buckets=(0.1, 1))
+
+        contador.sumar('a"b\\c\nd')
+        contador.sumar('a"b\\c\nd', cantidad=2)
+        gauge.sumar('1')
+        gauge.sumar('2')
+        gauge.sumar('2', cantidad=-1)
+        for valor in (0.05, 0.1, 0.5, 3):
+            histograma.observar(valor)
+
+    @mock.patch('keno.metricas.REGISTRO', [])
+    def test_la_respuesta_es_texto_de_prometheus(self):
+        self.metricas_de_prueba()
+        respuesta = self.pedir(AnonymousUser(), HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(respuesta['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+        texto = respuesta.content.decode()
+        self.assertTrue(texto.endswith('\n'))
+        for linea in texto.splitlines():
+            with self.subTest(linea=linea):
+                if linea.startswith('#'):
+                    self.assertRegex(linea, r'^# (HELP \S+ .+|TYPE \S+ (counter|gauge|histogram))$')
+                else:
+                    self.assertRegex(linea, MUESTRA_PROMETHEUS)
+
+    @mock.patch('keno.metricas.REGISTRO', [])
+    def test_series_de_cada_tipo(self):
+        self.metricas_de_prueba()
+        self.assertEqual(exponer(), '\n'.join([
+            '# HELP prueba_total Un contador',
+            '# TYPE prueba_total counter',
+            'prueba_total{origen="a\\"b\\\\c\\nd"} 3',
+            '# HELP prueba_abiertas Un gauge',
+            '# TYPE prueba_abiertas gauge',
+            # La sala 2 volvió a cero: su serie desaparece
+            'prueba_abiertas{sala="1"} 1',
+            '# HELP prueba_segundos Un histograma',
+            '# TYPE prueba_segundos histogram',
+            # Buckets acumulados; el límite es inclusivo (le)
+            'prueba_segundos_bucket{le="0.1"} 2',
+            'prueba_segundos_bucket{le="1"} 3',
+            'prueba_segundos_bucket{le="+Inf"} 4',
+            'prueba_segundos_sum 3.65',
+            'prueba_segundos_count 4',
+        ]) + '\n')
+
+
+class BufferEventosTests(SimpleTestCase):
+
+    def setUp(self):
+        self.estado = EstadoJuego(EstadoStore(MemoriaBackend()), 1)
+
+    def registrar(self, cantidad, tipo='sorteo_completado'):
+        async def registrar():
+            for i in range(cantidad):
+                await self.estado.registrar_evento(tipo, {'numero': i})
+        async_to_sync(registrar)()
+
+    def test_repite_lo_que_sigue_en_el_buffer(self):
+        self.registrar(5)
+        seq, textos, hueco = async_to_sync(self.estado.eventos_desde)(2)
+        self.assertEqual(seq, 5)
+        self.assertEqual([json.loads(texto)['seq'] for texto in textos], [3, 4, 5])
+        self.assertFalse(hueco)
+
+    def test_hueco_cuando_el_buffer_se_desborda(self):
+        self.registrar(TAMANO_BUFFER + 8)
+        seq, textos, hueco = async_to_sync(self.estado.eventos_desde)(5)
+        self.assertEqual(seq, TAMANO_BUFFER + 8)
+        self.assertTrue(hueco)
+        self.assertEqual(len(textos), TAMANO_BUFFER)
+
+        # Justo en el borde: lo que falta todavía está
+        seq, textos, hueco = async_to_sync(self.estado.eventos_desde)(8)
+        self.assertFalse(hueco)
+        self.assertEqual(len(textos), TAMANO_BUFFER)
+
+    def test_seq_del_futuro_es_hueco(self):
+        # Cliente de otra sala o de antes de un reinicio del store
+        self.registrar(3)
+        _, textos, hueco = async_to_sync(self.estado.eventos_desde)(10)
+        self.assertEqual(textos, [])
+        self.assertTrue(hueco)
+
+    def test_estado_solo_guarda_el_ultimo(self):
+        self.registrar(3, 'estado_confirmaciones')
+        self.registrar(1)
+        _, textos, hueco = async_to_sync(self.estado.eventos_desde)(0)
+        self.assertEqual([json.loads(texto)['seq'] for texto in textos], [3, 4])
+        self.assertFalse(hueco)
+
+
+class BoletoTests(SimpleTestCase):
+
+    def test_boleto_valido_queda_ordenado_y_sin_repetidos(self):
+        boleto = parsear_boleto('ana', [42, 3, 80, 3, 1])
+        self.assertEqual(boleto.numeros, (1, 3, 42, 80))
+        self.assertEqual(boleto.spots, 4)
+        self.assertEqual(boleto.mascara, (1 << 0) | (1 << 2) | (1 << 41) | (1 << 79))
+
+    def test_boletos_invalidos(self):
+        invalidos = [
+            ('ana', []),                      # ningún número
+            ('ana', list(range(1, 22))),      # más de 20
+            ('ana', [0, 5]),                  # fuera de rango
+            ('ana', [81]),
+            ('ana', [True, 2]),               # bool no cuenta como entero
+            ('ana', [1.0]),
+            ('ana', '1,2,3'),                 # no es una lista
+            ('', [1, 2]),                     # nickname vacío
+            ('   ', [1, 2]),
+            ('x' * 51, [1, 2]),               # más largo que Jugador.nickname
+            (None, [1, 2]),
+        ]
+        for nickname, numeros in invalidos:
+            with self.subTest(nickname=nickname, numeros=numeros):
+                with self.assertRaises(BoletoInvalido):
+                    parsear_boleto(nickname, numeros)
+
+    def test_veinte_numeros_es_el_maximo(self):
+        self.assertEqual(parsear_boleto('ana', list(range(61, 81))).spots, 20)
+
+
+def crear_jugadores(cantidad, puntos=0):
+    return [
         Jugador.objects.create(
-            user=user,
-            nickname=username
+            user=User.objects.create_user(f'jugador{i}'),
+            nickname=f'jugador{i}',
+            puntos_totales=puntos
+        )
+        for i in range(cantidad)
+    ]
+
+
+def resultados_de(jugadores, puntos=10):
+    return [
+        {'nickname': jugador.nickname, 'numeros': [1, 2, 3], 'aciertos': 1, 'puntos': puntos * (i % 3)}
+        for i, jugador in enumerate(jugadores)
+    ]
+
+
+class PersistenciaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.jugadores = crear_jugadores(20)
+        cls.sala = Sala.objects.create(codigo='PERS01', creador=cls.jugadores[0])
+        # La primera ronda siembra las estadísticas si la base no las tiene
+        guardar_ronda(cls.sala.id, None, list(range(1, 21)), [])
+
+    def test_consultas_fijas_por_ronda(self):
+        # Estadísticas (5), Partida, jugadores, apuestas, acumulados y el
+        # savepoint de la transacción (2): no crece con los jugadores
+        for cantidad in (1, 3, 20):
+            with self.subTest(jugadores=cantidad):
+                with self.assertNumQueries(11):
+                    guardar_ronda(self.sala.id, None, list(range(1, 21)), resultados_de(self.jugadores[:cantidad]))
+
+    def test_acumula_puntos_y_partidas(self):
+        guardar_ronda(self.sala.id, None, list(range(1, 21)), resultados_de(self.jugadores[:3]))
+        guardar_ronda(self.sala.id, None, list(range(1, 21)), resultados_de(self.jugadores[:3]))
+
+        acumulados = dict(Jugador.objects.filter(id__in=[j.id for j in self.jugadores[:3]])
+                          .values_list('nickname', 'puntos_totales'))
+        self.assertEqual(acumulados, {'jugador0': 0, 'jugador1': 20, 'jugador2': 40})
+        self.assertEqual(Apuesta.objects.count(), 6)
+        self.assertEqual(Jugador.objects.get(nickname='jugador2').partidas_jugadas, 2)
+
+
+def calcular_puntos(numeros_seleccionados, aciertos):
+    # Copia de GameConsumer.calcular_puntos, reemplazado por las tablas de pagos
+    if numeros_seleccionados == 1:
+        return 3 if aciertos == 1 else 0
+    elif numeros_seleccionados == 2:
+        return 15 if aciertos == 2 else 0
+    elif numeros_seleccionados == 3:
+        return {3: 45, 2: 5}.get(aciertos, 0)
+    elif numeros_seleccionados == 4:
+        return {4: 100, 3: 10, 2: 2}.get(aciertos, 0)
+    elif numeros_seleccionados == 5:
+        return {5: 500, 4: 50, 3: 5}.get(aciertos, 0)
+    elif numeros_seleccionados <= 10:
+        return aciertos * 50
+    elif numeros_seleccionados <= 15:
+        return aciertos * 100
+    else:
+        return aciertos * 150
+
+
+def tabla_de_pagos(pago):
+    # Paga `pago` por cada acierto, con cualquier cantidad de spots
+    return [[aciertos * pago if aciertos <= spots else 0 for aciertos in range(DIMENSION)]
+            for spots in range(DIMENSION)]
+
+
+class PagosTests(TestCase):
+
+    def setUp(self):
+        # Los ids se reusan entre tests: cada uno arranca sin compiladas
+        parche = mock.patch.dict('keno.pagos._compiladas', clear=True)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_la_tabla_clasica_paga_como_calcular_puntos(self):
+        combinaciones = [(spots, aciertos) for spots in range(1, DIMENSION) for aciertos in range(spots + 1)]
+        esperados = [calcular_puntos(spots, aciertos) for spots, aciertos in combinaciones]
+        predeterminada = compilar(TablaPagos.objects.get(version=VERSION_CLASICA))
+
+        for tabla in (TABLA_CLASICA, predeterminada):
+            with self.subTest(tabla=tabla.id):
+                self.assertEqual([tabla.puntos(s, a) for s, a in combinaciones], esperados)
+                self.assertEqual(tabla.puntos_lote(*zip(*combinaciones)), esperados)
+
+    def test_puntos_lote_vacio_y_de_uno(self):
+        self.assertEqual(TABLA_CLASICA.puntos_lote([], []), [])
+        self.assertEqual(TABLA_CLASICA.puntos_lote([5], [5]), [500])
+
+    def test_tablas_invalidas(self):
+        def con(spots, aciertos, valor):
+            pagos = pagos_clasicos()
+            pagos[spots][aciertos] = valor
+            return pagos
+
+        invalidas = {
+            'no es lista': {},
+            'faltan filas': pagos_clasicos()[:-1],
+            'faltan columnas': [fila[:-1] for fila in pagos_clasicos()],
+            'negativo': con(3, 3, -1),
+            'decimal': con(3, 3, 1.5),
+            'booleano': con(1, 1, True),
+            'sobre el tope': con(20, 20, MAX_PAGO + 1),
+            'mas aciertos que spots': con(3, 4, 10),
+        }
+        for motivo, pagos in invalidas.items():
+            with self.subTest(motivo):
+                with self.assertRaises(ValueError):
+                    validar_pagos(pagos)
+                with self.assertRaises(ValidationError):
+                    TablaPagos(version='mala', pagos=pagos).clean()
+
+        validar_pagos(con(20, 20, MAX_PAGO))
+
+    def test_compilar_una_vez_por_tabla(self):
+        tabla = TablaPagos.objects.create(version='doble-v1', pagos=tabla_de_pagos(2))
+        self.assertIsNone(tabla_compilada(tabla.id))
+
+        compilada = compilar(tabla)
+        self.assertIsInstance(compilada, TablaPagosCompilada)
+        self.assertIs(compilar(TablaPagos.objects.get(id=tabla.id)), compilada)
+        self.assertIs(tabla_compilada(tabla.id), compilada)
+        self.assertEqual((compilada.id, compilada.version, compilada.puntos(7, 3)), (tabla.id, 'doble-v1', 6))
+
+    def test_tabla_para_sala(self):
+        creador = crear_jugadores(1)[0]
+        propia = TablaPagos.objects.create(version='doble-v1', pagos=tabla_de_pagos(2))
+        con_tabla = Sala.objects.create(codigo='PAGO01', creador=creador, tabla_pagos=propia)
+        sin_tabla = Sala.objects.create(codigo='PAGO02', creador=creador)
+
+        self.assertEqual(tabla_para_sala(con_tabla).id, propia.id)
+        # Sin tabla propia: la predeterminada más nueva, y si no hay, la clásica
+        self.assertEqual(tabla_para_sala(sin_tabla).version, VERSION_CLASICA)
+        nueva = TablaPagos.objects.create(version='doble-v2', pagos=tabla_de_pagos(2), predeterminada=True)
+        self.assertEqual(tabla_para_sala(sin_tabla).id, nueva.id)
+        self.assertEqual(tabla_para_sala(None).id, nueva.id)
+
+        TablaPagos.objects.filter(predeterminada=True).update(predeterminada=False)
+        self.assertIs(tabla_para_sala(sin_tabla), TABLA_CLASICA)
+
+    def test_la_apuesta_guarda_la_tabla_con_que_se_pago(self):
+        jugadores = crear_jugadores(2)
+        sala = Sala.objects.create(codigo='PAGO03', creador=jugadores[0])
+        tabla = compilar(TablaPagos.objects.create(version='doble-v1', pagos=tabla_de_pagos(2)))
+        boletos = [parsear_boleto('jugador0', [1, 2, 3, 4, 5, 6]), parsear_boleto('jugador1', [1, 70])]
+
+        resultados = liquidar_ronda(boletos, list(range(1, 21)), tabla)
+        guardar_ronda(sala.id, tabla.id, list(range(1, 21)), resultados)
+
+        apuestas = Apuesta.objects.order_by('jugador__nickname').values_list('puntos_ganados', 'tabla_pagos__version')
+        self.assertEqual(list(apuestas), [(12, 'doble-v1'), (2, 'doble-v1')])
+
+
+class ProbabilidadesTests(TestCase):
+
+    def setUp(self):
+        parche = mock.patch.dict('keno.probabilidades._por_version', clear=True)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def pedir(self, version):
+        respuesta = views.probabilidades(RequestFactory().get(f'/probabilidades/{version}/'), version)
+        return respuesta, json.loads(respuesta.content)
+
+    def test_hipergeometrica_exacta(self):
+        _, datos = self.pedir(VERSION_CLASICA)
+        por_spots = {fila['spots']: fila for fila in datos['spots']}
+
+        self.assertEqual(datos['version'], VERSION_CLASICA)
+        self.assertEqual(sorted(por_spots), list(range(1, 21)))
+        self.assertEqual(por_spots[1]['probabilidades'], [0.75, 0.25])
+        self.assertAlmostEqual(por_spots[2]['probabilidades'][2], 190 / 3160)
+        # Los casos de libro: 10 de 10 y 20 de 20
+        self.assertAlmostEqual(1 / por_spots[10]['probabilidades'][10], 8911711.18, places=1)
+        self.assertEqual(por_spots[20]['probabilidades'][20], 1 / comb(80, 20))
+        for spots, fila in por_spots.items():
+            with self.subTest(spots=spots):
+                self.assertEqual(len(fila['probabilidades']), spots + 1)
+                self.assertAlmostEqual(sum(fila['probabilidades']), 1)
+
+    def test_valor_esperado_de_la_tabla_clasica(self):
+        _, datos = self.pedir(VERSION_CLASICA)
+
+        for fila in datos['spots']:
+            spots = fila['spots']
+            exactas = [Fraction(comb(spots, k) * comb(80 - spots, 20 - k), comb(80, 20)) for k in range(spots + 1)]
+            esperado = sum(p * calcular_puntos(spots, k) for k, p in enumerate(exactas))
+            con_premio = sum(p for k, p in enumerate(exactas) if calcular_puntos(spots, k) > 0)
+            with self.subTest(spots=spots):
+                self.assertEqual(fila['pagos'], [calcular_puntos(spots, k) for k in range(spots + 1)])
+                self.assertAlmostEqual(fila['esperado'], float(esperado))
+                self.assertAlmostEqual(fila['prob_premio'], float(con_premio))
+
+        # 1 spot paga 3 con probabilidad 1/4; desde 6 spots se paga por
+        # acierto y se esperan spots/4 aciertos
+        por_spots = {fila['spots']: fila for fila in datos['spots']}
+        self.assertAlmostEqual(por_spots[1]['esperado'], 0.75)
+        self.assertAlmostEqual(por_spots[10]['esperado'], 50 * 10 / 4)
+        self.assertAlmostEqual(por_spots[20]['esperado'], 150 * 20 / 4)
+
+    def test_tabla_de_la_base(self):
+        TablaPagos.objects.create(version='doble-v1', pagos=tabla_de_pagos(2))
+        _, datos = self.pedir('doble-v1')
+        for fila in datos['spots']:
+            with self.subTest(spots=fila['spots']):
+                self.assertAlmostEqual(fila['esperado'], fila['spots'] / 2)
+
+    def test_version_inexistente(self):
+        with self.assertRaises(Http404):
+            self.pedir('no-existe')
+
+    def test_la_respuesta_es_inmutable(self):
+        respuesta, _ = self.pedir(VERSION_CLASICA)
+        self.assertEqual(respuesta['Content-Type'], 'application/json')
+        self.assertEqual(
+            set(respuesta['Cache-Control'].split(', ')),
+            {'public', 'max-age=31536000', 'immutable'}
         )
-        
-        # Auto-login después del registro
-        login(request, user)
-        messages.success(request, '¡Registro exitoso!')
-        return redirect('sala')
-    
-    return render(request, "register.html")
-
-@login_required
-def sala(request):
-    jugador = Jugador.objects.get(user=request.user)
-    
-    # Crear o buscar sala activa
-    sala_activa = Sala.objects.filter(activa=True, jugadores__lt=10).first()
-    
-    if not sala_activa:
-        # Crear nueva sala
-        codigo = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        sala_activa = Sala.objects.create(
-            codigo=codigo,
-            creador=jugador
+
+
+class RankingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.jugadores = crear_jugadores(5)
+        for i, jugador in enumerate(cls.jugadores):
+            # jugador4 primero, jugador0 último
+            Jugador.objects.filter(id=jugador.id).update(puntos_totales=i * 10)
+
+    def ranking(self):
+        ranking = Leaderboard()
+        version, _ = version_actual()
+        ranking.sincronizar(version)
+        return ranking
+
+    def test_aplicar_mueve_al_jugador(self):
+        ranking = self.ranking()
+        ids = [jugador.id for jugador in self.jugadores]
+        self.assertEqual(ranking.pagina(1), ids[::-1])
+        self.assertEqual(ranking.posicion(ids[0]), 5)
+
+        ranking.aplicar(1, {ids[0]: 100, ids[3]: 0})
+        self.assertEqual(ranking.posicion(ids[0]), 1)
+        self.assertEqual(ranking.posicion(ids[4]), 2)
+        self.assertEqual(ranking.pagina(1, tamano=2), [ids[0], ids[4]])
+        self.assertEqual(ranking.pagina(3, tamano=2), [ids[1]])
+        self.assertEqual(ranking.total(), 5)
+
+    def test_empate_por_id(self):
+        ranking = self.ranking()
+        ids = [jugador.id for jugador in self.jugadores]
+        ranking.aplicar(1, {ids[3]: 10})   # 40 puntos, igual que jugador4
+        self.assertEqual(ranking.pagina(1, tamano=2), [ids[3], ids[4]])
+        self.assertEqual(ranking.posicion(ids[4]), 1)
+
+    def test_ronda_salteada_o_jugador_nuevo_invalida(self):
+        ranking = self.ranking()
+        ranking.aplicar(1, {self.jugadores[0].id: 5})
+        ranking.aplicar(3, {self.jugadores[0].id: 5})   # falta la ronda 2
+        self.assertIsNone(ranking.version)
+
+        ranking = self.ranking()
+        ranking.aplicar(1, {-1: 5})
+        self.assertIsNone(ranking.version)
+
+    def test_ronda_liquidada_durante_la_carga_no_se_suma_dos_veces(self):
+        sala = Sala.objects.create(codigo='RANK01', creador=self.jugadores[0])
+        ultimo, penultimo = self.jugadores[0], self.jugadores[3]   # 0 y 30 puntos
+        # La vista lee la version y, antes de cargar el ranking, se liquida una ronda
+        version, _ = version_actual()
+        partida = guardar_ronda(sala.id, None, [1], [
+            {'nickname': ultimo.nickname, 'numeros': [1], 'aciertos': 1, 'puntos': 20},
+        ])
+
+        ranking = Leaderboard()
+        ranking.sincronizar(version)
+        self.assertIsNone(ranking.version)
+        # El on_commit de la ronda llega después: no vuelve a sumar
+        ranking.aplicar(partida.id, {ultimo.id: 20})
+        self.assertEqual(ranking.posicion(penultimo.id), 2)
+        self.assertEqual(ranking.posicion(ultimo.id), 3)
+
+        ranking.sincronizar(version_actual()[0])
+        self.assertEqual(ranking.version, version_actual()[0])
+        self.assertEqual(ranking.posicion(ultimo.id), 3)
+
+    def test_save_de_jugador_invalida_el_ranking(self):
+        version, _ = version_actual()
+        leaderboard.sincronizar(version)
+        jugador = self.jugadores[0]
+        jugador.puntos_totales = 1000
+        jugador.save()
+        self.assertIsNone(leaderboard.version)
+
+
+class ListaOrdenadaTests(SimpleTestCase):
+
+    def test_coincide_con_una_lista_ordenada(self):
+        # Suficientes valores para que los bloques se partan y se vacíen
+        azar = random.Random(7)
+        valores = azar.sample(range(10 * TAMANO_BLOQUE), 3 * TAMANO_BLOQUE)
+        lista = ListaOrdenada(valores[:TAMANO_BLOQUE])
+        referencia = sorted(valores[:TAMANO_BLOQUE])
+
+        for valor in valores[TAMANO_BLOQUE:]:
+            lista.agregar(valor)
+            referencia.append(valor)
+        referencia.sort()
+        self.assertEqual(lista.rebanada(0, len(lista)), referencia)
+
+        # Un bloque tiene a lo sumo 2 x TAMANO_BLOQUE: el primero se vacía
+        for valor in azar.sample(referencia[:2 * TAMANO_BLOQUE + 1], 2 * TAMANO_BLOQUE + 1):
+            lista.quitar(valor)
+            referencia.remove(valor)
+        self.assertEqual(len(lista), len(referencia))
+        self.assertEqual(lista.rebanada(0, len(lista)), referencia)
+        self.assertEqual(lista.rebanada(10, 20), referencia[10:20])
+        for valor in (-1, referencia[0], referencia[len(referencia) // 2], 10 ** 9):
+            self.assertEqual(lista.menores(valor), sum(1 for v in referencia if v < valor))
+
+
+class SorteoTests(SimpleTestCase):
+
+    def test_derivacion_determinista(self):
+        semilla = bytes(range(32))
+        numeros = derivar_numeros(semilla)
+        self.assertEqual(numeros, derivar_numeros(semilla))
+        self.assertEqual(len(set(numeros)), 20)
+        self.assertTrue(all(1 <= n <= 80 for n in numeros))
+        self.assertNotEqual(numeros, derivar_numeros(bytes(31) + b'\x01'))
+
+    def test_compromiso_es_sha256_de_la_semilla(self):
+        sorteo = Sorteo.nuevo()
+        self.assertEqual(sorteo.compromiso, hashlib.sha256(sorteo.semilla).hexdigest())
+        self.assertEqual(sorteo.compromiso, compromiso_de(sorteo.semilla))
+        self.assertEqual(sorteo.numeros, tuple(derivar_numeros(sorteo.semilla)))
+        self.assertEqual(Sorteo.desde_dict(sorteo.como_dict()), sorteo)
+
+
+class VerificarSorteosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        jugador, = crear_jugadores(1)
+        cls.sala = Sala.objects.create(codigo='VERI01', creador=jugador)
+
+    def guardar(self, sorteo):
+        return guardar_ronda(self.sala.id, None, list(sorteo.numeros), [], sorteo)
+
+    def verificar(self):
+        salida = io.StringIO()
+        call_command('verificar_sorteos', stdout=salida, stderr=io.StringIO())
+        return salida.getvalue()
+
+    def test_partidas_guardadas_verifican(self):
+        for _ in range(3):
+            self.guardar(Sorteo.nuevo())
+        # Sin semilla: anterior al commit-reveal, no se verifica
+        Partida.objects.create(sala=self.sala, numeros_sorteados=[1, 2], finalizada=True)
+
+        salida = self.verificar()
+        self.assertIn('Verificadas: 3', salida)
+        self.assertIn('Sin semilla (anteriores al commit-reveal): 1', salida)
+
+    def test_numeros_o_compromiso_alterados_fallan(self):
+        alterada = self.guardar(Sorteo.nuevo())
+        otro = Sorteo.nuevo()
+        alterada.numeros_sorteados = list(otro.numeros)
+        alterada.save()
+        ajena = self.guardar(Sorteo.nuevo())
+        Partida.objects.filter(id=ajena.id).update(compromiso=otro.compromiso)
+
+        with self.assertRaisesMessage(CommandError, '2 partida(s) no verifican'):
+            self.verificar()
+
+
+class HistorialTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        jugador, = crear_jugadores(1)
+        cls.sala = Sala.objects.create(codigo='HIST01', creador=jugador)
+        otra = Sala.objects.create(codigo='HIST02', creador=jugador)
+        Partida.objects.create(sala=otra, finalizada=True)
+        Partida.objects.create(sala=cls.sala, finalizada=False)
+
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        # Tres partidas con la misma fecha: desempata el id
+        fechas = [base, base + timedelta(minutes=1), base + timedelta(minutes=1),
+                  base + timedelta(minutes=1), base + timedelta(minutes=2)]
+        cls.partidas = []
+        for fecha in fechas:
+            partida = Partida.objects.create(sala=cls.sala, finalizada=True, numeros_sorteados=[1, 80])
+            Partida.objects.filter(id=partida.id).update(fecha_inicio=fecha)
+            cls.partidas.append(partida.id)
+
+    def test_cursor_ida_y_vuelta(self):
+        fecha = datetime(2026, 3, 4, 5, 6, 7, 890000, tzinfo=timezone.utc)
+        self.assertEqual(decodificar_cursor(codificar_cursor(fecha, 42)), (fecha, 42))
+
+    def test_cursor_invalido(self):
+        for cursor in ('', 'no-es-base64!', codificar_cursor(datetime(2026, 1, 1), 1)[:-4], 'MjAyNnwx'):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(CursorInvalido):
+                    decodificar_cursor(cursor)
+
+    def test_paginas_recorren_todo_sin_repetir(self):
+        vistas = []
+        cursor = None
+        paginas = 0
+        while True:
+            filas, cursor = pagina_partidas(self.sala.id, cursor, limite=2)
+            vistas.extend(fila['partida'] for fila in filas)
+            paginas += 1
+            if cursor is None:
+                break
+
+        # De la más nueva a la más vieja; empates por id descendente
+        esperado = [self.partidas[4], self.partidas[3], self.partidas[2], self.partidas[1], self.partidas[0]]
+        self.assertEqual(vistas, esperado)
+        self.assertEqual(paginas, 3)
+
+    def test_pagina_cuesta_una_consulta(self):
+        _, cursor = pagina_partidas(self.sala.id, limite=2)
+        with self.assertNumQueries(1):
+            filas, _ = pagina_partidas(self.sala.id, cursor, limite=2)
+        self.assertEqual(filas[0]['numeros_sorteados'], [1, 80])
+
+
+class MascarasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        jugador, = crear_jugadores(1)
+        sala = Sala.objects.create(codigo='MASC01', creador=jugador)
+        partida = Partida.objects.create(sala=sala, numeros_sorteados=list(range(1, 21)))
+        # Números a ambos lados del corte de 40 bits
+        cls.apuestas = {
+            nombre: Apuesta.objects.create(partida=partida, jugador=jugador, numeros_elegidos=numeros).id
+            for nombre, numeros in {
+                'bajos': [1, 17, 40],
+                'altos': [41, 63, 80],
+                'mixta': [17, 40, 41, 80],
+            }.items()
+        }
+
+    def ids(self, consulta):
+        return {nombre for nombre, id in self.apuestas.items() if consulta.filter(id=id).exists()}
+
+    def test_lectura_y_escritura_de_la_lista(self):
+        apuesta = Apuesta.objects.get(id=self.apuestas['mixta'])
+        self.assertEqual(apuesta.numeros_elegidos, [17, 40, 41, 80])
+        self.assertEqual((apuesta.elegidos_bajos, apuesta.elegidos_altos), ((1 << 16) | (1 << 39), 1 | (1 << 39)))
+
+    def test_con_numero(self):
+        self.assertEqual(self.ids(Apuesta.objects.con_numero(40)), {'bajos', 'mixta'})
+        self.assertEqual(self.ids(Apuesta.objects.con_numero(41)), {'altos', 'mixta'})
+        self.assertEqual(self.ids(Apuesta.objects.con_numero(2)), set())
+
+    def test_con_todos(self):
+        self.assertEqual(self.ids(Apuesta.objects.con_todos([17, 80])), {'mixta'})
+        self.assertEqual(self.ids(Apuesta.objects.con_todos([41, 80])), {'altos', 'mixta'})
+        self.assertEqual(self.ids(Apuesta.objects.con_todos([1, 63])), set())
+
+    def test_con_alguno(self):
+        self.assertEqual(self.ids(Apuesta.objects.con_alguno([1, 63])), {'bajos', 'altos'})
+        self.assertEqual(self.ids(Apuesta.objects.con_alguno([2, 3])), set())
+        self.assertEqual(self.ids(Apuesta.objects.con_alguno([])), set())
+        self.assertEqual(Partida.objects.con_todos([1, 20]).count(), 1)
+
+
+class MigracionMascarasTests(TransactionTestCase):
+    # 0006 pasa las listas JSON a las columnas de máscara y vuelve atrás
+    antes = [('keno', '0005_indice_historial')]
+    despues = [('keno', '0006_numeros_como_mascaras')]
+
+    def migrar(self, destino):
+        executor = MigrationExecutor(connection)
+        executor.migrate(destino)
+        executor.loader.build_graph()
+        return executor.loader.project_state(destino).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_listas_a_mascaras_y_vuelta(self):
+        apps = self.migrar(self.antes)
+        user = apps.get_model('auth', 'User').objects.create(username='migracion')
+        jugador = apps.get_model('keno', 'Jugador').objects.create(user=user, nickname='migracion')
+        sala = apps.get_model('keno', 'Sala').objects.create(codigo='MIGR01', creador=jugador)
+        partida = apps.get_model('keno', 'Partida').objects.create(sala=sala, numeros_sorteados=[80, 3, 41, 40])
+        apps.get_model('keno', 'Apuesta').objects.create(partida=partida, jugador=jugador, numeros_elegidos=[41, 2])
+        # Filas viejas con basura: se ignora lo que no es un número válido
+        apps.get_model('keno', 'Partida').objects.create(sala=sala, numeros_sorteados=[0, 81, 'x', 5])
+
+        apps = self.migrar(self.despues)
+        filas = list(apps.get_model('keno', 'Partida').objects.order_by('id').values_list('sorteados_bajos', 'sorteados_altos'))
+        self.assertEqual(filas, [((1 << 2) | (1 << 39), 1 | (1 << 39)), (1 << 4, 0)])
+        apuesta = apps.get_model('keno', 'Apuesta').objects.values_list('elegidos_bajos', 'elegidos_altos').get()
+        self.assertEqual(apuesta, (1 << 1, 1))
+
+        # Hacia atrás la lista vuelve ordenada: el orden de salida se perdió
+        apps = self.migrar(self.antes)
+        numeros = list(apps.get_model('keno', 'Partida').objects.order_by('id').values_list('numeros_sorteados', flat=True))
+        self.assertEqual(numeros, [[3, 40, 41, 80], [5]])
+
+
+@mock.patch('keno.estadisticas.VENTANAS', (('ultimos_100', 2), ('ultimos_1000', 3)))
+class EstadisticasTests(TestCase):
+    # Ventanas chicas (2 y 3 sorteos) para verlas salir sin cientos de rondas
+
+    @classmethod
+    def setUpTestData(cls):
+        jugador, = crear_jugadores(1)
+        cls.sala = Sala.objects.create(codigo='ESTA01', creador=jugador)
+
+    def test_ventanas_suman_y_restan(self):
+        azar = random.Random(3)
+        sorteos = [[1, 2, 3], [3, 4, 80], [1, 4, 5]] + [azar.sample(range(1, 81), 20) for _ in range(5)]
+        base = sorteos_contados()
+
+        for i, numeros in enumerate(sorteos, 1):
+            guardar_ronda(self.sala.id, None, numeros, [])
+
+            filas = {fila.numero: fila for fila in EstadisticaNumero.objects.all()}
+            self.assertEqual(filas[0].veces, base + i)
+            for n in range(1, 81):
+                with self.subTest(sorteo=i, numero=n):
+                    fila = filas[n]
+                    self.assertEqual(fila.veces, sum(n in s for s in sorteos[:i]))
+                    self.assertEqual(fila.ultimos_100, sum(n in s for s in sorteos[max(0, i - 2):i]))
+                    self.assertEqual(fila.ultimos_1000, sum(n in s for s in sorteos[max(0, i - 3):i]))
+                    salidas = [j for j, s in enumerate(sorteos[:i], 1) if n in s]
+                    self.assertEqual(fila.ultimo_sorteo, base + salidas[-1] if salidas else 0)
+
+    def test_tablero_en_memoria_sigue_a_la_base(self):
+        tablero.json(sorteos_contados())
+        for numeros in ([1, 2, 3], [3, 4, 80], [1, 4, 5], [6]):
+            with self.captureOnCommitCallbacks(execute=True):
+                guardar_ronda(self.sala.id, None, numeros, [])
+            # Aplicado en orden: no hizo falta recargar
+            self.assertEqual(tablero.sorteos, sorteos_contados())
+
+        recargado = TableroNumeros()
+        self.assertEqual(tablero.json(sorteos_contados()), recargado.json(sorteos_contados()))
+
+
+
+@mock.patch('keno.historial.CHUNK_EXPORTACION', 2)
+class ExportacionTests(TestCase):
+    # Pedido ASGI, como en producción: el cuerpo llega por bloques
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.jugadores = crear_jugadores(2)
+        cls.sala = Sala.objects.create(codigo='EXPO01', creador=cls.jugadores[0])
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        for i in range(3):
+            guardar_ronda(cls.sala.id, None, list(range(1, 21)), [
+                {'nickname': jugador.nickname, 'numeros': [i + 1, 41], 'aciertos': 1, 'puntos': 10 * i}
+                for jugador in cls.jugadores
+            ], fecha=base + timedelta(hours=i))
+
+    async def exportar(self, vista, url, *args):
+        pedido = AsyncRequestFactory().get(url)
+        pedido.user = self.jugadores[0].user
+        respuesta = await sync_to_async(vista)(pedido, *args)
+        self.assertTrue(respuesta.streaming)
+        self.assertTrue(respuesta.is_async)
+        bloques = [bloque async for bloque in respuesta.streaming_content]
+        return respuesta, bloques
+
+    async def test_csv_de_la_sala(self):
+        respuesta, bloques = await self.exportar(views.exportar_sala, f'/historial/sala/{self.sala.id}/exportar/', self.sala.id)
+
+        self.assertEqual(respuesta['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(respuesta['Content-Disposition'], 'attachment; filename="apuestas_sala_EXPO01.csv"')
+        # Encabezado y tres bloques de dos filas
+        self.assertEqual(len(bloques), 4)
+        filas = list(csv.reader(io.StringIO(b''.join(bloques).decode())))
+        self.assertEqual(filas[0], ['partida', 'fecha', 'sala', 'jugador', 'numeros_elegidos',
+                                    'numeros_sorteados', 'aciertos', 'puntos', 'tabla_pagos'])
+        self.assertEqual(len(filas), 7)
+        self.assertEqual(filas[1][1:7], ['2026-01-01T00:00:00+00:00', 'EXPO01', 'jugador0', '1 41',
+                                         ' '.join(map(str, range(1, 21))), '1'])
+        self.assertEqual([fila[7] for fila in filas[1:]], ['0', '0', '10', '10', '20', '20'])
+
+    async def test_ndjson_del_jugador(self):
+        respuesta, bloques = await self.exportar(
+            views.exportar_jugador, '/historial/jugador/jugador1/exportar/?formato=ndjson', 'jugador1'
         )
-    
-    # Agregar jugador a la sala si no está
-    if jugador not in sala_activa.jugadores.all():
-        sala_activa.jugadores.add(jugador)
-    
-    context = {
-        'jugador': jugador,
-        'sala': sala_activa,
-        'url_invitacion': request.build_absolute_uri() + f"?sala={sala_activa.codigo}"
+
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(respuesta['Content-Disposition'], f'attachment; filename="apuestas_{self.jugadores[1].id}.ndjson"')
+        self.assertEqual(len(bloques), 2)
+        filas = [json.loads(linea) for linea in b''.join(bloques).decode().splitlines()]
+        self.assertEqual([fila['numeros_elegidos'] for fila in filas], [[1, 41], [2, 41], [3, 41]])
+        self.assertEqual({fila['jugador'] for fila in filas}, {'jugador1'})
+        self.assertIsNone(filas[0]['tabla_pagos'])
+
+
+def entrada_diario(sala, jugadores, sorteo=None):
+    # Misma forma que Diario.anotar
+    sorteo = sorteo or Sorteo.nuevo()
+    return {
+        'sala': sala.id,
+        'tabla': None,
+        'numeros': list(sorteo.numeros),
+        'resultados': resultados_de(jugadores),
+        'sorteo': sorteo.como_dict(),
     }
-    
-    return render(request, "sala.html", context)
 
-@login_required
-def inicio(request):
-    return render(request, "inicio.html")
 
-def logout_view(request):
-    logout(request)
-    return redirect('index')
\ No newline at end of file
+class GuardarLoteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.jugadores = crear_jugadores(3)
+        cls.sala = Sala.objects.create(codigo='LOTE01', creador=cls.jugadores[0])
+
+    def test_reaplicar_no_duplica(self):
+        entradas = [entrada_diario(self.sala, self.jugadores) for _ in range(3)]
+        self.assertEqual(guardar_lote(entradas), 3)
+        puntos = list(Jugador.objects.order_by('id').values_list('puntos_totales', flat=True))
+
+        # Caída entre el volcado y el truncado: el diario se reaplica entero
+        self.assertEqual(guardar_lote(entradas + [entrada_diario(self.sala, self.jugadores)]), 1)
+        self.assertEqual(Partida.objects.count(), 4)
+        self.assertEqual(Apuesta.objects.count(), 12)
+        self.assertEqual(
+            list(Jugador.objects.order_by('id').values_list('puntos_totales', flat=True)),
+            [p * 4 // 3 for p in puntos]
+        )
+
+    def test_entrada_repetida_en_el_lote(self):
+        entrada = entrada_diario(self.sala, self.jugadores)
+        self.assertEqual(guardar_lote([entrada, entrada]), 1)
+        self.assertEqual(Partida.objects.filter(compromiso=entrada['sorteo']['compromiso']).count(), 1)
+
+    def test_la_partida_toma_la_hora_del_sorteo(self):
+        sorteada = datetime(2026, 1, 1, 12, 30, tzinfo=timezone.utc)
+        entrada = entrada_diario(self.sala, self.jugadores)
+        entrada['fecha'] = sorteada.isoformat()
+        # Entrada anterior a la fecha en el diario: toma la hora del volcado
+        vieja = entrada_diario(self.sala, self.jugadores)
+        guardar_lote([entrada, vieja])
+
+        self.assertEqual(Partida.objects.get(compromiso=entrada['sorteo']['compromiso']).fecha_inicio, sorteada)
+        self.assertGreater(Partida.objects.get(compromiso=vieja['sorteo']['compromiso']).fecha_inicio, sorteada)
+
+    def test_sala_borrada_se_salta(self):
+        entrada = entrada_diario(self.sala, self.jugadores)
+        entrada['sala'] = self.sala.id + 1000
+        with self.assertLogs('keno', 'ERROR'):
+            self.assertEqual(guardar_lote([entrada, entrada_diario(self.sala, self.jugadores)]), 1)
+
+
+class RecuperarDiarioTests(TransactionTestCase):
+    # El volcado va por la cola de escritura (otro hilo, otra conexión):
+    # necesita datos confirmados
+
+    def setUp(self):
+        self.jugadores = crear_jugadores(2)
+        self.sala = Sala.objects.create(codigo='DIAR01', creador=self.jugadores[0])
+        self.directorio = tempfile.mkdtemp()
+
+    def escribir_huerfano(self, nombre, entradas, cola=b''):
+        with open(os.path.join(self.directorio, nombre), 'wb') as archivo:
+            for entrada in entradas:
+                archivo.write(json.dumps(entrada).encode() + b'\n')
+            archivo.write(cola)
+
+    def test_huerfanos_se_reaplican_una_vez(self):
+        guardada = entrada_diario(self.sala, self.jugadores)
+        guardar_lote([guardada])
+        nuevas = [entrada_diario(self.sala, self.jugadores) for _ in range(2)]
+        # Dos procesos caídos anotaron rondas que se solapan; la última
+        # línea quedó a medio escribir
+        self.escribir_huerfano('diario-1-aaaa.jsonl', [guardada, nuevas[0]])
+        self.escribir_huerfano('diario-2-bbbb.jsonl', nuevas, cola=b'{"sala": ')
+
+        with self.assertLogs('keno') as registro:
+            aplicadas = async_to_sync(Diario(self.directorio).recuperar)()
+        self.assertIn('Línea 3 ilegible', '\n'.join(registro.output))
+
+        self.assertEqual(aplicadas, 2)
+        self.assertEqual(Partida.objects.count(), 3)
+        self.assertEqual(os.listdir(self.directorio), [])
+        self.assertEqual(async_to_sync(Diario(self.directorio).recuperar)(), 0)
+
+    def test_el_volcado_conserva_la_hora_del_sorteo(self):
+        sorteo = Sorteo.nuevo()
+        sorteada = datetime(2026, 2, 3, 4, 5, 6, tzinfo=timezone.utc)
+        diario_propio = Diario(self.directorio)
+
+        async def anotar():
+            await diario_propio.anotar(
+                self.sala.id, None, list(sorteo.numeros), resultados_de(self.jugadores), sorteo, sorteada
+            )
+            await diario_propio.esperar()
+
+        async_to_sync(anotar)()
+        self.assertEqual(Partida.objects.get(compromiso=sorteo.compromiso).fecha_inicio, sorteada)
+
+
+class CubetaTests(SimpleTestCase):
+
+    def test_rafaga_y_recarga(self):
+        cubeta = Cubeta(3, 2.0)
+        self.assertEqual([cubeta.tomar() for _ in range(4)], [True, True, True, False])
+        self.assertFalse(cubeta.tomar())
+        self.assertEqual(cubeta.rechazos, 2)
+
+        # Medio segundo a 2 fichas por segundo: una ficha
+        cubeta.ultimo -= 0.5
+        self.assertTrue(cubeta.tomar())
+        self.assertEqual(cubeta.rechazos, 0)
+        self.assertFalse(cubeta.tomar())
+
+    def test_no_acumula_mas_que_la_rafaga(self):
+        cubeta = Cubeta(2, 1.0)
+        cubeta.ultimo -= 60
+        self.assertEqual([cubeta.tomar() for _ in range(3)], [True, True, False])
+
+
+class ConsumidorDePrueba(ConsumidorRegulado):
+    tipos_cliente = frozenset({'jugar'})
+    limites = {'jugar': (2, 0.001)}
+
+    def __init__(self):
+        self.cubetas = {}
+        self.recibidos = []
+        self.enviados = []
+
+    async def recibir(self, data):
+        self.recibidos.append(data)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        self.recibidos.append(bytes_data)
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.enviados.append(json.loads(text_data))
+
+
+class ConsumidorReguladoTests(SimpleTestCase):
+
+    def recibir(self, consumidor, *mensajes):
+        async def recibir():
+            for mensaje in mensajes:
+                await consumidor.websocket_receive(mensaje)
+        async_to_sync(recibir)()
+
+    def test_la_cubeta_es_la_del_tipo_parseado(self):
+        consumidor = ConsumidorDePrueba()
+        # Espacios delante o claves repetidas no cambian de cubeta
+        self.recibir(
+            consumidor,
+            {'text': '{"type": "jugar", "n": 1}'},
+            {'text': ' {"type": "jugar", "n": 2}'},
+            {'text': '{"type": "otro", "type": "jugar", "n": 3}'},
+            {'text': '{"type": "jugar", "n": 4}'},
+        )
+        self.assertEqual([data['n'] for data in consumidor.recibidos], [1, 2])
+        self.assertEqual(len(consumidor.enviados), 1)
+        self.assertEqual(consumidor.enviados[0]['type'], 'error')
+
+    def test_tipos_desconocidos_no_llegan(self):
+        consumidor = ConsumidorDePrueba()
+        self.recibir(
+            consumidor,
+            {'text': '{"type": "inventado"}'},
+            {'text': 'no es json'},
+            {'text': '[1, 2]'},
+            {'bytes': b'\x01\x02'},
+        )
+        self.assertEqual(consumidor.recibidos, [b'\x01\x02'])
+        self.assertEqual(set(consumidor.cubetas), {'desconocido', 'binario'})
+
+
+class ColaSalidaTests(SimpleTestCase):
+
+    def correr(self, frames):
+        # El socket no avanza hasta que se encolaron todos los frames
+        enviados = []
+
+        async def correr():
+            liberar = asyncio.Event()
+
+            async def send(mensaje):
+                await liberar.wait()
+                enviados.append(mensaje)
+
+            cola = ColaSalida(send, 'Prueba')
+            for texto, clave in frames:
+                await cola.poner({'type': 'websocket.send', 'text': texto}, clave)
+            pendientes = len(cola)
+            liberar.set()
+            await cola.tarea
+            return pendientes, cola.cortada
+
+        pendientes, cortada = async_to_sync(correr)()
+        return pendientes, cortada, enviados
+
+    def test_sobre_la_marca_alta_el_estado_se_reemplaza(self):
+        frames = [(f'frame{i}', None) for i in range(SALIDA_ALTA)]
+        frames += [(f'estado{i}', 'estado') for i in range(5)]
+        pendientes, cortada, enviados = self.correr(frames)
+
+        self.assertEqual(pendientes, SALIDA_ALTA + 1)
+        self.assertFalse(cortada)
+        self.assertEqual([m['text'] for m in enviados][-2:], [f'frame{SALIDA_ALTA - 1}', 'estado4'])
+
+    def test_bajo_la_marca_alta_no_se_reemplaza(self):
+        _, _, enviados = self.correr([('estado0', 'estado'), ('estado1', 'estado')])
+        self.assertEqual([m['text'] for m in enviados], ['estado0', 'estado1'])
+
+    def test_cola_llena_cierra_la_conexion(self):
+        frames = [(f'frame{i}', None) for i in range(SALIDA_MAXIMA + 10)]
+        _, cortada, enviados = self.correr(frames)
+
+        self.assertTrue(cortada)
+        self.assertEqual(enviados, [{'type': 'websocket.close', 'code': CIERRE_LENTO}])
+
+
+class ColaEscrituraTests(TransactionTestCase):
+    # El hilo escritor usa su propia conexión: hacen falta datos confirmados
+
+    def setUp(self):
+        jugador, = crear_jugadores(1)
+        self.sala = Sala.objects.create(codigo='COLA01', creador=jugador)
+        self.cola = ColaEscritura()
+
+    def partida(self, sala_id=None):
+        return Partida.objects.create(sala_id=sala_id or self.sala.id, compromiso=Sorteo.nuevo().compromiso).id
+
+    def fallar(self):
+        self.partida()
+        raise ValueError('falla a mitad del trabajo')
+
+    def estado_del_hilo(self):
+        return threading.current_thread().name, connection.in_atomic_block
+
+    def en_lote(self, *trabajos):
+        # El primer trabajo frena al escritor hasta que los demás están en
+        # la cola: salen todos juntos en el lote siguiente
+        liberar = threading.Event()
+
+        async def correr():
+            frenar = asyncio.ensure_future(self.cola.ejecutar(liberar.wait))
+            await asyncio.sleep(0.05)
+            pendientes = [asyncio.ensure_future(self.cola.ejecutar(trabajo)) for trabajo in trabajos]
+            await asyncio.sleep(0)
+            liberar.set()
+            await frenar
+            return await asyncio.gather(*pendientes, return_exceptions=True)
+
+        return async_to_sync(correr)()
+
+    def test_un_trabajo_que_falla_no_deshace_el_lote(self):
+        con_lote = []
+        resultados = self.en_lote(
+            self.partida,
+            self.fallar,
+            self.partida,
+            lambda: con_lote.append(self.estado_del_hilo()),
+        )
+
+        self.assertIsInstance(resultados[1], ValueError)
+        self.assertEqual(set(Partida.objects.values_list('id', flat=True)), {resultados[0], resultados[2]})
+        # Corre en el hilo escritor, dentro de la transacción del lote
+        self.assertEqual(con_lote, [('keno-escritor', True)])
+
+    def test_commit_fallido_repite_de_a_uno(self):
+        # La FK de SQLite es diferida: la sala inexistente falla en el COMMIT
+        with self.assertLogs('keno', 'ERROR'):
+            resultados = self.en_lote(self.partida, lambda: self.partida(sala_id=self.sala.id + 1000), self.partida)
+
+        self.assertIsInstance(resultados[1], IntegrityError)
+        self.assertEqual(set(Partida.objects.values_list('id', flat=True)), {resultados[0], resultados[2]})
+
+    @override_settings(KENO_COLA_ESCRITURA=False)
+    def test_sin_cola_va_por_el_executor(self):
+        nombre, en_transaccion = async_to_sync(self.cola.ejecutar)(self.estado_del_hilo)
+        self.assertNotEqual(nombre, 'keno-escritor')
+        self.assertFalse(en_transaccion)
+        self.assertIsNone(self.cola._hilo)
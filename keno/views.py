@@ -1,9 +1,20 @@
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Jugador, Sala
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from . import historial
+from .estadisticas import sorteos_contados, tablero
+from .metricas import exponer, registrar_error
+from .models import Jugador, Sala, TablaPagos
+from .pagos import TABLA_CLASICA, compilar, tabla_para_sala
+from .probabilidades import tabla_probabilidades
+from .ranking import TAMANO_PAGINA, filas_pagina, leaderboard, version_actual
+import hmac
 import random
 import string
 
@@ -112,29 +123,151 @@ def sala(request):
         return render(request, "sala.html", context)
         
     except Exception as e:
-        print(f"Error en sala: {e}")
+        registrar_error('vista_sala', 'Error en sala')
         messages.error(request, f'Error: {str(e)}')
         return redirect('index')
 
 @login_required
 def inicio(request):
-    return render(request, "inicio.html")
+    # Cada sala juega su propia ronda: el juego se conecta a ws/game/<sala_id>/
+    sala_id = request.GET.get('sala', '')
+    if sala_id.isdigit():
+        sala_juego = Sala.objects.select_related('tabla_pagos').filter(id=int(sala_id)).first()
+    else:
+        sala_juego = Sala.objects.select_related('tabla_pagos').filter(activa=True).first()
+
+    if not sala_juego:
+        return redirect('sala')
+
+    # La URL de probabilidades lleva la version de la tabla: se cachea para siempre
+    return render(request, "inicio.html", {
+        'sala': sala_juego,
+        'tabla_version': tabla_para_sala(sala_juego).version,
+    })
+
+@cache_control(public=True, max_age=31536000, immutable=True)
+def probabilidades(request, version):
+    # Una tabla de pagos no cambia una vez creada, así que su respuesta tampoco
+    modelo = TablaPagos.objects.filter(version=version).first()
+    if modelo is not None:
+        tabla = compilar(modelo)
+    elif version == TABLA_CLASICA.version:
+        tabla = TABLA_CLASICA
+    else:
+        raise Http404('Tabla de pagos inexistente')
+    return HttpResponse(tabla_probabilidades(tabla), content_type='application/json')
+
+def _sorteos_contados(request):
+    if not hasattr(request, '_sorteos_contados'):
+        request._sorteos_contados = sorteos_contados()
+    return request._sorteos_contados
+
+@condition(etag_func=lambda request: f'sorteos-{_sorteos_contados(request)}')
+def estadisticas(request):
+    # Cambia solo cuando se liquida un sorteo: el ETag es el total de sorteos
+    return HttpResponse(tablero.json(_sorteos_contados(request)), content_type='application/json')
+
+def _version_ranking(request):
+    # Se consulta una sola vez por request (ETag y Last-Modified)
+    if not hasattr(request, '_version_ranking'):
+        request._version_ranking = version_actual()
+    return request._version_ranking
+
+def _pagina_ranking(request):
+    pagina = request.GET.get('pagina', '1')
+    return int(pagina) if pagina.isdigit() and int(pagina) > 0 else 1
+
+def _etag_ranking(request):
+    (ultima_partida, ultimo_jugador), _ = _version_ranking(request)
+    return f'{ultima_partida}-{ultimo_jugador}-{_pagina_ranking(request)}-{request.user.id}'
+
+def _last_modified_ranking(request):
+    return _version_ranking(request)[1]
 
 @login_required
+@condition(etag_func=_etag_ranking, last_modified_func=_last_modified_ranking)
 def ranking(request):
-    jugadores = Jugador.objects.all().order_by('-puntos_totales')
-    
-    for jugador in jugadores:
-        if jugador.partidas_jugadas > 0:
-            jugador.promedio = jugador.puntos_totales / jugador.partidas_jugadas
-        else:
-            jugador.promedio = 0
+    version, _ = _version_ranking(request)
+    leaderboard.sincronizar(version)
+
+    pagina = _pagina_ranking(request)
+    jugadores = filas_pagina(leaderboard.pagina(pagina))
+    inicio = (pagina - 1) * TAMANO_PAGINA
+    for indice, jugador in enumerate(jugadores, start=1):
+        jugador.posicion = inicio + indice
+
+    mi_jugador = Jugador.objects.filter(user=request.user).values_list('id', flat=True).first()
+    total = leaderboard.total()
     
     context = {
-        'ranking': jugadores
+        'ranking': jugadores,
+        'pagina': pagina,
+        'pagina_anterior': pagina - 1 if pagina > 1 else None,
+        'pagina_siguiente': pagina + 1 if inicio + TAMANO_PAGINA < total else None,
+        'mi_posicion': leaderboard.posicion(mi_jugador) if mi_jugador else None,
     }
     return render(request, "ranking.html", context)
 
+def _limite_historial(request):
+    limite = request.GET.get('limite', '')
+    if not limite.isdigit():
+        return historial.TAMANO_PAGINA
+    return max(1, min(int(limite), historial.MAX_PAGINA))
+
+def _pagina_historial(request, funcion, *args):
+    try:
+        filas, siguiente = funcion(*args, request.GET.get('cursor'), _limite_historial(request))
+    except historial.CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'resultados': filas, 'siguiente': siguiente})
+
+def _exportar_historial(request, apuestas, nombre):
+    # Los exportadores son generadores asíncronos (ver historial.py): con
+    # ASGI cada bloque sale apenas se lee su chunk de la consulta
+    if request.GET.get('formato') == 'ndjson':
+        respuesta = StreamingHttpResponse(historial.exportar_ndjson(apuestas), content_type='application/x-ndjson')
+        extension = 'ndjson'
+    else:
+        respuesta = StreamingHttpResponse(historial.exportar_csv(apuestas), content_type='text/csv; charset=utf-8')
+        extension = 'csv'
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}.{extension}"'
+    return respuesta
+
+@login_required
+def historial_jugador(request, nickname):
+    jugador = get_object_or_404(Jugador, nickname=nickname)
+    return _pagina_historial(request, historial.pagina_apuestas, historial.apuestas_de_jugador(jugador.id))
+
+@login_required
+def historial_sala(request, sala_id):
+    sala = get_object_or_404(Sala, id=sala_id)
+    return _pagina_historial(request, historial.pagina_partidas, sala.id)
+
+@login_required
+def exportar_jugador(request, nickname):
+    jugador = get_object_or_404(Jugador, nickname=nickname)
+    return _exportar_historial(request, historial.apuestas_de_jugador(jugador.id), f'apuestas_{jugador.id}')
+
+@login_required
+def exportar_sala(request, sala_id):
+    sala = get_object_or_404(Sala, id=sala_id)
+    return _exportar_historial(request, historial.apuestas_de_sala(sala.id), f'apuestas_sala_{sala.codigo}')
+
 def logout_view(request):
     logout(request)
-    return redirect('index')
\ No newline at end of file
+    return redirect('index')
+
+def _puede_ver_metricas(request):
+    # Staff con sesión, o el scraper con Authorization: Bearer <KENO_METRICS_TOKEN>
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = settings.KENO_METRICS_TOKEN
+    cabecera = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(cabecera.encode(), f'Bearer {token}'.encode())
+
+
+def metricas(request):
+    # Formato de texto de Prometheus; métricas de este proceso
+    if not _puede_ver_metricas(request):
+        return HttpResponseForbidden()
+    return HttpResponse(exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -6,6 +6,10 @@ echo "Starting Keno application..."
 echo "Running migrations..."
 python manage.py migrate --noinput
 
+# Rondas anotadas en el diario que no llegaron a la base antes del reinicio
+echo "Replaying settlement journal..."
+python manage.py aplicar_diario
+
 # Recolectar archivos estáticos
 echo "Collecting static files..."
 python manage.py collectstatic --noinput --clear
@@ -13,7 +17,10 @@ python manage.py collectstatic --noinput --clear
 # Obtener puerto de Azure (o usar 8000 por defecto)
 PORT="${PORT:-8000}"
 
-echo "Starting Daphne server on port $PORT..."
+echo "Starting Uvicorn server on port $PORT..."
 
-# Iniciar servidor con Daphne
-daphne -b 0.0.0.0 -p $PORT config.asgi:application
\ No newline at end of file
+# Iniciar servidor con Uvicorn. Con --ws websockets el send de un frame
+# espera a que el socket drene: el control de flujo de salida (ver
+# keno/flujo.py) ve el atraso de cada cliente. Daphne acepta todo sin
+# esperar y ese control nunca se activaría. Django no implementa lifespan.
+uvicorn config.asgi:application --host 0.0.0.0 --port $PORT --ws websockets --lifespan off
\ No newline at end of file